@@ -1,32 +1,92 @@
+import uuid
+from concurrent.futures import CancelledError
+
 import streamlit as st
 import dart_fss as dart
 import pandas as pd
 import OpenDartReader
-from statement_helper import yearly_company_performance, quarterly_company_performance
-
-corps_loaded = False
-
-
-def load_corps():
-    corp_list = dart.get_corp_list()
-    return corp_list
+from cache_helper import cached_opendart
+from corp_helper import DEFAULT_MAX_AGE, load_corp_index
+from display_helper import format_sheet
+from policy_helper import FetchPolicy, QuotaExhausted, set_policy
+from profile_helper import profiler
+from quant_helper import QuantSnapshots, INDUSTRY_COLUMN
+from result_helper import get_result_cache, get_warmer, performance_jobs, result_key
+from statement_helper import collect_sheet, yearly_company_performance_stream, quarterly_company_performance_stream
+
+
+STREAM_FUNCTIONS = {'yearly': yearly_company_performance_stream,
+                    'quarterly': quarterly_company_performance_stream}
+
+
+def show_performance(company, start, end, mode, opendart):
+    """
+    다른 세션이나 미리 계산한 결과가 있으면 바로, 없으면 받는 대로 표를 채워가며 보여줌
+    """
+    results = get_result_cache()
+    key = result_key(company.corp_code, start, end, mode)
+    placeholder = st.empty()
+
+    sheet = results.get(key)
+    while sheet is None:
+        flight = results.begin(key)
+        if flight is not None:
+            # 미리 계산 중이거나 다른 세션이 계산 중이면 그 결과를 기다림
+            try:
+                with st.spinner('Loading...'):
+                    sheet = flight.result()
+            except CancelledError:  # 계산하던 세션이 중단됨
+                continue
+            break
+
+        # 이 세션이 계산하는 동안 미리 계산이나 다른 세션은 새로 계산하지 않고 기다림
+        parts = []
+        try:
+            with st.spinner('Loading...'):
+                for part in STREAM_FUNCTIONS[mode](company, start, end, opendart):
+                    parts.append(part)
+                    placeholder.write(format_sheet(collect_sheet(parts)))
+            sheet = collect_sheet(parts)
+        except BaseException as e:
+            results.finish(key, error=e)
+            raise
+        results.finish(key, sheet)
+        break
+
+    if not isinstance(sheet, pd.DataFrame):
+        placeholder.write(f'Can not retrieve {company.corp_name} data')
+    else:
+        placeholder.write(format_sheet(sheet))
+
+
+@st.cache_resource(ttl=DEFAULT_MAX_AGE)
+def corp_index_and_labels():
+    """
+    rerun 마다 index 를 다시 열지 않도록 세션들이 공유, 하루가 지나면 DART 의 회사 목록과 다시 비교
+    """
+    corp_index = load_corp_index()
+    return corp_index, sorted(corp_index.labels())
 
 
 def app():
 
-    global corps_loaded
     st.set_page_config(layout="wide")
 
-    quant_data = st.cache(pd.read_csv)('./data/quant-20212Q.csv')
-    all_category = quant_data['업종 (대)'].unique()
+    # csv 는 한번만 parquet 으로 변환되고, 업종별 조회는 미리 만든 index 로
+    snapshots = st.cache_resource(QuantSnapshots)()
+    snapshot_names = snapshots.names()
+    selected_snapshot = st.sidebar.selectbox('quant 데이터', snapshot_names, index=len(snapshot_names) - 1)
+    snapshot = snapshots.get(selected_snapshot)
+
+    selected_category = st.sidebar.selectbox('업종선택(2021.1Q) 적자순', snapshot.industries_by_rows())
+    st.write(snapshot.in_industry(selected_category))
 
-    selected_category = st.sidebar.selectbox('업종선택(2021.1Q) 적자순', all_category)
-    filtered_qdf = quant_data.loc[quant_data['업종 (대)'] == selected_category]
-    st.write(filtered_qdf)
+    previous = snapshot_names[:snapshot_names.index(selected_snapshot)]
+    if len(previous) > 0 and st.sidebar.checkbox('이전 quant 데이터와 비교'):
+        compared = snapshots.compare(previous[-1], selected_snapshot)
+        st.write(compared[compared[INDUSTRY_COLUMN] == selected_category])
 
-    f_name = filtered_qdf['회사명'].to_list()
-    f_code = [e[1:] for e in filtered_qdf['코드 번호'].to_list()]
-    filtered_name_code = [f'{x} : {y}' for x, y in zip(f_name, f_code)]
+    filtered_name_code = snapshot.labels(selected_category)
 
     # Open DART API KEY 설정
     #api_key = st.text_input("Enter Dart api key")
@@ -35,20 +95,17 @@ def app():
     api_key = st.secrets["api_key"]
 
     if len(api_key) > 0:
-        opendart = OpenDartReader(api_key)
+        # 화면에서는 이용한도가 초기화될 때까지 기다리지 않고 바로 알림
+        set_policy(FetchPolicy(on_quota='raise'))
+        opendart = cached_opendart(OpenDartReader(api_key))
         dart.set_api_key(api_key=api_key)
 
-        if not corps_loaded:
-            with st.spinner('Loading...'):
-                corp_list = load_corps()
-            corps_loaded = True
-
-        all_name_code = [f'{c.corp_name} : {c.stock_code}' for c in corp_list.corps
-                         if c.stock_code is not None ]
+        # 회사 목록이 바뀐 경우에만 DART 에서 다시 받아 index 를 만듦
+        corp_index, all_name_code = corp_index_and_labels()
 
         scope = st.sidebar.radio('범위', [f'{selected_category}', '전체'])
         if scope == '전체':
-            list_scope = sorted(all_name_code)
+            list_scope = all_name_code
         else:
             list_scope = filtered_name_code
 
@@ -56,7 +113,7 @@ def app():
 
         start = st.sidebar.number_input("Start year", 2015)
 
-        company = corp_list.find_by_stock_code(selected_company[-6:])
+        company = corp_index.find_by_stock_code(selected_company[-6:])
 
         naver_url = f'<a href="https://finance.naver.com/item/main.nhn?code={company.stock_code}" ' \
                     f'target="_blank" rel="noopener noreferrer">{company.corp_name} 네이버 금융링크</a>'
@@ -64,17 +121,42 @@ def app():
 
         if st.sidebar.button('년간 사업보고서'):
             st.subheader(f'{selected_company} 년간 사업보고서')
-            with st.spinner('Loading...'):
-                company_sheet = yearly_company_performance(company, start, 2021, opendart)
-            st.write(company_sheet)
+            try:
+                show_performance(company, start, 2021, 'yearly', opendart)
+            except QuotaExhausted as e:
+                st.error(f'DART 이용한도를 초과했습니다. 내일 다시 시도하세요. ({e})')
 
         if st.sidebar.button('분기별 보고서'):
             st.subheader(f'{selected_company} 분기별 보고서')
-            with st.spinner('Loading...'):
-                q_company_sheet = quarterly_company_performance(company, start, 2021, opendart)
-            st.write(q_company_sheet)
-
-
+            try:
+                show_performance(company, start, 2021, 'quarterly', opendart)
+            except QuotaExhausted as e:
+                st.error(f'DART 이용한도를 초과했습니다. 내일 다시 시도하세요. ({e})')
+
+        # 선택한 업종의 회사들을 background 에서 미리 계산, 업종을 바꾸면 이 세션이 요청한 남은 작업은 취소됨
+        # 다른 세션이 요청한 작업은 그 세션이 거둘 때까지 유지
+        warmer = get_warmer()
+        session = st.session_state.setdefault('warmer_session', uuid.uuid4().hex)
+        if st.sidebar.checkbox(f'{selected_category} 미리 계산'):
+            companies = [corp_index.find_by_stock_code(code) for code in snapshot.stock_codes(selected_category)]
+            companies = [c for c in companies if c is not None]
+            jobs = performance_jobs(companies, start, 2021, 'yearly', opendart)
+            jobs.update(performance_jobs(companies, start, 2021, 'quarterly', opendart))
+            warmer.warm(jobs, session)
+        else:
+            warmer.warm({}, session)
+        st.sidebar.write(f'미리 계산 대기 {warmer.pending()}건, 보관 {len(get_result_cache())}건')
+
+        # 단계별 시간, 요청수, 캐시 hit, 이용한도 사용량
+        if st.sidebar.checkbox('성능 정보'):
+            report = profiler.report()
+            st.sidebar.write(f"DART 요청 {report['quota']['used']:,}건 / 하루 {report['quota']['limit']:,}건")
+            if len(report['stages']) > 0:
+                st.sidebar.dataframe(pd.DataFrame(report['stages']).T.sort_values('seconds', ascending=False))
+            if len(report['cache']) > 0:
+                st.sidebar.dataframe(pd.DataFrame(report['cache']).T)
+            if st.sidebar.button('초기화'):
+                profiler.reset()
 
 
 
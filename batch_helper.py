@@ -0,0 +1,197 @@
+import argparse
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import dart_fss as dart
+import OpenDartReader
+import pandas as pd
+
+from cache_helper import cached_opendart
+from multi_helper import multi_labels, prefetch_to_store
+from policy_helper import QuotaExhausted
+from profile_helper import write_report
+from quant_helper import load_snapshot
+from result_helper import PERFORMANCE_FUNCTIONS
+from statement_helper import get_accounts
+from store_helper import get_store
+
+
+QUANT_DATA_PATH = './data/quant-20212Q.csv'
+DEFAULT_CHECKPOINT_DIR = 'batch_checkpoints'
+
+
+def companies_in_category(category, corp_list, quant_path=QUANT_DATA_PATH):
+    """
+    quant 데이터의 '업종 (대)' 에 속한 회사들
+    """
+    codes = load_snapshot(quant_path).stock_codes(category)
+    companies = [corp_list.find_by_stock_code(code) for code in codes]
+    return [c for c in companies if c is not None]
+
+
+def listed_companies(corp_list):
+    """
+    corp_list 중 상장된(stock_code 가 있는) 회사들
+    """
+    return [c for c in corp_list.corps if c.stock_code is not None]
+
+
+def _checkpoint_path(checkpoint_dir, mode, corp_code):
+    return os.path.join(checkpoint_dir, mode, f'{corp_code}.pkl')
+
+
+def load_checkpoint(checkpoint_dir, mode, corp_code):
+    """
+    :return: (found, 결과 DataFrame 또는 None)
+    """
+    path = _checkpoint_path(checkpoint_dir, mode, corp_code)
+    if not os.path.exists(path):
+        return False, None
+    with open(path, 'rb') as f:
+        return True, pickle.load(f)
+
+
+def save_checkpoint(checkpoint_dir, mode, corp_code, df):
+    path = _checkpoint_path(checkpoint_dir, mode, corp_code)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 중단되어도 반쯤 쓰인 파일이 남지 않도록 임시파일에 쓰고 바꿔치기
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def company_performance(company, start, end, opendart, mode='yearly', period_workers=1, store=None):
+    """
+    회사 하나의 연간/분기 실적, 데이터가 없으면 None
+    """
+    df = PERFORMANCE_FUNCTIONS[mode](company, start, end, opendart, period_workers, store=store)
+    return df if isinstance(df, pd.DataFrame) else None
+
+
+def run_batch(companies, start, end, opendart, mode='yearly', checkpoint_dir=DEFAULT_CHECKPOINT_DIR,
+              workers=4, period_workers=1, store=None, api_key=None):
+    """
+    여러 회사의 실적을 쓰레드풀에서 계산하여 (corp_code, period) index 의 panel 로 쌓음
+    회사마다 결과를 checkpoint_dir 에 저장하므로 중단 후 다시 실행하면 남은 회사만 계산함
+
+    :param companies: corp_code, stock_code, corp_name 을 가진 객체들 (dart_fss Corp 등)
+    :param opendart: OpenDartReader 또는 같은 메소드를 가진 객체 (가짜 서버, 녹화된 응답 등)
+    :param mode: 'yearly' 또는 'quarterly'
+    :param workers: 동시에 처리할 회사수
+    :param period_workers: 회사 하나 안에서 동시에 요청할 기간수
+    :param store: FactStore, api_key 와 함께 주면 재무값을 다중회사 주요계정으로 묶어 미리 가져와 store 에 저장하고
+                  회사별 계산은 store 를 읽음
+    :return: (panel DataFrame, 실패한 corp_code 목록)
+    """
+    opendart = cached_opendart(opendart)
+    results = {}
+    pending = []
+    for company in companies:
+        found, df = load_checkpoint(checkpoint_dir, mode, company.corp_code)
+        if found:
+            results[company.corp_code] = df
+        else:
+            pending.append(company)
+
+    print(f'[batch] {mode} {start}~{end}: {len(companies)}개 중 {len(results)}개는 checkpoint 사용, '
+          f'{len(pending)}개 계산')
+
+    if store is not None and api_key is not None and len(pending) > 0:
+        prefetch_to_store([c.corp_code for c in pending], start, end, opendart, api_key, store,
+                          quarterly=(mode == 'quarterly'))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(company_performance, c, start, end, opendart, mode, period_workers, store): c
+                   for c in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            company = futures[future]
+            try:
+                df = future.result()
+            except QuotaExhausted as e:
+                # 이용한도가 초기화될 때까지 남은 회사는 계산하지 않음, 다음 실행에서 checkpoint 이후부터 다시 시작
+                print(f'[batch] 이용한도 초과로 중단합니다: {e}')
+                executor.shutdown(wait=True, cancel_futures=True)
+                failed = [c.corp_code for c in pending if c.corp_code not in results]
+                break
+            except Exception as e:
+                # 실패한 회사는 checkpoint 를 남기지 않으므로 다음 실행에서 다시 시도됨
+                print(f'[batch] {company.corp_name}({company.stock_code}) 실패: {e!r}')
+                failed.append(company.corp_code)
+                continue
+            save_checkpoint(checkpoint_dir, mode, company.corp_code, df)
+            results[company.corp_code] = df
+            print(f'[batch] {i}/{len(pending)} {company.corp_name}({company.stock_code}) 완료')
+
+    return stack_panel(results, [c.corp_code for c in companies]), failed
+
+
+def stack_panel(results, corp_codes):
+    """
+    회사별 DataFrame 을 (corp_code, period) index 의 panel 하나로 쌓음
+    """
+    frames = {code: results[code] for code in corp_codes if results.get(code) is not None}
+    if len(frames) == 0:
+        return pd.DataFrame()
+    panel = pd.concat(frames.values(), keys=frames.keys(), names=['corp_code', 'period'])
+    return panel
+
+
+def dart_api_key():
+    """
+    DART_API_KEY 환경변수, 없으면 key.py 의 api_key
+    """
+    api_key = os.environ.get('DART_API_KEY')
+    if api_key is None:
+        from key import api_key
+    return api_key
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='업종 또는 전체 상장사의 연간/분기 실적 panel 계산')
+    scope = parser.add_mutually_exclusive_group(required=True)
+    scope.add_argument('--category', help="quant 데이터의 '업종 (대)'")
+    scope.add_argument('--all', action='store_true', help='dart.get_corp_list() 의 전체 상장사')
+    parser.add_argument('--start', type=int, default=2015)
+    parser.add_argument('--end', type=int, default=2021)
+    parser.add_argument('--mode', choices=sorted(PERFORMANCE_FUNCTIONS), default='yearly')
+    parser.add_argument('--quant', default=QUANT_DATA_PATH)
+    parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--period-workers', type=int, default=1)
+    parser.add_argument('--out', default='panel.pkl', help='결과 panel 을 저장할 pickle 파일')
+    parser.add_argument('--multi', action='store_true',
+                        help='주요계정에 있는 계정은 다중회사 주요계정으로 묶어서, 나머지는 회사별로 요청하고 '
+                             'facts 저장소 사용')
+    parser.add_argument('--profile', help='단계별 성능 정보를 저장할 파일, .prom 이면 Prometheus text, 그 외는 JSON')
+    args = parser.parse_args(argv)
+
+    api_key = dart_api_key()
+    dart.set_api_key(api_key=api_key)
+    opendart = OpenDartReader(api_key)
+    corp_list = dart.get_corp_list()
+
+    if args.all:
+        companies = listed_companies(corp_list)
+    else:
+        companies = companies_in_category(args.category, corp_list, args.quant)
+
+    if args.multi:
+        # 주요계정에 없는 계정은 회사마다 finstate_all 로 가져오므로 그만큼은 요청수가 줄지 않음
+        labels = {a['label'] for a in get_accounts() if len(a['conditions']) > 0}
+        covered = multi_labels(get_accounts())
+        print(f'[batch] 다중회사 주요계정: {", ".join(sorted(covered)) or "없음"}, '
+              f'회사별 finstate_all: {", ".join(sorted(labels - covered)) or "없음"}')
+    store = get_store() if args.multi else None
+    panel, failed = run_batch(companies, args.start, args.end, opendart, args.mode, args.checkpoint_dir,
+                              args.workers, args.period_workers, store, api_key if args.multi else None)
+    panel.to_pickle(args.out)
+    print(f'[batch] {len(panel)} rows -> {args.out}, 실패 {len(failed)}개')
+    if args.profile:
+        write_report(args.profile)
+
+
+if __name__ == '__main__':
+    main()
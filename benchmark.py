@@ -0,0 +1,419 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from cache_helper import DartCache, cached_opendart, set_cache
+from corp_helper import CorpEntry
+from fake_dart_helper import FakeDartServer, serving
+from policy_helper import FetchPolicy, set_policy
+from profile_helper import profiler
+from replay_helper import Fixtures, ReplayOpenDart, recording, replaying
+from share_helper import SHARES_ROW_KEYWORD, PriceStore, parse_shares_row, set_price_store
+from statement_helper import (get_accounts, yearly_company_performance, quarterly_company_performance, REPRT_CODES,
+                              account_matcher, resolve_accounts, align_sources, combine_by_precedence)
+
+
+DEFAULT_FIXTURES = os.path.join('benchmarks', 'fixtures.pkl')
+
+# 고정된 회사 묶음 (종목코드, 회사명), 버전 간 비교를 위해 바꾸지 않음
+BASKET = [('005930', '삼성전자'),
+          ('096770', 'SK이노베이션'),
+          ('095570', 'AJ네트웍스'),
+          ('002960', '한국쉘석유'),
+          ('018670', 'SK가스')]
+
+MODES = {'yearly': yearly_company_performance,
+         'quarterly': quarterly_company_performance}
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _rcept_no(year, reprt_code, i):
+    month_day = {'11013': '0515', '11012': '0814', '11014': '1114', '11011': '0330'}[reprt_code]
+    return f'{year + 1 if reprt_code == "11011" else year}{month_day}{i:06d}'
+
+
+def _shares_html(common, preferred):
+    rows = ''.join(f'<tr><td>항목{i}</td><td>{i * 1000:,}</td><td>-</td><td>{i * 1000:,}</td></tr>'
+                   for i in range(300))
+    return (f'<html><body><table>{rows}'
+            f'<tr><td>Ⅳ. 발행주식의 총수 (Ⅱ-Ⅲ)</td><td>{common:,}</td><td>{preferred:,}</td>'
+            f'<td>{common + preferred:,}</td></tr>{rows}</table></body></html>').encode('utf-8')
+
+
+def synthetic_fixtures(basket=BASKET, start=2015, end=2021, seed=0, filler=150):
+    """
+    실제 응답과 같은 모양의 가짜 fixtures, 녹화한 fixtures 가 없어도 벤치마크를 실행할 수 있음
+    계정마다 첫번째 조건을 만족하는 row 와 filler 개의 다른 row 로 finstate 를 만듦
+    """
+    rng = np.random.default_rng(seed)
+    fixtures = Fixtures()
+    accounts = [a for a in get_accounts() if len(a['conditions']) > 0]
+
+    for i, (stock_code, name) in enumerate(basket):
+        corp_code = f'{i + 1:08d}'
+        fixtures.meta['corp_codes'][stock_code] = corp_code
+        fixtures.meta.setdefault('names', {})[corp_code] = name
+
+        for year in range(start - 2, end + 2):
+            for reprt_code in REPRT_CODES:
+                rcept_no = _rcept_no(year, reprt_code, i)
+                rows = []
+                for account in accounts:
+                    condition = account['conditions'][0]
+                    row = {k: (v[0] if isinstance(v, tuple) else v).strip() for k, v in condition.items()}
+                    rows.append(row)
+                rows += [{'account_id': f'dart_Filler{j}', 'account_nm': f'기타항목{j}'} for j in range(filler)]
+                amounts = rng.integers(10 ** 9, 10 ** 13, size=(len(rows), 3))
+                df = pd.DataFrame(rows)
+                df['account_detail'] = df.get('account_detail', pd.Series(dtype=object)).fillna('-')
+                for k, column in enumerate(['thstrm_amount', 'frmtrm_amount', 'bfefrmtrm_amount']):
+                    df[column] = [str(a) for a in amounts[:, k]]
+                df['rcept_no'] = rcept_no
+                df['reprt_code'] = reprt_code
+                df['bsns_year'] = str(year)
+                fixtures.put(Fixtures.finstate_key(corp_code, year, reprt_code), df)
+
+                report_url = f'synthetic://{rcept_no}/business'
+                fixtures.put(Fixtures.sub_docs_key(rcept_no, '사업의 내용'),
+                             pd.DataFrame({'title': ['II. 사업의 내용'], 'url': [report_url]}))
+
+            # 주식수: 다음해 사업보고서 목록 -> 주식의 총수 문서
+            rcept_no = _rcept_no(year, '11011', i)
+            filings = pd.DataFrame({'corp_code': [corp_code], 'stock_code': [stock_code], 'corp_name': [name],
+                                    'report_nm': [f'사업보고서 ({year}.12)'], 'rcept_no': [rcept_no],
+                                    'rcept_dt': [rcept_no[:8]], 'rm': ['연']})
+            fixtures.put(Fixtures.list_key(corp_code, f'{year}-12-01', f'{year + 1}-5-30', 'A'), filings)
+            shares_url = f'synthetic://{rcept_no}/shares'
+            fixtures.put(Fixtures.sub_docs_key(rcept_no, '주식의 총수'),
+                         pd.DataFrame({'title': ['4. 주식의 총수 등'], 'url': [shares_url]}))
+            fixtures.put(Fixtures.document_key(shares_url),
+                         (_shares_html(int(rng.integers(10 ** 6, 10 ** 9)), int(rng.integers(0, 10 ** 6))), 'utf-8'))
+
+            values = rng.uniform(100, 5000, size=(3, 3)).round(2)
+            fixtures.put(Fixtures.dividend_key(corp_code, str(year)),
+                         {'status': '000', 'message': '정상',
+                          'list': [{'se': se, 'thstrm': f'{v[0]:,}', 'frmtrm': f'{v[1]:,}', 'lwfr': f'{v[2]:,}'}
+                                   for se, v in zip(['주당순이익', '주당 현금배당금(원)', '현금배당수익률(%)'], values)]})
+
+        days = pd.bdate_range(date(start - 3, 1, 1), date(end, 12, 31))
+        fixtures.put(Fixtures.prices_key(stock_code),
+                     pd.DataFrame({'Close': rng.uniform(1000, 100000, len(days)).round()}, index=days))
+    return fixtures
+
+
+def record_fixtures(api_key, path=DEFAULT_FIXTURES, basket=BASKET, start=2015, end=2021, modes=tuple(MODES)):
+    """
+    실제 DART, FinanceDataReader 에 요청하며 basket 의 응답을 녹화 (네트워크와 api_key 필요)
+    """
+    import dart_fss as dart
+    import OpenDartReader
+
+    dart.set_api_key(api_key=api_key)
+    fixtures = Fixtures(path)
+    opendart = ReplayOpenDart(fixtures, OpenDartReader(api_key))
+    with tempfile.TemporaryDirectory() as directory, recording(fixtures):
+        _isolate(directory)
+        for stock_code, name in basket:
+            company = CorpEntry(opendart.find_corp_code(stock_code), stock_code, name)
+            for mode in modes:
+                MODES[mode](company, start, end, cached_opendart(opendart))
+    print(f'[benchmark] {len(fixtures.entries)}개 응답을 {path} 에 녹화')
+    return fixtures
+
+
+def _isolate(directory):
+    # 매번 빈 캐시, 빈 주가 저장소에서 시작
+    set_cache(DartCache(os.path.join(directory, f'cache-{time.perf_counter_ns()}.sqlite3')))
+    set_price_store(PriceStore(os.path.join(directory, f'prices-{time.perf_counter_ns()}.sqlite3')))
+
+
+def _requests(fixtures, server):
+    return server.total_requests() if server is not None else sum(fixtures.calls.values())
+
+
+def run_benchmark(fixtures, basket=BASKET, start=2015, end=2021, modes=tuple(MODES), use_server=False,
+                  latency=0.0, max_workers=None):
+    """
+    basket 의 회사마다 모드별로
+    - cold: 빈 캐시에서의 시간, 요청수, 단계별 시간
+    - warm: 같은 캐시로 다시 계산한 시간
+    - peak_kb: 빈 캐시에서 다시 계산할 때의 tracemalloc 최대 메모리
+    를 잼. 네트워크 없이 fixtures 만 사용
+
+    :param use_server: True 이면 가짜 DART HTTP 서버(FakeDartServer)를 거쳐 요청, 아니면 프로세스 안에서 재생
+    :param latency: 가짜 서버의 응답 지연(초)
+    """
+    set_policy(FetchPolicy(retries=0, on_quota='raise'))
+    results = []
+    server = FakeDartServer(fixtures, latency=latency).start() if use_server else None
+    try:
+        with tempfile.TemporaryDirectory() as directory, \
+                (serving(server) if server is not None else replaying(fixtures)) as source:
+            opendart = source if server is not None else ReplayOpenDart(fixtures)
+            for stock_code, name in basket:
+                company = CorpEntry(fixtures.corp_code(stock_code), stock_code, name)
+                for mode in modes:
+                    func = MODES[mode]
+
+                    _isolate(directory)
+                    profiler.reset()
+                    before = _requests(fixtures, server)
+                    t = time.perf_counter()
+                    df = func(company, start, end, cached_opendart(opendart), max_workers)
+                    cold = time.perf_counter() - t
+                    requests = _requests(fixtures, server) - before
+                    stages = {k: round(v['seconds'], 6) for k, v in profiler.report()['stages'].items()}
+
+                    t = time.perf_counter()
+                    func(company, start, end, cached_opendart(opendart), max_workers)
+                    warm = time.perf_counter() - t
+
+                    _isolate(directory)
+                    tracemalloc.start()
+                    func(company, start, end, cached_opendart(opendart), max_workers)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                    results.append({'stock_code': stock_code, 'name': name, 'mode': mode,
+                                    'rows': len(df) if isinstance(df, pd.DataFrame) else 0,
+                                    'cold_s': cold, 'warm_s': warm, 'requests': requests,
+                                    'peak_kb': peak / 1024, 'stages': stages})
+    finally:
+        if server is not None:
+            server.stop()
+
+    return {'version': _version(), 'timestamp': time.time(), 'python': platform.python_version(),
+            'pandas': pd.__version__, 'source': 'server' if use_server else 'replay', 'latency': latency,
+            'start': start, 'end': end, 'missing_fixtures': len(fixtures.missing), 'results': results}
+
+
+def _reference_resolution(df, conditions):
+    # 예전 account_meet_conditions 처럼 조건마다 column 별 str.contains 로 찾은 (조건 순번, row 위치)
+    for i, condition in enumerate(conditions):
+        mask = np.ones(len(df), dtype=bool)
+        for column, value in condition.items():
+            literals = value if isinstance(value, (tuple, list)) else (value,)
+            hit = np.zeros(len(df), dtype=bool)
+            if column in df.columns:
+                for e in literals:
+                    hit |= df[column].str.contains(e, regex=False, na=False).to_numpy(dtype=bool)
+            mask &= hit
+        rows = np.flatnonzero(mask)
+        if len(rows) > 0:
+            return i, rows
+    return None
+
+
+def check_account_resolution(fixtures, accounts=None):
+    """
+    녹화된 재무제표마다 resolve_accounts 가 조건별 str.contains 와 같은 row 를 찾는지 확인
+
+    :return: 확인한 재무제표 수, 다르면 AssertionError
+    """
+    accounts = accounts or get_accounts()
+    matcher = account_matcher(accounts)
+    checked = 0
+    for key, (kind, df) in fixtures.entries.items():
+        if key[0] != 'finstate_all' or kind != 'ok' or df is None or len(df) == 0:
+            continue
+        resolved = resolve_accounts(df, matcher)
+        for account in accounts:
+            expected = _reference_resolution(df, account['conditions'])
+            found = resolved.get(account['label'])
+            assert (found is None) == (expected is None), (key, account['label'], found, expected)
+            if found is not None:
+                assert found[0] == expected[0] and np.array_equal(found[1], expected[1]), (key, account['label'])
+        checked += 1
+    return checked
+
+
+def _synthetic_filings(years, quarterly=False, accounts=None, seed=0):
+    # 최근 보고서 순의 finstate_in_year(사업보고서, 3년치) 또는 finstate_of_report(분기) 모양의 frame 들
+    labels = [e['label'] for e in (accounts or get_accounts()) if len(e['conditions']) > 0]
+    rng = np.random.default_rng(seed)
+    frames = []
+    for year in range(2000 + years - 1, 1999, -1):
+        if quarterly:
+            for quarter in ['4Q', '3Q', '2Q', '1Q']:
+                frames.append(pd.DataFrame(rng.random((1, len(labels))) * 1e12, columns=labels,
+                                           index=pd.Index([f'{year}.{quarter}'], name='year')))
+        else:
+            frames.append(pd.DataFrame(rng.random((3, len(labels))) * 1e12, columns=labels,
+                                       index=pd.Index([year, year - 1, year - 2], name='year')))
+    return frames
+
+
+def _assemble_by_append(frames, sources):
+    # 이전 방식: 한 frame 씩 이어 붙이고(DataFrame.append) keep='first' 로 중복 제거, source 마다 merge
+    mdf = None
+    for df in frames:
+        mdf = df if mdf is None else pd.concat([mdf, df])
+    mdf = mdf[~mdf.index.duplicated(keep='first')].sort_index()
+    for source in sources:
+        mdf = pd.merge(mdf, source, on='year', how='outer')
+    return mdf
+
+
+def _assemble_once(frames, sources):
+    return align_sources([combine_by_precedence(frames)] + list(sources))
+
+
+def benchmark_assembly(years=20, repeat=20):
+    """
+    years 년의 사업보고서(연간)와 years x 4 분기보고서를 조립할 때
+    이전 방식(append + merge)과 한번에 만드는 방식의 시간, 최대 메모리를 비교
+
+    :return: 방식별 결과 DataFrame
+    """
+    results = []
+    for mode in ['yearly', 'quarterly']:
+        frames = _synthetic_filings(years, quarterly=(mode == 'quarterly'))
+        index = pd.Index(sorted({i for df in frames for i in df.index}), name='year')
+        sources = [pd.DataFrame({name: np.arange(len(index), dtype='float64')}, index=index)
+                   for name in ['주가', '주식수', '주당 현금배당금(원)']]
+
+        for method, assemble in [('append', _assemble_by_append), ('once', _assemble_once)]:
+            tracemalloc.start()
+            t = time.perf_counter()
+            for _ in range(repeat):
+                assemble(frames, sources)
+            elapsed = (time.perf_counter() - t) / repeat
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({'mode': mode, 'method': method, 'frames': len(frames),
+                            'ms': elapsed * 1000, 'peak_kb': peak / 1024})
+    return pd.DataFrame(results).set_index(['mode', 'method'])
+
+
+def _parse_shares_with_soup(html):
+    # 이전 방식: 문서 전체를 BeautifulSoup(html.parser)로 파싱
+    soup = BeautifulSoup(html, 'html.parser')
+    shares_row = soup.find('td', string=re.compile(SHARES_ROW_KEYWORD)).parent
+    shares = []
+    for r in shares_row.find_all('td'):
+        r = r.text.replace(',', '').replace('-', '')
+        shares.append(int(r) if r.isdigit() else r)
+    return shares
+
+
+def _measure(func, html, repeat):
+    tracemalloc.start()
+    t = time.perf_counter()
+    for _ in range(repeat):
+        result = func(html)
+    elapsed = (time.perf_counter() - t) / repeat
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def benchmark_share_parsing(paths, repeat=5, encoding='utf-8'):
+    """
+    저장된 '주식의 총수' 문서들로 BeautifulSoup 파싱과 스트리밍 파싱의 시간, 최대 메모리를 비교
+
+    :param paths: html 파일 경로들
+    :return: 파일별 결과 DataFrame
+    """
+    results = []
+    for path in paths:
+        with open(path, encoding=encoding, errors='replace') as f:
+            html = f.read()
+        soup_shares, soup_time, soup_peak = _measure(_parse_shares_with_soup, html, repeat)
+        stream_shares, stream_time, stream_peak = _measure(parse_shares_row, html, repeat)
+        results.append({'file': os.path.basename(path), 'bytes': len(html.encode(encoding)),
+                        'soup_ms': soup_time * 1000, 'stream_ms': stream_time * 1000,
+                        'soup_peak_kb': soup_peak / 1024, 'stream_peak_kb': stream_peak / 1024,
+                        'same_result': soup_shares == stream_shares})
+    df = pd.DataFrame(results).set_index('file')
+    df['speedup'] = df['soup_ms'] / df['stream_ms']
+    return df
+
+
+def summary(report):
+    df = pd.DataFrame(report['results']).drop(columns=['stages'])
+    return df.set_index(['name', 'mode'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='녹화한 DART 응답으로 yearly/quarterly_company_performance 벤치마크')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    record = sub.add_parser('record', help='실제 DART 에 요청하며 fixtures 녹화 (api_key 필요)')
+    record.add_argument('--fixtures', default=DEFAULT_FIXTURES)
+
+    synthetic = sub.add_parser('synthetic', help='가짜 fixtures 생성')
+    synthetic.add_argument('--fixtures', default=DEFAULT_FIXTURES)
+    synthetic.add_argument('--seed', type=int, default=0)
+
+    run = sub.add_parser('run', help='fixtures 로 벤치마크 실행 (네트워크 불필요)')
+    run.add_argument('--fixtures', default=DEFAULT_FIXTURES)
+    run.add_argument('--server', action='store_true', help='가짜 DART HTTP 서버를 거쳐 요청')
+    run.add_argument('--latency', type=float, default=0.0, help='가짜 서버의 응답 지연(초)')
+    run.add_argument('--mode', choices=sorted(MODES), action='append', help='기본은 모든 모드')
+    run.add_argument('--workers', type=int, default=None)
+    run.add_argument('--out', help='결과를 저장할 JSON 파일')
+
+    check = sub.add_parser('check', help='녹화된 재무제표로 계정 찾기(resolve_accounts)가 예전과 같은지 확인')
+    check.add_argument('--fixtures', default=DEFAULT_FIXTURES)
+
+    assembly = sub.add_parser('assembly', help='연간/분기 표 조립(append + merge 와 한번에 만들기) 비교')
+    assembly.add_argument('--years', type=int, default=20)
+    assembly.add_argument('--repeat', type=int, default=20)
+
+    shares = sub.add_parser('shares', help="저장된 '주식의 총수' 문서들로 주식수 파싱 비교")
+    shares.add_argument('directory', nargs='?', default='.', help='html 문서들이 있는 디렉토리')
+
+    for p in (record, synthetic, run):
+        p.add_argument('--start', type=int, default=2015)
+        p.add_argument('--end', type=int, default=2021)
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        api_key = os.environ.get('DART_API_KEY')
+        if api_key is None:
+            from key import api_key
+        record_fixtures(api_key, args.fixtures, start=args.start, end=args.end)
+    elif args.command == 'synthetic':
+        fixtures = synthetic_fixtures(start=args.start, end=args.end, seed=args.seed)
+        fixtures.save(args.fixtures)
+        print(f'[benchmark] {len(fixtures.entries)}개 가짜 응답 -> {args.fixtures}')
+    elif args.command == 'assembly':
+        print(benchmark_assembly(args.years, args.repeat).to_string(float_format=lambda v: f'{v:,.3f}'))
+    elif args.command == 'shares':
+        paths = sorted(glob.glob(os.path.join(args.directory, '*.htm*')))
+        print(benchmark_share_parsing(paths).to_string())
+    elif args.command == 'check':
+        print(f'[benchmark] 재무제표 {check_account_resolution(Fixtures(args.fixtures))}건의 계정 찾기가 같음')
+    else:
+        fixtures = Fixtures(args.fixtures)
+        report = run_benchmark(fixtures, start=args.start, end=args.end, modes=args.mode or tuple(MODES),
+                               use_server=args.server, latency=args.latency, max_workers=args.workers)
+        print(summary(report).to_string(float_format=lambda v: f'{v:,.3f}'))
+        if report['missing_fixtures']:
+            print(f"[benchmark] 녹화되지 않은 요청 {report['missing_fixtures']}건은 공시 없음으로 처리함")
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import csv
+
+import numpy as np
+import pandas as pd
+
+from statement_helper import get_accounts, account_matcher, pattern_masks, account_values, REPRT_CODES
+from store_helper import frame_to_facts
+
+
+# DART 재무정보 일괄다운로드 파일(탭 구분, cp949)의 column 을 finstate_all 의 column 으로 대응
+DUMP_COLUMNS = {'종목코드': 'stock_code',
+                '회사명': 'corp_name',
+                '결산기준일': 'settlement_date',
+                '보고서종류': 'report_name',
+                '항목코드': 'account_id',
+                '항목명': 'account_nm'}
+
+DUMP_REPRT_CODES = {'1분기보고서': '11013', '반기보고서': '11012', '3분기보고서': '11014', '사업보고서': '11011'}
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def _amount_columns(header):
+    """
+    '당기 1분기 3개월', '당기 1분기 누적', '전기말' 등에서 당기, 전기, 전전기의 첫번째 column
+    손익계산서의 당기는 finstate_all 의 thstrm_amount 와 같은 3개월 값이 먼저 나옴
+    """
+    def first(prefix):
+        return next((c for c in header if c.startswith(prefix)), None)
+
+    return {'thstrm_amount': first('당기'),
+            'frmtrm_amount': first('전기'),
+            'bfefrmtrm_amount': first('전전기')}
+
+
+def read_dump(path, chunksize=DEFAULT_CHUNK_SIZE, encoding='cp949'):
+    """
+    일괄다운로드 파일을 finstate_all 과 같은 column 이름의 DataFrame chunk 로 읽음
+    """
+    header = pd.read_csv(path, sep='\t', encoding=encoding, nrows=0, quoting=csv.QUOTE_NONE).columns
+    header = [c.strip() for c in header]
+    amounts = _amount_columns(header)
+    renames = dict(DUMP_COLUMNS, **{v: k for k, v in amounts.items() if v is not None})
+
+    reader = pd.read_csv(path, sep='\t', encoding=encoding, dtype=str, chunksize=chunksize,
+                         quoting=csv.QUOTE_NONE, header=0, names=header,
+                         usecols=[c for c in header if c in renames])
+    for chunk in reader:
+        chunk = chunk.rename(columns=renames)
+        chunk['stock_code'] = chunk['stock_code'].str.strip('[] ')
+        chunk['account_nm'] = chunk['account_nm'].str.strip()
+        for column in amounts:
+            if column not in chunk:
+                chunk[column] = ''
+        yield chunk
+
+
+def load_dump(paths, accounts=None, chunksize=DEFAULT_CHUNK_SIZE, encoding='cp949', quarterly=False):
+    """
+    같은 기간의 일괄다운로드 파일들(재무상태표, 손익계산서 ...)에서 회사별 계정값을 추출
+    finstate_all 이 재무상태표, 손익계산서 ... 순서로 반환하므로 paths 도 같은 순서로 주어야
+    '첫번째로 만족하는 row' 가 같아짐. 파일은 chunk 단위로 읽고 회사별 계정값만 유지하므로
+    메모리 사용량은 파일 크기와 무관함
+    일괄다운로드 파일에는 account_detail 이 없으므로 account_detail 조건은 만족하지 않음
+
+    :param quarterly: True 이면 사업보고서도 '2020.4Q' 형식의 당기값만 반환
+    :return: {stock_code: DataFrame}, 사업보고서는 finstate_in_year, 분기보고서는 finstate_in_quarter 의
+             해당 분기와 같은 모양
+    """
+    accounts = accounts or get_accounts()
+    matcher = account_matcher(accounts)
+
+    # stock_code -> {label: (조건 순번, row)}, 회사별 기간 정보
+    found = {}
+    periods = {}
+    for path in paths:
+        for chunk in read_dump(path, chunksize, encoding):
+            masks = pattern_masks(chunk, matcher)
+            companies = chunk['stock_code'].to_numpy()
+
+            for code, i in zip(*np.unique(companies, return_index=True)):
+                if code not in periods:
+                    row = chunk.iloc[i]
+                    periods[code] = (int(str(row['settlement_date'])[:4]), DUMP_REPRT_CODES[row['report_name']])
+
+            for label, conditions in matcher['accounts']:
+                for i, condition in enumerate(conditions):
+                    rows = np.flatnonzero(masks[condition].all(axis=0))
+                    if len(rows) == 0:
+                        continue
+                    # 회사별로 조건을 만족하는 첫번째 row
+                    codes, first = np.unique(companies[rows], return_index=True)
+                    for code, r in zip(codes, rows[first]):
+                        best = found.setdefault(code, {}).get(label)
+                        if best is None or i < best[0]:
+                            found[code][label] = (i, chunk.iloc[r][['thstrm_amount', 'frmtrm_amount',
+                                                                    'bfefrmtrm_amount']])
+
+    frames = {}
+    for code, values in found.items():
+        year, reprt_code = periods[code]
+        quarter = None if reprt_code == '11011' and not quarterly else REPRT_CODES[reprt_code]
+        series = []
+        for account in accounts:
+            if account['label'] in values:
+                s = pd.Series(account_values(values[account['label']][1], year, quarter), name=account['label'])
+                s.index.name = 'year'
+                series.append(s)
+        frames[code] = pd.DataFrame({s.name: s for s in series})
+    return frames
+
+
+def load_dump_to_store(paths, store, corp_codes, accounts=None, chunksize=DEFAULT_CHUNK_SIZE, encoding='cp949',
+                       quarterly=False):
+    """
+    일괄다운로드 파일의 계정값을 FactStore 에 저장
+
+    :param corp_codes: {stock_code: corp_code}, store 는 corp_code 를 키로 사용
+    :return: 저장한 회사수
+    """
+    frames = load_dump(paths, accounts, chunksize, encoding, quarterly)
+    facts = [frame_to_facts(df, corp_codes[code]) for code, df in frames.items() if code in corp_codes]
+    if len(facts) > 0:
+        store.write(pd.concat(facts))
+    return len(facts)
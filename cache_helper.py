@@ -0,0 +1,332 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import dart_fss as dart
+
+from policy_helper import DART_API_URL, OK, NO_FILING, get_policy, request_finstate_all, unavailable_as_no_filing
+from profile_helper import profiler
+from scheduler_helper import dart_limiter
+
+
+DEFAULT_CACHE_PATH = os.path.join('docs_cache', 'dart_cache.sqlite3')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024   # 512MB
+OPEN_PERIOD_TTL = 6 * 60 * 60           # 아직 진행중인 기간은 6시간만 유지
+AMENDMENT_GRACE_DAYS = 30               # 제출기한 이후 정정공시를 기다리는 기간
+
+# 정기보고서 제출기한 (월, 일, 다음해 여부)
+# 사업보고서는 다음해 3월 말, 분기/반기보고서는 분기말 후 45일
+REPORT_DEADLINES = {'11013': (5, 15, False),
+                    '11012': (8, 14, False),
+                    '11014': (11, 14, False),
+                    '11011': (3, 31, True)}
+
+
+def report_deadline(year, reprt_code='11011'):
+    """
+    해당 기간의 정기보고서 제출기한
+    """
+    month, day, next_year = REPORT_DEADLINES.get(reprt_code, REPORT_DEADLINES['11011'])
+    return date(year + 1 if next_year else year, month, day)
+
+
+def is_closed_period(deadline, today=None):
+    """
+    제출기한과 정정기간이 모두 지났으면 더 이상 바뀌지 않는 기간으로 봄
+    """
+    today = today or date.today()
+    return today > deadline + timedelta(days=AMENDMENT_GRACE_DAYS)
+
+
+def ttl_for_deadline(deadline, today=None):
+    """
+    닫힌 기간은 만료되지 않음(None), 열린 기간은 OPEN_PERIOD_TTL 초
+    """
+    return None if is_closed_period(deadline, today) else OPEN_PERIOD_TTL
+
+
+# 공시가 없다는 확정된 응답, 값 대신 저장하여 다시 요청하지 않음
+NoFilingEntry = namedtuple('NoFilingEntry', ['reason'])
+
+
+def _is_empty(value):
+    if value is None:
+        return True
+    empty = getattr(value, 'empty', None)
+    return empty if isinstance(empty, bool) else False
+
+
+class DartCache:
+    """
+    OpenDART 응답을 디스크(SQLite)에 저장하는 캐시
+    (endpoint, corp/stock code, year, reprt_code) 를 키로 사용하며 여러 프로세스가 같은 파일을 공유할 수 있음
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                endpoint TEXT NOT NULL,
+                                code TEXT NOT NULL,
+                                year INTEGER NOT NULL,
+                                reprt_code TEXT NOT NULL,
+                                extra TEXT NOT NULL,
+                                value BLOB,
+                                size INTEGER NOT NULL,
+                                created REAL NOT NULL,
+                                expires REAL,
+                                accessed REAL NOT NULL,
+                                PRIMARY KEY (endpoint, code, year, reprt_code, extra))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, counter, endpoint):
+        with self._lock:
+            counter[endpoint] = counter.get(endpoint, 0) + 1
+
+    def get(self, endpoint, code, year, reprt_code='', extra=''):
+        """
+        :return: (found, value)
+        """
+        key = (endpoint, str(code), int(year), reprt_code, extra)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, expires FROM entries WHERE endpoint=? AND code=? AND year=? '
+                               'AND reprt_code=? AND extra=?', key).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self._count(self.misses, endpoint)
+                profiler.count_cache(endpoint, False)
+                return False, None
+            conn.execute('UPDATE entries SET accessed=? WHERE endpoint=? AND code=? AND year=? '
+                         'AND reprt_code=? AND extra=?', (now,) + key)
+
+        self._count(self.hits, endpoint)
+        profiler.count_cache(endpoint, True)
+        return True, pickle.loads(row[0])
+
+    def put(self, endpoint, code, year, value, reprt_code='', extra='', ttl=None):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (endpoint, str(code), int(year), reprt_code, extra, blob, len(blob), now, expires, now))
+        self.evict()
+
+    def fetch(self, endpoint, code, year, func, reprt_code='', extra='', ttl=None, limited=True, policy=None,
+              empty=None):
+        """
+        캐시에 있으면 캐시값을, 없으면 func() 를 policy(FetchPolicy)에 따라 호출하여 저장 후 반환
+        limited 이면 DART API 이용한도(dart_limiter)를 지키며 호출
+
+        - 공시가 없다는 응답(NoDataReceived 등)은 NoFilingEntry 로 ttl 동안 저장하고 empty 를 반환
+        - 재시도 후에도 실패한 일시적인 오류는 저장하지 않고 empty 를 반환
+        - 이용한도 초과는 policy 에 따라 기다리거나 QuotaExhausted 를 발생
+        - 예외 없이 받은 빈 응답(None, 빈 DataFrame)은 원인을 알 수 없으므로 저장하지 않음
+        """
+        found, value = self.get(endpoint, code, year, reprt_code, extra)
+        if found:
+            return empty if isinstance(value, NoFilingEntry) else value
+
+        def call():
+            if limited:
+                dart_limiter.acquire()
+            return func()
+
+        # 캐시에 없을 때 요청(재시도, 대기 포함)에 걸린 시간
+        with profiler.stage(f'dart.{endpoint}'):
+            outcome = (policy or get_policy()).run(call, name=f'{endpoint} {code} {year} {reprt_code}'.strip())
+        if outcome.status == NO_FILING:
+            self.put(endpoint, code, year, NoFilingEntry(str(outcome.error)), reprt_code, extra, ttl)
+            return empty
+        if outcome.status != OK:
+            return empty
+
+        value = outcome.value
+        if not _is_empty(value):
+            self.put(endpoint, code, year, value, reprt_code, extra, ttl)
+        return value
+
+    def invalidate(self, endpoint=None, codes=None, year=None, reprt_code=None):
+        """
+        조건에 맞는 항목을 삭제, 조건이 None 이면 해당 조건은 무시
+        :return: 삭제된 항목수
+        """
+        clauses, params = [], []
+        if endpoint is not None:
+            clauses.append('endpoint=?')
+            params.append(endpoint)
+        if codes is not None:
+            codes = [str(c) for c in codes]
+            clauses.append(f'code IN ({",".join("?" * len(codes))})')
+            params.extend(codes)
+        if year is not None:
+            clauses.append('year=?')
+            params.append(int(year))
+        if reprt_code is not None:
+            clauses.append('reprt_code=?')
+            params.append(reprt_code)
+
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        with self._connect() as conn:
+            return conn.execute(f'DELETE FROM entries{where}', params).rowcount
+
+    def evict(self):
+        """
+        전체 크기가 max_bytes 를 넘으면 만료된 항목과 오래 사용되지 않은 항목부터 삭제
+        """
+        with self._connect() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            removed = conn.execute('DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?',
+                                   (time.time(),)).rowcount
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+            # 최대 크기의 90% 까지 줄임
+            target = self.max_bytes * 0.9
+            rows = conn.execute('SELECT rowid, size FROM entries ORDER BY accessed').fetchall()
+            victims = []
+            for rowid, size in rows:
+                if total <= target:
+                    break
+                victims.append((rowid,))
+                total -= size
+            conn.executemany('DELETE FROM entries WHERE rowid=?', victims)
+            return removed + len(victims)
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {'entries': entries, 'bytes': size,
+                'hits': hits, 'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses > 0 else 0.0,
+                'by_endpoint': {e: {'hits': self.hits.get(e, 0), 'misses': self.misses.get(e, 0)}
+                                for e in sorted(set(self.hits) | set(self.misses))}}
+
+
+_default_cache = None
+
+
+def get_cache():
+    """
+    프로세스에서 공유하는 기본 캐시, DART_CACHE_PATH 환경변수로 위치를 바꿀 수 있음
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DartCache(os.environ.get('DART_CACHE_PATH', DEFAULT_CACHE_PATH))
+    return _default_cache
+
+
+def set_cache(cache):
+    """
+    기본 캐시를 바꿈, 벤치마크처럼 빈 캐시에서 시작해야 할 때 사용
+    """
+    global _default_cache
+    _default_cache = cache
+
+
+class CachedOpenDart:
+    """
+    OpenDartReader 객체를 감싸서 finstate_all, list, sub_docs 호출을 캐시함
+    그 밖의 메소드는 원래 객체로 그대로 전달
+    """
+
+    def __init__(self, opendart, cache=None):
+        self.opendart = opendart
+        self.cache = cache or get_cache()
+
+    def __getattr__(self, name):
+        return getattr(self.opendart, name)
+
+    def _finstate_all(self, corp, bsns_year, reprt_code, fs_div):
+        # OpenDartReader 는 오류 응답을 빈 DataFrame 으로 바꾸므로, api_key 가 있으면 직접 요청하여
+        # '데이터 없음'과 이용한도 초과 등을 구분함
+        api_key = getattr(self.opendart, 'api_key', None)
+        find_corp_code = getattr(self.opendart, 'find_corp_code', None)
+        if api_key is None or find_corp_code is None:
+            return self.opendart.finstate_all(corp, bsns_year, reprt_code=reprt_code, fs_div=fs_div)
+        corp_code = find_corp_code(corp)
+        if not corp_code:
+            raise ValueError(f'could not find "{corp}"')
+        return request_finstate_all(api_key, corp_code, bsns_year, reprt_code, fs_div,
+                                    getattr(self.opendart, 'base_url', DART_API_URL))
+
+    def finstate_all(self, corp, bsns_year, reprt_code='11011', fs_div='CFS'):
+        year = int(bsns_year)
+        return self.cache.fetch('finstate_all', corp, year,
+                                lambda: self._finstate_all(corp, bsns_year, reprt_code, fs_div),
+                                reprt_code=reprt_code, extra=fs_div,
+                                ttl=ttl_for_deadline(report_deadline(year, reprt_code)))
+
+    def list(self, corp=None, start=None, end=None, kind='', kind_detail='', final=True):
+        start_date = to_date(start) if start else date(1990, 1, 1)
+        end_date = to_date(end) if end else date.today()
+        extra = f'{start_date}|{end_date}|{kind}|{kind_detail}|{final}'
+        return self.cache.fetch('list', corp or '', start_date.year,
+                                lambda: self.opendart.list(corp, start=start, end=end, kind=kind,
+                                                           kind_detail=kind_detail, final=final),
+                                extra=extra, ttl=ttl_for_deadline(end_date))
+
+    def sub_docs(self, s, match=None):
+        # 접수번호의 문서는 바뀌지 않으므로 만료되지 않음
+        rcept_no = str(s)
+        return self.cache.fetch('sub_docs', rcept_no, int(rcept_no[:4]) if rcept_no[:4].isdigit() else 0,
+                                lambda: self.opendart.sub_docs(s, match=match), extra=match or '',
+                                limited=False)
+
+
+def cached_opendart(opendart, cache=None):
+    """
+    이미 캐시가 적용된 객체는 그대로 반환
+    """
+    if opendart is None or isinstance(opendart, CachedOpenDart):
+        return opendart
+    return CachedOpenDart(opendart, cache)
+
+
+def cached_get_dividend(corp_code, bsns_year, reprt_code='11011', cache=None):
+    cache = cache or get_cache()
+    year = int(bsns_year)
+    get_dividend = unavailable_as_no_filing(
+        lambda: dart.api.info.get_dividend(corp_code, bsns_year=str(bsns_year), reprt_code=reprt_code),
+        f'get_dividend {corp_code} {year}')
+    return cache.fetch('get_dividend', corp_code, year, get_dividend, reprt_code=reprt_code, ttl=ttl_for_deadline(report_deadline(year, reprt_code)))
+
+
+def to_date(value):
+    """
+    '2020-5-30', '20200530', date 등을 date 로 변환
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    s = str(value).strip()
+    if '-' in s:
+        y, m, d = (int(e) for e in s.split('-'))
+        return date(y, m, d)
+    return datetime.strptime(s, '%Y%m%d').date()
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import mmap
+import os
+import time
+from collections import namedtuple
+
+import dart_fss as dart
+import numpy as np
+
+
+DEFAULT_INDEX_DIR = os.path.join('docs_cache', 'corp_index')
+DEFAULT_MAX_AGE = 24 * 60 * 60  # 하루에 한번 DART 의 회사 목록과 비교
+
+CorpEntry = namedtuple('CorpEntry', ['corp_code', 'stock_code', 'corp_name'])
+
+ENTRY_DTYPE = np.dtype([('corp_code', 'S8'), ('stock_code', 'S6'), ('name_offset', '<i4'), ('name_length', '<i4')])
+
+_FILES = {'entries': 'entries.npy',       # stock_code 순으로 정렬된 회사 목록
+          'by_corp': 'by_corp.npy',       # corp_code 순서의 entries 위치
+          'by_name': 'by_name.npy',       # 이름 순서의 entries 위치
+          'names': 'names.bin',           # '\n' 으로 구분된 utf-8 회사명
+          'meta': 'meta.json'}
+
+
+def _fingerprint(rows):
+    h = hashlib.sha1()
+    for row in rows:
+        h.update('\t'.join(row).encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def build_corp_index(corps, directory=DEFAULT_INDEX_DIR):
+    """
+    (corp_code, stock_code, corp_name) 목록으로 index 파일들을 만듦
+
+    :param corps: corp_code, stock_code, corp_name 을 가진 객체들, stock_code 가 없는 회사는 제외
+    :return: fingerprint
+    """
+    rows = sorted({(c.corp_code, c.stock_code, c.corp_name) for c in corps if c.stock_code},
+                  key=lambda r: (r[1], r[0]))
+    fingerprint = _fingerprint(rows)
+    os.makedirs(directory, exist_ok=True)
+
+    entries = np.zeros(len(rows), dtype=ENTRY_DTYPE)
+    blob = bytearray()
+    for i, (corp_code, stock_code, name) in enumerate(rows):
+        encoded = name.encode('utf-8')
+        entries[i] = (corp_code.encode(), stock_code.encode(), len(blob), len(encoded))
+        blob += encoded + b'\n'
+
+    by_corp = np.argsort(entries['corp_code'], kind='stable').astype('<i4')
+    by_name = np.array(sorted(range(len(rows)), key=lambda i: rows[i][2]), dtype='<i4')
+
+    # 읽는 쪽이 반쯤 쓰인 파일을 보지 않도록 임시파일에 쓰고 바꿔치기, meta 를 마지막에 바꿈
+    def replace(name, write):
+        path = os.path.join(directory, _FILES[name])
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    replace('entries', lambda f: np.save(f, entries))
+    replace('by_corp', lambda f: np.save(f, by_corp))
+    replace('by_name', lambda f: np.save(f, by_name))
+    replace('names', lambda f: f.write(bytes(blob) or b'\n'))
+    replace('meta', lambda f: f.write(json.dumps({'fingerprint': fingerprint, 'built': time.time(),
+                                                  'count': len(rows)}).encode('utf-8')))
+    return fingerprint
+
+
+class CorpIndex:
+    """
+    stock_code <-> corp_code <-> 회사명 index, 파일을 memory map 하여 바로 사용
+    """
+
+    def __init__(self, directory=DEFAULT_INDEX_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, _FILES['meta']), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.entries = np.load(os.path.join(directory, _FILES['entries']), mmap_mode='r')
+        self.by_corp = np.load(os.path.join(directory, _FILES['by_corp']), mmap_mode='r')
+        self.by_name = np.load(os.path.join(directory, _FILES['by_name']), mmap_mode='r')
+        with open(os.path.join(directory, _FILES['names']), 'rb') as f:
+            self.names = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # 회사명 시작위치, substring 검색 결과를 회사로 바꿀 때 사용
+        self._name_starts = np.asarray(self.entries['name_offset'])
+        self._name_order = np.argsort(self._name_starts)
+        self._corp_codes = np.asarray(self.entries['corp_code'][self.by_corp])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _name(self, i):
+        e = self.entries[i]
+        return self.names[e['name_offset']:e['name_offset'] + e['name_length']].decode('utf-8')
+
+    def _entry(self, i):
+        e = self.entries[i]
+        return CorpEntry(e['corp_code'].decode(), e['stock_code'].decode(), self._name(i))
+
+    def find_by_stock_code(self, stock_code):
+        key = stock_code.encode()
+        i = int(np.searchsorted(self.entries['stock_code'], key))
+        if i < len(self.entries) and self.entries[i]['stock_code'] == key:
+            return self._entry(i)
+        return None
+
+    def find_by_corp_code(self, corp_code):
+        key = corp_code.encode()
+        i = int(np.searchsorted(self._corp_codes, key))
+        if i < len(self._corp_codes) and self._corp_codes[i] == key:
+            return self._entry(int(self.by_corp[i]))
+        return None
+
+    def search_prefix(self, prefix, limit=None):
+        """
+        회사명이 prefix 로 시작하는 회사들, 이름순
+        """
+        lo, hi = 0, len(self.by_name)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(int(self.by_name[mid])) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        results = []
+        for j in range(lo, len(self.by_name)):
+            i = int(self.by_name[j])
+            if not self._name(i).startswith(prefix) or (limit is not None and len(results) >= limit):
+                break
+            results.append(self._entry(i))
+        return results
+
+    def search(self, text, limit=None):
+        """
+        회사명에 text 가 들어있는 회사들, stock_code 순
+        """
+        key = text.encode('utf-8')
+        if len(key) == 0 or b'\n' in key:
+            return []
+
+        found = set()
+        pos = self.names.find(key)
+        while pos >= 0:
+            # pos 를 포함하는 회사명
+            k = int(np.searchsorted(self._name_starts, pos, side='right', sorter=self._name_order)) - 1
+            found.add(int(self._name_order[k]))
+            pos = self.names.find(key, pos + 1)
+
+        results = [self._entry(i) for i in sorted(found)]
+        return results[:limit] if limit is not None else results
+
+    def labels(self):
+        """
+        '회사명 : 종목코드' 목록, 사이드바 선택상자용
+        """
+        return [f'{self._name(i)} : {self.entries[i]["stock_code"].decode()}' for i in range(len(self.entries))]
+
+
+def load_corp_index(directory=DEFAULT_INDEX_DIR, max_age=DEFAULT_MAX_AGE, corp_list=None):
+    """
+    index 를 읽음. 없거나 max_age 초보다 오래되었으면 DART 의 회사 목록과 비교하여
+    바뀐 경우에만 다시 만듦 (dart.set_api_key 가 필요)
+
+    :param corp_list: 이미 받은 dart_fss CorpList, 없으면 dart.get_corp_list()
+    """
+    meta_path = os.path.join(directory, _FILES['meta'])
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+
+    if meta is None or time.time() - meta['built'] > max_age:
+        corps = (corp_list or dart.get_corp_list()).corps
+        rows = sorted({(c.corp_code, c.stock_code, c.corp_name) for c in corps if c.stock_code},
+                      key=lambda r: (r[1], r[0]))
+        if meta is not None and _fingerprint(rows) == meta['fingerprint']:
+            meta['built'] = time.time()
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        else:
+            print('회사 목록이 바뀌어 index 를 다시 만듭니다')
+            build_corp_index(corps, directory)
+
+    return CorpIndex(directory)
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from statement_helper import get_accounts
+
+
+HUNDRED_MILLION = 100000000
+
+# 단위별 표시 형식
+UNIT_FORMATS = {'KRW': '{:,.0f}'.format,        # 억원
+                'KRW/share': '{:,.0f}'.format,
+                'shares': '{:,.0f}'.format,
+                '%': '{:,.2f}'.format,
+                'ratio': '{:,.1%}'.format}
+
+
+def _format(values, formatter):
+    return values.map(lambda v: '' if pd.isna(v) else formatter(v))
+
+
+def format_sheet(df, accounts=None):
+    """
+    yearly_company_performance/quarterly_company_performance 의 숫자 DataFrame 을 화면에 보일 문자열 표로 만듦
+    계정값은 억원 단위로 나누고 column 이름을 '1.매출액(억)' 형식으로 바꿈
+
+    :param df: attrs['units'] 가 있는 DataFrame, 없는 column 은 그대로 표시
+    """
+    accounts = accounts or get_accounts()
+    orders = {e['label']: e['order'] for e in accounts}
+    units = df.attrs.get('units', {})
+
+    columns = {}
+    for column in df.columns:
+        unit = units.get(column)
+        values = df[column]
+        if unit == 'KRW':
+            values = _format(values.astype('float64') / HUNDRED_MILLION, UNIT_FORMATS[unit])
+        elif unit in UNIT_FORMATS:
+            values = _format(values.astype('float64').replace([np.inf, -np.inf], np.nan), UNIT_FORMATS[unit])
+
+        if column in orders:
+            name = f'{orders[column]}.{column}(억)' if unit == 'KRW' else f'{orders[column]}.{column}'
+        else:
+            name = column
+        columns[name] = values
+
+    return pd.DataFrame(columns, index=df.index)
@@ -1,37 +1,67 @@
 
-import dart_fss as dart
 import pandas as pd
 
+from cache_helper import cached_get_dividend
+from plan_helper import fetch_covering
+from profile_helper import profiled
 
-def yearly_dividends_from_dart(corp_code, start, end):
-    dividends = []
-    for year in range(start, end + 1):
-        try:
-            # dart api 를 이용, 배당정보추출
-            dividend = dart.api.info.get_dividend(corp_code, bsns_year=str(year), reprt_code='11011')
-            print(f'{year} Retrieve dividend data')
-            dividends.append({'year': year, 'dividend': dividend})
-        except:
-            print(f"{year} Can't retrieve dividend data")
 
-    return dividends
+@profiled('dividend.dividend_in_year')
+def dividend_in_year(corp_code, year):
+    """
+    사업보고서의 배당정보, 공시가 없거나 재시도 후에도 받지 못하면 None
+    이용한도 초과는 FetchPolicy 에 따라 기다리거나 QuotaExhausted 가 발생함
+    """
+    # dart api 를 이용, 배당정보추출
+    dividend = cached_get_dividend(corp_code, bsns_year=str(year), reprt_code='11011')
+    if dividend is None:
+        print(f"{year} Can't retrieve dividend data")
+        return None
+    print(f'{year} Retrieve dividend data')
+    return {'year': year, 'dividend': dividend}
 
 
-def extract_df_from_dividends_raw(divdends_raw, criterion):
+@profiled('dividend.yearly_dividends_from_dart')
+def yearly_dividends_from_dart(corp_code, start, end, max_workers=None):
+    """
+    배당정보 하나에 3년치(thstrm, frmtrm, lwfr)가 있으므로 [start, end] 를 포함하는 사업보고서만 요청
+    최근 보고서 순으로 반환하므로 중복 연도는 최근 보고서의 값이 먼저 옴
+    """
+    filings, _ = fetch_covering(start, end, lambda year: dividend_in_year(corp_code, year),
+                                max_workers=max_workers, name=f'[{corp_code}] dividend')
+    return [dividend for _, dividend in filings]
+
+
+EXTRACT_COLUMNS = ['thstrm', 'frmtrm', 'lwfr']  # 올해, 작년, 재작년
+
+
+def _number(value):
+    # '1,000' -> 1000.0, '-' 또는 빈 값은 NaN
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return float('nan')
 
-    results = []
-    for div in divdends_raw:
-        if div['dividend'] is not None:
-            try:
-                r = next((item for item in div['dividend']['list'] if
-                          all(v in item[k] for k, v in criterion.items())), None)
 
-                extract_columns = ['thstrm', 'frmtrm', 'lwfr']  # 올해, 작년, 재작년
-                results.extend([{'year': div['year'] - offset_year, criterion['se']: float(r[column].replace(',', ''))}
-                                for offset_year, column in enumerate(extract_columns)])
+def dividend_values(div, criterion):
+    """
+    배당정보 하나에서 criterion 을 만족하는 항목의 {연도: 값}, 없으면 빈 dict
+    """
+    if div is None or div['dividend'] is None:
+        return {}
+    r = next((item for item in div['dividend'].get('list', []) if
+              all(v in (item.get(k) or '') for k, v in criterion.items())), None)
+    if r is None:
+        print(f'dividend - no result satisfying criterion: {criterion}')
+        return {}
+    return {div['year'] - offset_year: _number(r.get(column))
+            for offset_year, column in enumerate(EXTRACT_COLUMNS)}
 
-            except:
-                print(f'dividend - no result satisfying criterion: {criterion}')
+
+def extract_df_from_dividends_raw(divdends_raw, criterion):
+
+    results = [{'year': year, criterion['se']: value}
+               for div in divdends_raw for year, value in dividend_values(div, criterion).items()]
 
     if len(results) > 0:
         df = pd.DataFrame(results)
@@ -41,15 +71,18 @@ def extract_df_from_dividends_raw(divdends_raw, criterion):
     return None
 
 
+@profiled('dividend.yearly_dividends')
 def yearly_dividends(dividends_raw, criteria):
-    mdf = None
-    for criterion in criteria:
-        df = extract_df_from_dividends_raw(dividends_raw, criterion)
-        if df is not None:
-            if mdf is not None:
-                mdf = pd.merge(mdf, df, on='year', how='outer')
-            else:
-                mdf = df
-
-    mdf = mdf[~mdf.index.duplicated(keep='first')]
-    return mdf
\ No newline at end of file
+    """
+    dividends_raw 는 최근 보고서 순, 같은 연도/항목은 최근 보고서의 값을 사용
+    모든 항목을 한번에 모아서 DataFrame 을 한번만 만듦
+    """
+    values = {}
+    for div in dividends_raw:  # 우선순위 순
+        for criterion in criteria:
+            for year, value in dividend_values(div, criterion).items():
+                values.setdefault(year, {}).setdefault(criterion['se'], value)
+
+    df = pd.DataFrame.from_dict(values, orient='index', columns=[c['se'] for c in criteria])
+    df.index.name = 'year'
+    return df.sort_index()
@@ -0,0 +1,220 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+import dart_fss as dart
+import pandas as pd
+from dart_fss.errors import NoDataReceived
+
+import share_helper
+from policy_helper import dart_get, request_finstate_all
+from replay_helper import Fixtures, patched, replay_prices
+
+NO_DATA = {'status': '013', 'message': '조회된 데이타가 없습니다.'}
+OVER_LIMIT = {'status': '020', 'message': '요청 제한을 초과하였습니다.'}
+
+
+def _records(df):
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+class FakeDartServer:
+    """
+    녹화한 fixtures 로 OpenDART API 를 흉내내는 로컬 HTTP 서버
+
+    - fnlttSinglAcntAll, fnlttMultiAcnt, list, alotMatter(배당) 와 sub_docs(문서 목록) json
+    - /document?url=... 로 공시 문서 html
+    - latency 초만큼 늦게 응답하고, quota 건을 넘으면 020(요청 제한 초과)으로 응답
+
+    with FakeDartServer(fixtures) as server: 처럼 사용하며 server.url 이 base_url
+    """
+
+    def __init__(self, fixtures, latency=0.0, quota=None, host='127.0.0.1', port=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.quota = quota
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def origin(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def url(self):
+        return f'{self.origin}/api/'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def _count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            return sum(self.requests.values())
+
+    def _lookup(self, key):
+        entry = self.fixtures.entries.get(key)
+        return None if entry is None or entry[0] != 'ok' else entry[1]
+
+    def finstate_all(self, q):
+        df = self._lookup(Fixtures.finstate_key(q['corp_code'], q['bsns_year'], q.get('reprt_code', '11011'),
+                                                q.get('fs_div', 'CFS')))
+        return NO_DATA if df is None or len(df) == 0 else {'status': '000', 'message': '정상', 'list': _records(df)}
+
+    def multi_accounts(self, q):
+        rows = []
+        for corp_code in q['corp_code'].split(','):
+            df = self._lookup(Fixtures.finstate_key(corp_code, q['bsns_year'], q.get('reprt_code', '11011')))
+            if df is not None and len(df) > 0:
+                rows.append(df.assign(corp_code=corp_code, fs_div='CFS'))
+        if len(rows) == 0:
+            return NO_DATA
+        return {'status': '000', 'message': '정상', 'list': _records(pd.concat(rows, ignore_index=True))}
+
+    def filings(self, q):
+        # 녹화된 공시목록 중 해당 회사, 기간의 것
+        corp_code = q.get('corp_code', '')
+        frames = [entry[1] for key, entry in self.fixtures.entries.items()
+                  if key[0] == 'list' and entry[0] == 'ok' and entry[1] is not None and len(entry[1]) > 0
+                  and (not corp_code or key[1] == corp_code)]
+        if len(frames) == 0:
+            return NO_DATA
+        df = pd.concat(frames, ignore_index=True).drop_duplicates('rcept_no')
+        if 'rcept_dt' in df:
+            df = df[(df['rcept_dt'] >= q.get('bgn_de', '')) & (df['rcept_dt'] <= q.get('end_de', '99999999'))]
+        if len(df) == 0:
+            return NO_DATA
+        return {'status': '000', 'message': '정상', 'page_no': 1, 'total_page': 1, 'total_count': len(df),
+                'list': _records(df.sort_values('rcept_no', ascending=False))}
+
+    def dividend(self, q):
+        value = self._lookup(Fixtures.dividend_key(q['corp_code'], q['bsns_year'], q.get('reprt_code', '11011')))
+        return NO_DATA if value is None else value
+
+    def sub_docs(self, q):
+        df = self._lookup(Fixtures.sub_docs_key(q['rcept_no'], q.get('match') or None))
+        if df is None or len(df) == 0:
+            return NO_DATA
+        df = df.assign(url=[f'{self.origin}/document?url={quote(u, safe="")}' for u in df['url']])
+        return {'status': '000', 'message': '정상', 'list': _records(df)}
+
+    def _handler(self):
+        server = self
+        routes = {'/api/fnlttSinglAcntAll.json': self.finstate_all,
+                  '/api/fnlttMultiAcnt.json': self.multi_accounts,
+                  '/api/list.json': self.filings,
+                  '/api/alotMatter.json': self.dividend,
+                  '/api/sub_docs.json': self.sub_docs}
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                q = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                count = server._count(parsed.path)
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if parsed.path == '/document':
+                    entry = server._lookup(Fixtures.document_key(q.get('url', '')))
+                    if entry is None:
+                        return self._send(404, b'not recorded', 'text/plain')
+                    content, encoding = entry
+                    return self._send(200, content, f'text/html; charset={encoding or "utf-8"}')
+
+                route = routes.get(parsed.path)
+                if route is None:
+                    return self._send(404, b'{}', 'application/json')
+                body = OVER_LIMIT if server.quota is not None and count > server.quota else route(q)
+                self._send(200, json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+        return Handler
+
+
+class FakeOpenDart:
+    """
+    가짜 서버에 요청하는 OpenDartReader 대용, api_key 와 base_url 이 있으므로 CachedOpenDart 는
+    finstate_all 을 서버에 직접 요청하여 응답 status 를 구분함
+    """
+
+    def __init__(self, server, api_key='fake'):
+        self.server = server
+        self.api_key = api_key
+        self.base_url = server.url
+
+    def find_corp_code(self, corp):
+        return self.server.fixtures.corp_code(corp)
+
+    def finstate_all(self, corp, bsns_year, reprt_code='11011', fs_div='CFS'):
+        try:
+            return request_finstate_all(self.api_key, self.find_corp_code(corp), bsns_year, reprt_code, fs_div,
+                                        self.base_url)
+        except NoDataReceived:
+            return pd.DataFrame()
+
+    def list(self, corp=None, start=None, end=None, kind='', kind_detail='', final=True):
+        params = {'corp_code': self.find_corp_code(corp) if corp else '',
+                  'bgn_de': pd.to_datetime(start or '1990-01-01').strftime('%Y%m%d'),
+                  'end_de': pd.to_datetime(end or pd.Timestamp.today()).strftime('%Y%m%d'),
+                  'pblntf_ty': kind}
+        try:
+            return pd.DataFrame(dart_get(self.api_key, 'list', params, self.base_url)['list'])
+        except NoDataReceived:
+            return pd.DataFrame()
+
+    def sub_docs(self, s, match=None):
+        try:
+            jo = dart_get(self.api_key, 'sub_docs', {'rcept_no': str(s), 'match': match or ''}, self.base_url)
+        except NoDataReceived:
+            return pd.DataFrame()
+        return pd.DataFrame(jo['list'])
+
+    def get_dividend(self, corp_code, bsns_year, reprt_code='11011'):
+        # dart_fss 의 get_dividend 처럼 json 을 그대로 반환, 데이터가 없으면 NoDataReceived
+        return dart_get(self.api_key, 'alotMatter', {'corp_code': corp_code, 'bsns_year': str(bsns_year),
+                                                     'reprt_code': reprt_code}, self.base_url)
+
+
+@contextmanager
+def serving(server):
+    """
+    배당(get_dividend)은 가짜 서버로, 주가(FinanceDataReader)는 fixtures 로 재생
+    공시 문서는 sub_docs 가 서버의 /document 주소를 주므로 실제 HTTP 로 받음
+    """
+    opendart = FakeOpenDart(server)
+    with patched([(dart.api.info, 'get_dividend', opendart.get_dividend),
+                   (share_helper.fdr, 'DataReader', replay_prices(server.fixtures))]):
+        yield opendart
@@ -0,0 +1,210 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from share_helper import get_price_store
+
+
+# 손익계산서 계정(기간 동안의 합), 나머지 계정은 기말 잔액
+FLOW_COLUMNS = ['매출액', '지배기업소유주당기순이익']
+INCOME_COLUMN = '지배기업소유주당기순이익'
+EQUITY_COLUMN = '지배기업소유주자본'
+SHARES_COLUMN = '주식수'
+PRICE_COLUMN = '주가'
+
+QUARTERS = {'1Q': 1, '2Q': 2, '3Q': 3, '4Q': 4}
+
+
+def period_positions(panel):
+    """
+    period level 을 연속된 정수로 바꿈, 연간은 연도, 분기는 연도 * 4 + (분기 - 1)
+    period 는 2020, '2020' 또는 '2020.1Q' 형식
+
+    :return: (정수 위치 배열, 분기 여부)
+    """
+    periods = panel.index.get_level_values('period').astype(str)
+    years = np.asarray(periods.str[:4], dtype=np.int64)
+    quarterly = bool(periods.str.contains('.', regex=False).any())
+    if not quarterly:
+        return years, False
+    quarters = np.asarray(periods.str[5:].map(QUARTERS), dtype=np.int64)
+    return years * 4 + quarters - 1, True
+
+
+def _keyed(panel, positions):
+    corp_codes = panel.index.get_level_values('corp_code')
+    return pd.MultiIndex.from_arrays([corp_codes, positions], names=['corp_code', 'position'])
+
+
+def lagged(panel, columns, lag, positions=None):
+    """
+    같은 회사의 lag 기간 전 값, 그 기간이 없으면 NaN
+    shift 가 아닌 (corp_code, 위치 - lag) 로 찾으므로 중간에 빠진 기간이 있어도 어긋나지 않음
+    """
+    if positions is None:
+        positions, _ = period_positions(panel)
+    keyed = panel[columns].set_axis(_keyed(panel, positions))
+    shifted = keyed.reindex(_keyed(panel, positions - lag))
+    return shifted.set_axis(panel.index)
+
+
+def standalone_quarters(panel, columns=None, positions=None):
+    """
+    분기 panel 의 4Q 는 사업보고서의 연간 누계이므로 연간 - (1Q + 2Q + 3Q) 로 4분기 값만 남김
+    1Q ~ 3Q 중 하나라도 없으면 4Q 는 NaN
+    """
+    columns = [c for c in (columns or FLOW_COLUMNS) if c in panel.columns]
+    if positions is None:
+        positions, _ = period_positions(panel)
+
+    panel = panel.copy()
+    if len(columns) == 0:
+        return panel
+    is_4q = (positions % 4) == 3
+    previous = sum(lagged(panel, columns, lag, positions).to_numpy(dtype='float64') for lag in (1, 2, 3))
+    values = panel[columns].to_numpy(dtype='float64')
+    panel[columns] = np.where(is_4q[:, None], values - previous, values)
+    return panel
+
+
+def trailing_sum(panel, columns, window=4, positions=None):
+    """
+    최근 window 기간의 합(TTM), 한 기간이라도 없으면 NaN
+    """
+    if positions is None:
+        positions, _ = period_positions(panel)
+    total = panel[columns].to_numpy(dtype='float64').copy()
+    for lag in range(1, window):
+        total += lagged(panel, columns, lag, positions).to_numpy(dtype='float64')
+    return pd.DataFrame(total, index=panel.index, columns=columns)
+
+
+def growth(panel, columns, lag, positions=None):
+    """
+    lag 기간 전 대비 증가율, 기준값이 0 이하이면 NaN
+    """
+    if positions is None:
+        positions, _ = period_positions(panel)
+    current = panel[columns].to_numpy(dtype='float64')
+    base = lagged(panel, columns, lag, positions).to_numpy(dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(base > 0, current / base - 1, np.nan)
+    return pd.DataFrame(rate, index=panel.index, columns=columns)
+
+
+def _divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype='float64')
+    denominator = np.asarray(denominator, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator != 0, numerator / denominator, np.nan)
+
+
+def derive_metrics(panel, flow_columns=None):
+    """
+    (corp_code, period) index 의 panel 에 파생지표를 한번에 계산하여 column 으로 추가
+    연간 panel 은 batch_helper.stack_panel, 분기 panel 은 FactStore.query 등의 결과
+
+    연간: YoY, ROE(기초/기말 평균 자본), EPS, BPS, 주가가 있으면 PER, PBR
+    분기: 4Q 를 4분기 단독값으로 바꾸고, TTM, YoY, QoQ, ROE(TTM 이익 / 1년전과 평균 자본), EPS(TTM), BPS, PER, PBR
+    증가율과 ROE 는 비율(0.1 = 10%)
+    """
+    positions, quarterly = period_positions(panel)
+    panel = panel.iloc[np.lexsort((positions, panel.index.get_level_values('corp_code')))]
+    positions, _ = period_positions(panel)
+
+    flow_columns = [c for c in (flow_columns or FLOW_COLUMNS) if c in panel.columns]
+    year_lag = 4 if quarterly else 1
+    metrics = {}
+
+    if quarterly:
+        panel = standalone_quarters(panel, flow_columns, positions)
+        ttm = trailing_sum(panel, flow_columns, 4, positions)
+        for column in flow_columns:
+            metrics[f'{column}_TTM'] = ttm[column]
+        qoq = growth(panel, flow_columns, 1, positions)
+        for column in flow_columns:
+            metrics[f'{column}_QoQ'] = qoq[column]
+        income = ttm[INCOME_COLUMN] if INCOME_COLUMN in ttm else None
+    else:
+        income = panel[INCOME_COLUMN] if INCOME_COLUMN in panel else None
+
+    yoy = growth(panel, flow_columns, year_lag, positions)
+    for column in flow_columns:
+        metrics[f'{column}_YoY'] = yoy[column]
+
+    if income is not None and EQUITY_COLUMN in panel:
+        equity = panel[EQUITY_COLUMN].to_numpy(dtype='float64')
+        previous = lagged(panel, [EQUITY_COLUMN], year_lag, positions)[EQUITY_COLUMN].to_numpy(dtype='float64')
+        # 기초 자본이 없으면 기말 자본만 사용 (rolling(min_periods=1) 과 같음)
+        average = np.where(np.isnan(previous), equity, (equity + previous) / 2)
+        metrics['ROE'] = _divide(income, average)
+
+    if SHARES_COLUMN in panel:
+        shares = panel[SHARES_COLUMN].to_numpy(dtype='float64')
+        if income is not None:
+            metrics['EPS'] = _divide(income, shares)
+        if EQUITY_COLUMN in panel:
+            metrics['BPS'] = _divide(panel[EQUITY_COLUMN], shares)
+
+    if PRICE_COLUMN in panel:
+        price = panel[PRICE_COLUMN].to_numpy(dtype='float64')
+        if 'EPS' in metrics:
+            metrics['PER'] = _divide(price, metrics['EPS'])
+        if 'BPS' in metrics:
+            metrics['PBR'] = _divide(price, metrics['BPS'])
+
+    metrics = pd.DataFrame({k: np.asarray(v, dtype='float64') for k, v in metrics.items()}, index=panel.index)
+    return pd.concat([panel, metrics], axis=1)
+
+
+def _no_prices():
+    index = pd.MultiIndex.from_arrays([[], []], names=['corp_code', 'period'])
+    return pd.Series(index=index, dtype='float64', name=PRICE_COLUMN)
+
+
+def panel_prices(stock_codes, start, end, quarterly=False, store=None):
+    """
+    여러 회사의 기간말 주가를 (corp_code, period) index 의 '주가' Series 로
+    yearly_share_prices/quarterly_share_prices 와 같은 PriceStore 를 쓰되 종목 전체를 한번에 읽음
+
+    :param stock_codes: {corp_code: stock_code}
+    :return: 주가가 없으면 빈 Series, index 는 같은 (corp_code, period)
+    """
+    store = store or get_price_store()
+    closes = store.closes(sorted(set(stock_codes.values())), date(start, 1, 1), date(end, 12, 31))
+    if len(closes) == 0:
+        return _no_prices()
+
+    index = pd.DatetimeIndex(closes.index)
+    if quarterly:
+        keys = [f'{y}.{q}Q' for y, q in zip(index.year, index.quarter)]
+    else:
+        keys = list(index.year)
+    # 기간별 마지막 거래일의 종가 (period_end_prices 와 같음)
+    last = closes.groupby(keys, sort=True).last()
+
+    columns = {corp_code: last[stock_code] for corp_code, stock_code in stock_codes.items()
+               if stock_code in last}
+    if len(columns) == 0:
+        return _no_prices()
+    prices = pd.DataFrame(columns).stack()
+    prices.index = prices.index.swaplevel().set_names(['corp_code', 'period'])
+    return prices.sort_index().rename(PRICE_COLUMN)
+
+
+def with_prices(panel, stock_codes, quarterly=False, store=None):
+    """
+    panel 에 '주가' 가 없으면 panel_prices 로 채워 넣음, period 형식은 panel 을 따름
+    """
+    if PRICE_COLUMN in panel.columns:
+        return panel
+    periods = panel.index.get_level_values('period')
+    years = periods.astype(str).str[:4].astype(int)
+    prices = panel_prices(stock_codes, int(years.min()), int(years.max()), quarterly, store)
+
+    keys = pd.MultiIndex.from_arrays([panel.index.get_level_values('corp_code'), periods.astype(str)])
+    prices.index = prices.index.set_levels(prices.index.levels[1].astype(str), level='period')
+    panel = panel.copy()
+    panel[PRICE_COLUMN] = prices.reindex(keys).to_numpy()
+    return panel
@@ -0,0 +1,189 @@
+import time
+
+import pandas as pd
+from dart_fss.errors import NoDataReceived
+
+from cache_helper import get_cache, ttl_for_deadline, report_deadline
+from plan_helper import plan_filings, covered_years
+from policy_helper import DART_API_URL, dart_get
+from scheduler_helper import dart_limiter
+from statement_helper import (get_accounts, account_matcher, resolve_accounts, account_values, finstate_in_year,
+                              finstate_of_report, REPRT_CODES)
+from store_helper import frame_to_facts
+
+
+# 다중회사 주요계정은 한번에 여러 corp_code 를 ',' 로 이어서 요청
+MULTI_CORP_BATCH = 100
+
+# 다중회사 주요계정 응답에 있는 계정명(account_nm), account_id 와 account_detail 은 없음
+MULTI_ACCOUNT_NAMES = ['유동자산', '비유동자산', '자산총계', '유동부채', '비유동부채', '부채총계', '자본금',
+                       '이익잉여금', '자본총계', '매출액', '영업이익', '법인세차감전 순이익', '당기순이익']
+
+
+def multi_labels(accounts):
+    """
+    accounts 중 다중회사 주요계정으로 찾을 수 있는 계정 label 들
+    나머지 계정은 회사마다 finstate_all 로 가져옴
+    """
+    names = pd.DataFrame({'account_nm': MULTI_ACCOUNT_NAMES})
+    resolved = resolve_accounts(names, account_matcher(accounts))
+    return {a['label'] for a in accounts if len(a['conditions']) > 0 and a['label'] in resolved}
+
+
+def request_multi_accounts(api_key, corp_codes, year, reprt_code='11011', base_url=DART_API_URL, session=None):
+    """
+    다중회사 주요계정(fnlttMultiAcnt) 한번의 요청
+
+    :return: 응답의 list 를 DataFrame 으로, 데이터가 없으면 빈 DataFrame
+             일시적인 오류, 이용한도 초과는 예외로 전달되어 multi_accounts 의 FetchPolicy 가 처리함
+    """
+    params = {'corp_code': ','.join(corp_codes),
+              'bsns_year': str(year),
+              'reprt_code': reprt_code}
+    dart_limiter.acquire()
+    try:
+        jo = dart_get(api_key, 'fnlttMultiAcnt', params, base_url, session)
+    except NoDataReceived:  # 013: 조회된 데이터가 없음, 묶음 안의 회사는 finstate_all 로 다시 확인함
+        return pd.DataFrame()
+    return pd.DataFrame(jo['list'])
+
+
+def multi_accounts(api_key, corp_codes, year, reprt_code='11011', base_url=DART_API_URL, session=None,
+                   batch_size=MULTI_CORP_BATCH):
+    """
+    corp_codes 를 batch_size 개씩 묶어 요청하고 결과를 이어 붙임, 묶음별로 캐시함
+    """
+    corp_codes = sorted(set(corp_codes))
+    ttl = ttl_for_deadline(report_deadline(int(year), reprt_code))
+    dfs = []
+    for i in range(0, len(corp_codes), batch_size):
+        batch = corp_codes[i:i + batch_size]
+        dfs.append(get_cache().fetch('multi_accounts', ','.join(batch), int(year),
+                                     lambda: request_multi_accounts(api_key, batch, year, reprt_code, base_url,
+                                                                    session),
+                                     reprt_code=reprt_code, ttl=ttl, limited=False))
+    dfs = [df for df in dfs if df is not None and len(df) > 0]
+    return pd.concat(dfs, ignore_index=True) if len(dfs) > 0 else pd.DataFrame()
+
+
+def split_multi_accounts(rows, year, accounts, quarter=None):
+    """
+    다중회사 응답을 회사별 finstate_in_year(또는 분기) 모양의 DataFrame 으로 나눔
+    연결재무제표(CFS)가 있으면 연결, 없으면 별도(OFS)를 사용
+
+    :return: {corp_code: DataFrame}
+    """
+    frames = {}
+    if rows is None or len(rows) == 0:
+        return frames
+
+    matcher = account_matcher(accounts)
+    for corp_code, finstate in rows.groupby('corp_code', sort=False):
+        cfs = finstate[finstate['fs_div'] == 'CFS']
+        finstate = cfs if len(cfs) > 0 else finstate
+        resolved = resolve_accounts(finstate, matcher)
+
+        series = []
+        for account in accounts:
+            if account['label'] in resolved:
+                account_row = finstate.iloc[resolved[account['label']][1][0]]
+                s = pd.Series(account_values(account_row, year, quarter), name=account['label'])
+                s.index.name = 'year'
+                series.append(s)
+        df = pd.DataFrame({s.name: s for s in series})
+        df.attrs['rcept_no'] = finstate['rcept_no'].iloc[0]
+        frames[corp_code] = df
+    return frames
+
+
+def finstate_of_companies(corp_codes, year, accounts, opendart, api_key, reprt_code='11011',
+                          base_url=DART_API_URL, session=None, batch_size=MULTI_CORP_BATCH):
+    """
+    여러 회사의 계정값을 다중회사 주요계정으로 한번에 가져오고,
+    주요계정에 없는 계정(또는 주요계정 응답에 빠진 계정)이 있는 회사만 finstate_all 로 다시 가져와 빈 계정만 채움
+    accounts 가 모두 주요계정에 있으면 finstate_all 은 요청하지 않음
+
+    :return: {corp_code: DataFrame}, 사업보고서는 finstate_in_year, 분기보고서는 finstate_of_report 모양
+    """
+    quarter = None if reprt_code == '11011' else REPRT_CODES[reprt_code]
+    multi = len(multi_labels(accounts)) > 0
+    rows = multi_accounts(api_key, corp_codes, year, reprt_code, base_url, session, batch_size) if multi else None
+    frames = split_multi_accounts(rows, year, accounts, quarter)
+
+    wanted = {a['label'] for a in accounts if len(a['conditions']) > 0}
+    fallbacks = 0
+    for corp_code in corp_codes:
+        df = frames.get(corp_code)
+        if df is not None and wanted.issubset(df.columns):
+            continue
+
+        fallbacks += 1
+        if reprt_code == '11011':
+            full = finstate_in_year(corp_code, year, accounts, opendart)
+        else:
+            full = finstate_of_report(corp_code, year, reprt_code, accounts, opendart)
+        if full is None:
+            continue
+        if df is None:
+            frames[corp_code] = full
+        else:
+            missing = [c for c in full.columns if c not in df.columns]
+            merged = df.join(full[missing], how='outer')
+            merged.attrs['rcept_no'] = df.attrs.get('rcept_no')
+            frames[corp_code] = merged
+
+    print(f'[multi] {year} {reprt_code}: {len(corp_codes)}개 회사, '
+          f'다중회사 요청 {(len(set(corp_codes)) + batch_size - 1) // batch_size if multi else 0}건, '
+          f'finstate_all {fallbacks}건')
+    return frames
+
+
+def prefetch_to_store(corp_codes, start, end, opendart, api_key, store, quarterly=False, accounts=None,
+                      base_url=DART_API_URL, session=None, batch_size=MULTI_CORP_BATCH):
+    """
+    여러 회사의 [start, end] 계정값을 묶음 요청으로 가져와 FactStore 에 저장
+    이후 yearly/quarterly_company_performance 에 store 를 주면 네트워크 대신 store 를 읽음
+    연간은 사업보고서의 3년치를 이용해 필요한 연도만 요청하고, 빠진 회사는 이웃 연도로 다시 요청함
+    """
+    accounts = accounts or get_accounts()
+    corp_codes = list(corp_codes)
+    filings = []  # (보고서 연도, reprt_code, facts)
+
+    def collect(year, reprt_code, frames):
+        for corp_code, df in frames.items():
+            filings.append((year, reprt_code, frame_to_facts(df, corp_code, df.attrs.get('rcept_no'))))
+
+    if quarterly:
+        for year in range(start, end + 1):
+            for reprt_code in REPRT_CODES:
+                collect(year, reprt_code, finstate_of_companies(corp_codes, year, accounts, opendart, api_key,
+                                                                reprt_code, base_url, session, batch_size))
+    else:
+        # 회사별로 아직 채워지지 않은 연도
+        uncovered = {c: set(range(start, end + 1)) for c in corp_codes}
+        tried = set()
+        while any(uncovered.values()):
+            planned = set()
+            for years in uncovered.values():
+                planned.update(plan_filings(years, end, tried)[0])
+            if len(planned) == 0:
+                break
+            for year in sorted(planned, reverse=True):
+                targets = [c for c, years in uncovered.items() if years & covered_years(year)]
+                frames = finstate_of_companies(targets, year, accounts, opendart, api_key, '11011',
+                                               base_url, session, batch_size)
+                collect(year, '11011', frames)
+                for corp_code, df in frames.items():
+                    if len(df) > 0:
+                        uncovered[corp_code] -= covered_years(year)
+            tried |= planned
+
+    if len(filings) == 0:
+        return 0
+
+    # store 는 같은 키의 나중 값을 사용하므로, 오래된 보고서부터 쓰면 최근 보고서(정정된 수치)가 우선함
+    filings.sort(key=lambda e: e[0])
+    facts = pd.concat([f for _, _, f in filings], ignore_index=True)
+    facts['fetched'] = time.time()
+    store.write(facts)
+    return len(filings)
@@ -0,0 +1,95 @@
+from scheduler_helper import run_as_completed
+
+
+# 사업보고서의 finstate_all 은 당기, 전기, 전전기(thstrm, frmtrm, bfefrmtrm),
+# 배당정보는 당기, 전기, 전전기(thstrm, frmtrm, lwfr) 의 3년치를 포함함
+ANNUAL_WINDOW = 3
+
+
+def _is_missing(value):
+    if value is None:
+        return True
+    empty = getattr(value, 'empty', None)
+    return empty if isinstance(empty, bool) else False
+
+
+def covered_years(year, window=ANNUAL_WINDOW):
+    """
+    year 보고서가 포함하는 연도들, 예) 2020 -> {2018, 2019, 2020}
+    """
+    return set(range(year - window + 1, year + 1))
+
+
+def plan_filings(uncovered, latest, tried=(), window=ANNUAL_WINDOW):
+    """
+    uncovered 연도를 모두 포함하는 가장 적은 보고서 연도 목록
+    가장 최근의 연도부터 그 연도를 포함하는 보고서를 고르며, 이미 시도한(없는) 보고서는
+    그 연도를 포함하는 이웃 연도(year+1, year+2 ...)의 보고서로 대체함
+
+    :param uncovered: 아직 값이 없는 연도들
+    :param latest: 조회할 수 있는 가장 최근 보고서 연도
+    :param tried: 이미 요청한 보고서 연도
+    :return: (요청할 보고서 연도 목록, 어떤 보고서로도 채울 수 없는 연도들)
+    """
+    remaining = set(uncovered)
+    tried = set(tried)
+    planned, unreachable = [], set()
+
+    while remaining:
+        year = max(remaining)
+        candidate = next((y for y in range(year, min(year + window - 1, latest) + 1) if y not in tried), None)
+        if candidate is None:
+            unreachable.add(year)
+            remaining.discard(year)
+            continue
+        planned.append(candidate)
+        tried.add(candidate)
+        remaining -= covered_years(candidate, window)
+
+    return planned, unreachable
+
+
+def iter_covering(start, end, fetch, window=ANNUAL_WINDOW, max_workers=None, stats=None):
+    """
+    fetch_covering 과 같은 보고서들을 요청하되 받는 대로 (보고서 연도, 결과) 를 yield, 없는 보고서는 건너뜀
+    보고서가 없으면 이웃 연도의 보고서로 다시 계획하여 요청함
+
+    :param stats: dict 가 주어지면 끝난 뒤 통계를 채움
+    """
+    uncovered = set(range(start, end + 1))
+    tried = set()
+    missing = set()
+
+    while uncovered:
+        planned, unreachable = plan_filings(uncovered, end, tried, window)
+        missing |= unreachable
+        uncovered -= unreachable
+        if len(planned) == 0:
+            break
+
+        tried.update(planned)
+        for year, value in run_as_completed(fetch, planned, max_workers):
+            if not _is_missing(value):
+                uncovered -= covered_years(year, window)
+                yield year, value
+
+    if stats is not None:
+        stats.update({'requested': len(tried), 'naive': end - start + 1,
+                      'saved': (end - start + 1) - len(tried), 'missing': sorted(missing)})
+
+
+def fetch_covering(start, end, fetch, window=ANNUAL_WINDOW, max_workers=None, name=''):
+    """
+    [start, end] 를 포함하는 가장 적은 수의 보고서만 요청
+    보고서가 없으면 이웃 연도의 보고서로 다시 계획하여 요청함
+
+    :param fetch: 보고서 연도를 받아 결과를 반환하는 함수, 없으면 None 또는 빈 DataFrame
+    :return: ([(보고서 연도, 결과), ...] 최근 보고서 순, 통계 dict)
+             최근 보고서가 앞에 있으므로 중복 연도는 첫번째 값(정정된 최신 수치)을 사용하면 됨
+    """
+    stats = {}
+    results = dict(iter_covering(start, end, fetch, window, max_workers, stats))
+    print(f'{name} {start}~{end}: {stats["requested"]}건 요청, {stats["saved"]}건 절약'
+          + (f', 보고서 없음 {stats["missing"]}' if stats['missing'] else ''))
+
+    return sorted(results.items(), key=lambda e: e[0], reverse=True), stats
@@ -0,0 +1,177 @@
+import os
+import random
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pandas as pd
+import requests
+from dart_fss.errors import (InvalidField, NoDataReceived, NotFoundConsolidated, OverQueryLimit, TemporaryLocked,
+                             ServiceClose, UnknownError, check_status)
+
+from profile_helper import profiler
+from scheduler_helper import KST
+
+
+DART_API_URL = 'https://opendart.fss.or.kr/api/'
+
+# 요청 결과의 종류
+OK = 'ok'
+NO_FILING = 'no-filing'     # 공시가 없음, 다시 요청해도 같음 (캐시함)
+TRANSIENT = 'transient'     # 네트워크, 서버 오류 등 다시 요청하면 될 수 있음 (캐시하지 않음)
+QUOTA = 'quota'             # 이용한도 초과, 한도가 초기화될 때까지 기다리거나 중단
+
+Outcome = namedtuple('Outcome', ['status', 'value', 'error'])
+
+DEFAULT_RETRIES = int(os.environ.get('DART_RETRIES', 3))
+DEFAULT_BACKOFF = 1.0       # 첫 재시도 전 대기시간(초), 재시도마다 2배
+MAX_BACKOFF = 60.0
+DEFAULT_ON_QUOTA = os.environ.get('DART_ON_QUOTA', 'pause')
+
+
+class QuotaExhausted(RuntimeError):
+    """
+    이용한도를 초과하여 더 진행할 수 없을 때, 빈 결과 대신 실행을 멈추기 위해 발생
+    """
+
+
+def classify(error):
+    """
+    예외를 요청 결과의 종류로 분류, 다시 시도해도 소용없는 오류(잘못된 키, 필드, 코드 오류 등)는 None
+    """
+    if isinstance(error, (NoDataReceived, NotFoundConsolidated)):
+        return NO_FILING
+    if isinstance(error, (OverQueryLimit, TemporaryLocked, QuotaExhausted)):
+        return QUOTA
+    if isinstance(error, (ServiceClose, UnknownError, requests.ConnectionError, requests.Timeout,
+                          requests.exceptions.ChunkedEncodingError, requests.exceptions.JSONDecodeError)):
+        return TRANSIENT
+    if isinstance(error, requests.HTTPError):
+        status = getattr(error.response, 'status_code', None)
+        return TRANSIENT if status is None or status >= 500 or status == 429 else None
+    return None
+
+
+def unavailable_as_no_filing(func, name=''):
+    """
+    다시 요청해도 결과가 같은 오류(4xx 응답, 잘못된 요청 field)를 NoDataReceived 로 바꾸는 func
+    FetchPolicy 에서 공시 없음으로 처리되어 캐시되고 빈 결과가 됨
+    5xx 등 일시적인 오류와 그 밖의 오류(코드 오류 등)는 그대로 발생
+    """
+    def call():
+        try:
+            return func()
+        except requests.HTTPError as e:
+            if classify(e) is not None:
+                raise
+            raise NoDataReceived(f'{name}: {e}') from e
+        except InvalidField as e:
+            raise NoDataReceived(f'{name}: {e}') from e
+    return call
+
+
+def seconds_until_quota_reset(now=None):
+    now = now or datetime.now(KST)
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=5, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class FetchPolicy:
+    """
+    요청 하나를 실행하고 결과를 Outcome 으로 돌려줌
+    일시적인 오류는 지수적으로 늘어나는 간격으로 retries 번까지 다시 시도하고,
+    이용한도 초과는 on_quota 에 따라 한도가 초기화될 때까지 기다리거나('pause') QuotaExhausted 를 발생('raise')
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=MAX_BACKOFF,
+                 on_quota=DEFAULT_ON_QUOTA, sleep=time.sleep):
+        if on_quota not in ('pause', 'raise'):
+            raise ValueError(f"on_quota 는 'pause' 또는 'raise': {on_quota}")
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_quota = on_quota
+        self.sleep = sleep
+
+    def delay(self, attempt):
+        # 여러 쓰레드가 동시에 다시 시도하지 않도록 jitter 를 줌
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def run(self, func, name=''):
+        attempt = 0
+        paused = False
+        while True:
+            try:
+                return Outcome(OK, func(), None)
+            except Exception as e:
+                status = classify(e)
+                if status is None:
+                    raise
+                if status == NO_FILING:
+                    return Outcome(NO_FILING, None, e)
+
+                if status == QUOTA:
+                    if self.on_quota == 'raise' or paused:
+                        raise QuotaExhausted(f'{name}: {e}') from e
+                    wait = seconds_until_quota_reset()
+                    print(f'[policy] {name}: 이용한도 초과, {wait / 3600:.1f}시간 후 다시 시도합니다 ({e})')
+                    self.sleep(wait)
+                    paused = True
+                    continue
+
+                if attempt >= self.retries:
+                    print(f'[policy] {name}: {attempt + 1}번 시도했으나 실패 ({e!r})')
+                    return Outcome(TRANSIENT, None, e)
+                wait = self.delay(attempt)
+                print(f'[policy] {name}: 일시적인 오류, {wait:.1f}초 후 다시 시도 ({e!r})')
+                self.sleep(wait)
+                attempt += 1
+
+
+_default_policy = None
+
+
+def get_policy():
+    """
+    프로세스에서 공유하는 기본 정책, DART_RETRIES, DART_ON_QUOTA 환경변수로 바꿀 수 있음
+    """
+    global _default_policy
+    if _default_policy is None:
+        _default_policy = FetchPolicy()
+    return _default_policy
+
+
+def set_policy(policy):
+    """
+    기본 정책을 바꿈, 화면(app.py)처럼 몇시간씩 기다릴 수 없는 곳은 on_quota='raise' 를 사용
+    """
+    global _default_policy
+    _default_policy = policy
+
+
+def dart_get(api_key, endpoint, params, base_url=DART_API_URL, session=None):
+    """
+    OpenDART API 한번의 요청, 응답의 status 를 dart_fss.errors 의 예외로 바꿈
+
+    :param endpoint: 'fnlttSinglAcntAll' 등 '.json' 을 뺀 이름
+    :return: 응답 json
+    """
+    with profiler.stage(f'dart_api.{endpoint}'):
+        r = (session or requests).get(f'{base_url}{endpoint}.json', params=dict(params, crtfc_key=api_key),
+                                      timeout=30)
+    profiler.add_bytes(f'dart_api.{endpoint}', len(r.content))
+    r.raise_for_status()
+    jo = r.json()
+    check_status(**jo)
+    return jo
+
+
+def request_finstate_all(api_key, corp_code, bsns_year, reprt_code='11011', fs_div='CFS', base_url=DART_API_URL,
+                         session=None):
+    """
+    OpenDartReader.finstate_all 과 같은 결과, 데이터가 없으면 빈 DataFrame 대신 NoDataReceived 를 발생
+    """
+    jo = dart_get(api_key, 'fnlttSinglAcntAll', {'corp_code': corp_code, 'bsns_year': str(bsns_year),
+                                                 'reprt_code': reprt_code, 'fs_div': fs_div},
+                  base_url, session)
+    return pd.DataFrame(jo['list'])
@@ -0,0 +1,166 @@
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from scheduler_helper import dart_limiter, quota_day, DART_PER_DAY
+
+
+class Profiler:
+    """
+    단계(stage)별 호출수, 걸린 시간(wall time), 받은 bytes, 오류수와 캐시 endpoint 별 hit/miss 를 모음
+    단계는 중첩될 수 있으며 시간은 안쪽 단계를 포함한 값
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.cache = {}
+            self.started = time.time()
+            self.requests_before = dart_limiter.total
+
+    def _stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'errors': 0}
+        return stage
+
+    def record(self, name, seconds, error=False):
+        with self.lock:
+            stage = self._stage(name)
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            stage['errors'] += int(error)
+
+    def add_bytes(self, name, n):
+        with self.lock:
+            self._stage(name)['bytes'] += n
+
+    def count_cache(self, endpoint, hit):
+        with self.lock:
+            counter = self.cache.setdefault(endpoint, {'hits': 0, 'misses': 0})
+            counter['hits' if hit else 'misses'] += 1
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - t, error)
+
+    def report(self):
+        """
+        :return: {'stages': {단계: {...}}, 'cache': {endpoint: {...}}, 'quota': {...}, 'requests': 요청수,
+                  'elapsed': 초}
+        """
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in sorted(self.stages.items())}
+            cache = {name: dict(counter) for name, counter in sorted(self.cache.items())}
+            elapsed = time.time() - self.started
+            requests = dart_limiter.total - self.requests_before
+        for counter in cache.values():
+            total = counter['hits'] + counter['misses']
+            counter['hit_ratio'] = counter['hits'] / total if total > 0 else 0.0
+        # 이용한도는 dart_limiter 를 거친 오늘(한국시간)의 요청수, requests 는 reset 이후의 요청수
+        used = dart_limiter.used_today()
+        return {'stages': stages, 'cache': cache, 'elapsed': elapsed, 'requests': requests,
+                'quota': {'day': quota_day().isoformat(), 'used': used, 'limit': DART_PER_DAY,
+                          'remaining': max(DART_PER_DAY - used, 0)}}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.report(), ensure_ascii=False, indent=indent)
+
+    def to_prometheus(self, prefix='dart'):
+        """
+        Prometheus text exposition format
+        """
+        report = self.report()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'{prefix}_{name}{{{label_text}}} {value}' if label_text else f'{prefix}_{name} {value}')
+
+        stages = report['stages']
+        metric('stage_calls_total', 'counter', 'Calls per stage',
+               [({'stage': s}, v['calls']) for s, v in stages.items()])
+        metric('stage_seconds_total', 'counter', 'Wall time per stage, nested stages included',
+               [({'stage': s}, f"{v['seconds']:.6f}") for s, v in stages.items()])
+        metric('stage_bytes_total', 'counter', 'Bytes received per stage',
+               [({'stage': s}, v['bytes']) for s, v in stages.items()])
+        metric('stage_errors_total', 'counter', 'Calls that raised per stage',
+               [({'stage': s}, v['errors']) for s, v in stages.items()])
+        metric('cache_hits_total', 'counter', 'Cache hits per endpoint',
+               [({'endpoint': e}, v['hits']) for e, v in report['cache'].items()])
+        metric('cache_misses_total', 'counter', 'Cache misses per endpoint',
+               [({'endpoint': e}, v['misses']) for e, v in report['cache'].items()])
+        metric('requests', 'gauge', 'DART requests since the profiler was reset', [({}, report['requests'])])
+        metric('quota_used', 'gauge', 'DART requests made by this process today (KST)',
+               [({}, report['quota']['used'])])
+        metric('quota_remaining', 'gauge', 'DART daily quota left for this process',
+               [({}, report['quota']['remaining'])])
+        return '\n'.join(lines) + '\n'
+
+
+# 프로세스에서 공유하는 profiler
+profiler = Profiler()
+
+
+def profiled(name):
+    """
+    함수 호출을 name 단계로 기록하는 decorator
+    generator 함수는 조각을 만드는 데 걸린 시간만 모아서 한번의 호출로 기록, 받는 쪽에서 쓴 시간은 빠짐
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                parts = func(*args, **kwargs)
+                seconds, error = 0.0, False
+                try:
+                    while True:
+                        t = time.perf_counter()
+                        try:
+                            part = next(parts)
+                        except StopIteration as e:
+                            return e.value
+                        except BaseException:
+                            error = True
+                            raise
+                        finally:
+                            seconds += time.perf_counter() - t
+                        yield part
+                finally:
+                    parts.close()
+                    profiler.record(name, seconds, error)
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_report(path):
+    """
+    '.prom' 으로 끝나면 Prometheus text, 그 밖에는 JSON 으로 저장
+    """
+    text = profiler.to_prometheus() if path.endswith('.prom') else profiler.to_json()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
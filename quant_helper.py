@@ -0,0 +1,221 @@
+import glob
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+DEFAULT_QUANT_DIR = 'data'
+DEFAULT_SNAPSHOT_DIR = os.path.join('docs_cache', 'quant')
+SNAPSHOT_PATTERN = 'quant-*.csv'
+
+NAME_COLUMN = '회사명'
+INDUSTRY_COLUMN = '업종 (대)'
+SUB_INDUSTRY_COLUMN = '업종 (소)'
+CODE_COLUMN = '코드 번호'          # 'A010140' 형식
+STOCK_CODE_COLUMN = 'stock_code'  # '010140' 처럼 6자리 문자열로 저장, '0001A0' 같은 영문 포함 코드도 있음
+
+# 변환 형식이 바뀌면 올려서 이전에 변환한 snapshot 을 다시 만듦
+SNAPSHOT_VERSION = 2
+
+CATEGORY_COLUMNS = [INDUSTRY_COLUMN, SUB_INDUSTRY_COLUMN]
+
+
+def snapshot_name(path):
+    """
+    'data/quant-20212Q.csv' -> '20212Q'
+    """
+    return re.sub(r'^quant-', '', os.path.splitext(os.path.basename(path))[0])
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return hashlib.sha1(f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()
+
+
+def _numbers(values):
+    # '-5,342 ' -> -5342.0, 빈 값은 NaN
+    return pd.to_numeric(values.astype(str).str.replace(',', '', regex=False).str.strip(), errors='coerce')
+
+
+def parse_quant_csv(path):
+    """
+    quant csv 를 한번만 파싱하여 typed DataFrame 으로
+    업종은 category, 코드 번호는 6자리 문자열 stock_code, 그 밖의 숫자 column 은 float32
+    코드 번호가 비어있는 row 는 버림
+    """
+    df = pd.read_csv(path, dtype=str, encoding='utf-8-sig')
+    df.columns = [c.strip() for c in df.columns]
+
+    typed = pd.DataFrame({NAME_COLUMN: df[NAME_COLUMN].str.strip()})
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            typed[column] = df[column].str.strip().astype('category')
+    codes = df[CODE_COLUMN].str.strip().str.upper()
+    typed[STOCK_CODE_COLUMN] = codes.str.replace(r'^A', '', regex=True).str.zfill(6)
+    for column in df.columns:
+        if column not in typed and column != CODE_COLUMN:
+            typed[column] = _numbers(df[column]).astype('float32')
+
+    missing = typed[STOCK_CODE_COLUMN].isna() | (typed[STOCK_CODE_COLUMN] == '000000')
+    if missing.any():
+        print(f'[quant] {path}: 코드 번호가 없는 {int(missing.sum())}개 row 를 제외합니다')
+        typed = typed[~missing].reset_index(drop=True)
+    return typed
+
+
+def build_snapshot(path, directory=DEFAULT_SNAPSHOT_DIR):
+    """
+    csv 를 parquet 과 업종 -> rows index 로 변환하여 저장
+    index 는 업종 코드순으로 정렬된 row 위치(order)와 업종별 시작위치(offsets), 업종 안에서는 csv 순서를 유지
+    """
+    name = snapshot_name(path)
+    os.makedirs(directory, exist_ok=True)
+    df = parse_quant_csv(path)
+
+    codes = df[INDUSTRY_COLUMN].cat.codes.to_numpy()
+    order = np.argsort(codes, kind='stable').astype('int32')
+    offsets = np.searchsorted(codes[order], np.arange(len(df[INDUSTRY_COLUMN].cat.categories) + 1)).astype('int32')
+
+    def tmp(filename):
+        return os.path.join(directory, f'{filename}.{os.getpid()}.tmp')
+
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp(f'{name}.parquet'))
+    with open(tmp(f'{name}.index.npz'), 'wb') as f:
+        np.savez(f, order=order, offsets=offsets)
+    # meta 를 마지막에 바꾸므로 중간에 실패하면 다음에 다시 변환
+    with open(tmp(f'{name}.meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': _fingerprint(path), 'version': SNAPSHOT_VERSION, 'source': path,
+                   'rows': len(df)}, f)
+    for filename in [f'{name}.parquet', f'{name}.index.npz', f'{name}.meta.json']:
+        os.replace(tmp(filename), os.path.join(directory, filename))
+    return name
+
+
+class QuantSnapshot:
+    """
+    변환된 quant snapshot 하나, 업종별 조회는 미리 만든 index 로 바로 찾음
+    """
+
+    def __init__(self, name, directory=DEFAULT_SNAPSHOT_DIR):
+        self.name = name
+        self.frame = pq.read_table(os.path.join(directory, f'{name}.parquet'), memory_map=True).to_pandas()
+        with np.load(os.path.join(directory, f'{name}.index.npz')) as index:
+            self.order, self.offsets = index['order'], index['offsets']
+        self.industries = list(self.frame[INDUSTRY_COLUMN].cat.categories)
+        self._industry_codes = {industry: i for i, industry in enumerate(self.industries)}
+        self._by_stock_code = pd.Index(self.frame[STOCK_CODE_COLUMN])
+
+    def __len__(self):
+        return len(self.frame)
+
+    def rows(self, industry):
+        """
+        업종에 속한 row 위치들, csv 순서
+        """
+        code = self._industry_codes.get(industry)
+        if code is None:
+            return np.zeros(0, dtype='int32')
+        return self.order[self.offsets[code]:self.offsets[code + 1]]
+
+    def in_industry(self, industry):
+        return self.frame.iloc[self.rows(industry)]
+
+    def industries_by_rows(self):
+        """
+        csv 에 처음 나오는 순서의 업종들 (csv 가 적자순이면 적자가 큰 업종부터)
+        """
+        return list(pd.unique(self.frame[INDUSTRY_COLUMN].astype(object)))
+
+    def stock_codes(self, industry=None):
+        """
+        '010140' 형식의 종목코드 문자열들
+        """
+        codes = self.frame[STOCK_CODE_COLUMN].to_numpy() if industry is None else \
+            self.frame[STOCK_CODE_COLUMN].to_numpy()[self.rows(industry)]
+        return list(codes)
+
+    def labels(self, industry=None):
+        """
+        '회사명 : 종목코드' 목록, 사이드바 선택상자용
+        """
+        df = self.frame if industry is None else self.in_industry(industry)
+        return [f'{name} : {code}' for name, code in zip(df[NAME_COLUMN], df[STOCK_CODE_COLUMN])]
+
+    def find(self, stock_code):
+        i = self._by_stock_code.get_indexer([str(stock_code).zfill(6)])[0]
+        return None if i < 0 else self.frame.iloc[i]
+
+
+def load_snapshot(path, directory=DEFAULT_SNAPSHOT_DIR):
+    """
+    csv 가 바뀌었거나 변환된 파일이 없을 때만 다시 변환
+    """
+    name = snapshot_name(path)
+    meta_path = os.path.join(directory, f'{name}.meta.json')
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+    if meta is None or meta['fingerprint'] != _fingerprint(path) or meta.get('version') != SNAPSHOT_VERSION:
+        build_snapshot(path, directory)
+    return QuantSnapshot(name, directory)
+
+
+class QuantSnapshots:
+    """
+    여러 분기의 quant snapshot, 처음 사용할 때 읽음
+    """
+
+    def __init__(self, quant_dir=DEFAULT_QUANT_DIR, directory=DEFAULT_SNAPSHOT_DIR):
+        self.directory = directory
+        self.paths = {snapshot_name(p): p for p in sorted(glob.glob(os.path.join(quant_dir, SNAPSHOT_PATTERN)))}
+        self._loaded = {}
+
+    def names(self):
+        return sorted(self.paths)
+
+    def get(self, name):
+        if name not in self._loaded:
+            self._loaded[name] = load_snapshot(self.paths[name], self.directory)
+        return self._loaded[name]
+
+    def latest(self):
+        return self.get(self.names()[-1])
+
+    def panel(self, names=None):
+        """
+        (snapshot, stock_code) index 로 여러 snapshot 을 쌓음
+        """
+        names = names or self.names()
+        frames = [self.get(n).frame for n in names]
+        panel = pd.concat(frames, keys=names, names=['snapshot', None]).reset_index(level=1, drop=True)
+        return panel.set_index(STOCK_CODE_COLUMN, append=True)
+
+    def compare(self, old, new, columns=None):
+        """
+        두 snapshot 의 같은 회사를 나란히 놓고 숫자 column 의 변화량과 업종 변경 여부를 계산
+        한쪽에만 있는 회사도 포함 (값은 NaN)
+        """
+        a, b = self.get(old).frame, self.get(new).frame
+        numeric = [c for c in b.columns if c in a.columns and pd.api.types.is_float_dtype(b[c])]
+        columns = [c for c in (columns or numeric) if c in numeric]
+
+        joined = a.set_index(STOCK_CODE_COLUMN).join(b.set_index(STOCK_CODE_COLUMN), how='outer',
+                                                     lsuffix=f' ({old})', rsuffix=f' ({new})')
+        result = pd.DataFrame(index=joined.index)
+        result[NAME_COLUMN] = joined[f'{NAME_COLUMN} ({new})'].fillna(joined[f'{NAME_COLUMN} ({old})'])
+        result[INDUSTRY_COLUMN] = joined[f'{INDUSTRY_COLUMN} ({new})'].astype(object).fillna(
+            joined[f'{INDUSTRY_COLUMN} ({old})'].astype(object))
+        result['업종 변경'] = joined[f'{INDUSTRY_COLUMN} ({old})'].astype(object) != \
+            joined[f'{INDUSTRY_COLUMN} ({new})'].astype(object)
+        for column in columns:
+            result[f'{column} ({old})'] = joined[f'{column} ({old})']
+            result[f'{column} ({new})'] = joined[f'{column} ({new})']
+            result[f'{column} 변화'] = joined[f'{column} ({new})'] - joined[f'{column} ({old})']
+        return result
@@ -0,0 +1,290 @@
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+
+import dart_fss as dart
+import FinanceDataReader as fdr
+import pandas as pd
+import requests
+from dart_fss.errors import NoDataReceived
+
+import share_helper
+from cache_helper import to_date
+from policy_helper import NO_FILING, classify, request_finstate_all
+
+
+class FixtureMissing(KeyError):
+    pass
+
+
+def _date_text(value):
+    return '' if value is None or value == '' else to_date(value).isoformat()
+
+
+class Fixtures:
+    """
+    녹화한 응답들, {key: ('ok', 값) 또는 ('error', 예외)} 를 pickle 파일 하나로 저장
+    '공시 없음' 처럼 다시 요청해도 같은 오류만 녹화하고, 일시적인 오류는 녹화하지 않음
+
+    :param strict: True 이면 녹화되지 않은 요청에 FixtureMissing, 아니면 공시 없음(NoDataReceived)으로 응답하고
+                   missing 에 기록 (코드가 바뀌어 새로 요청하는 기간이 생겨도 벤치마크는 계속 진행)
+    """
+
+    def __init__(self, path=None, strict=False):
+        self.path = path
+        self.strict = strict
+        self.entries = {}
+        self.meta = {'corp_codes': {}}
+        self.calls = {}
+        self.missing = []
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            self.entries, self.meta = saved['entries'], saved['meta']
+
+    def _count(self, kind):
+        with self.lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def put(self, key, value, error=None):
+        with self.lock:
+            self.entries[key] = ('error', error) if error is not None else ('ok', value)
+
+    def get(self, key):
+        self._count(key[0])
+        entry = self.entries.get(key)
+        if entry is None:
+            if self.strict:
+                raise FixtureMissing(key)
+            with self.lock:
+                self.missing.append(key)
+            raise NoDataReceived(f'녹화되지 않은 요청: {key}')
+        kind, value = entry
+        if kind == 'error':
+            raise value
+        return value
+
+    def record(self, key, func):
+        self._count(key[0])
+        try:
+            value = func()
+        except Exception as e:
+            if classify(e) == NO_FILING:
+                self.put(key, None, e)
+            raise
+        self.put(key, value)
+        return value
+
+    def corp_code(self, corp):
+        return self.meta['corp_codes'].get(str(corp), str(corp))
+
+    def save(self, path=None):
+        path = path or self.path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'entries': self.entries, 'meta': self.meta}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    # 요청별 key, 녹화와 재생, 가짜 서버가 같은 key 를 사용
+
+    @staticmethod
+    def finstate_key(corp_code, bsns_year, reprt_code='11011', fs_div='CFS'):
+        return 'finstate_all', str(corp_code), int(bsns_year), reprt_code, fs_div
+
+    @staticmethod
+    def list_key(corp_code, start=None, end=None, kind='', kind_detail='', final=True):
+        return 'list', str(corp_code or ''), _date_text(start), _date_text(end), kind, kind_detail, bool(final)
+
+    @staticmethod
+    def sub_docs_key(rcept_no, match=None):
+        return 'sub_docs', str(rcept_no), match or ''
+
+    @staticmethod
+    def dividend_key(corp_code, bsns_year, reprt_code='11011'):
+        return 'get_dividend', str(corp_code), str(bsns_year), reprt_code
+
+    @staticmethod
+    def prices_key(ticker):
+        return 'prices', str(ticker)
+
+    @staticmethod
+    def document_key(url):
+        return 'document', str(url)
+
+
+class ReplayOpenDart:
+    """
+    OpenDartReader 의 finstate_all, list, sub_docs, find_corp_code 를 녹화(opendart 가 주어질 때)하거나 재생
+    api_key 를 드러내지 않으므로 CachedOpenDart 는 이 객체의 finstate_all 을 그대로 호출함
+    """
+
+    def __init__(self, fixtures, opendart=None):
+        self.fixtures = fixtures
+        self.opendart = opendart
+
+    @property
+    def recording(self):
+        return self.opendart is not None
+
+    def find_corp_code(self, corp):
+        if self.recording:
+            corp_code = self.opendart.find_corp_code(corp)
+            if corp_code:
+                self.fixtures.meta['corp_codes'][str(corp)] = corp_code
+            return corp_code
+        return self.fixtures.corp_code(corp)
+
+    def finstate_all(self, corp, bsns_year, reprt_code='11011', fs_div='CFS'):
+        key = Fixtures.finstate_key(self.find_corp_code(corp), bsns_year, reprt_code, fs_div)
+        if not self.recording:
+            return self.fixtures.get(key)
+
+        def fetch():
+            api_key = getattr(self.opendart, 'api_key', None)
+            if api_key is None:
+                return self.opendart.finstate_all(corp, bsns_year, reprt_code=reprt_code, fs_div=fs_div)
+            return request_finstate_all(api_key, key[1], bsns_year, reprt_code, fs_div)
+        return self.fixtures.record(key, fetch)
+
+    def list(self, corp=None, start=None, end=None, kind='', kind_detail='', final=True):
+        key = Fixtures.list_key(self.find_corp_code(corp) if corp else '', start, end, kind, kind_detail, final)
+        if not self.recording:
+            return self.fixtures.get(key)
+        return self.fixtures.record(key, lambda: self.opendart.list(corp, start=start, end=end, kind=kind,
+                                                                    kind_detail=kind_detail, final=final))
+
+    def sub_docs(self, s, match=None):
+        key = Fixtures.sub_docs_key(s, match)
+        if not self.recording:
+            return self.fixtures.get(key)
+        return self.fixtures.record(key, lambda: self.opendart.sub_docs(s, match=match))
+
+
+class FakeResponse:
+    """
+    requests.Response 중 share_helper 가 사용하는 부분만 흉내냄
+    """
+
+    def __init__(self, content, encoding='utf-8', status_code=200, url=''):
+        self.content = content
+        self.encoding = encoding
+        self.status_code = status_code
+        self.url = url
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} for {self.url}', response=self)
+
+    def iter_content(self, chunk_size=16 * 1024):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class ReplaySession:
+    """
+    공시 문서를 받는 requests.Session 대신 사용, session 이 주어지면 녹화
+    """
+
+    def __init__(self, fixtures, session=None):
+        self.fixtures = fixtures
+        self.session = session
+
+    def get(self, url, stream=False, timeout=None, **kwargs):
+        key = Fixtures.document_key(url)
+        if self.session is None:
+            content, encoding = self.fixtures.get(key)
+        else:
+            def fetch():
+                r = self.session.get(url, timeout=timeout, **kwargs)
+                r.raise_for_status()
+                return r.content, r.encoding
+            content, encoding = self.fixtures.record(key, fetch)
+        return FakeResponse(content, encoding, url=url)
+
+
+def _replay_dividend(fixtures):
+    def get_dividend(corp_code, bsns_year, reprt_code='11011'):
+        return fixtures.get(Fixtures.dividend_key(corp_code, bsns_year, reprt_code))
+    return get_dividend
+
+
+def _record_dividend(fixtures, get_dividend):
+    def recorded(corp_code, bsns_year, reprt_code='11011'):
+        if get_dividend is None:
+            raise AttributeError('설치된 dart_fss 에 dart.api.info.get_dividend 가 없습니다')
+        return fixtures.record(Fixtures.dividend_key(corp_code, bsns_year, reprt_code),
+                               lambda: get_dividend(corp_code, bsns_year=bsns_year, reprt_code=reprt_code))
+    return recorded
+
+
+def replay_prices(fixtures):
+    def data_reader(ticker, start=None, end=None, *args, **kwargs):
+        try:
+            df = fixtures.get(Fixtures.prices_key(ticker))
+        except NoDataReceived:
+            return pd.DataFrame(columns=['Close'])
+        return df.loc[pd.Timestamp(start) if start else None:pd.Timestamp(end) if end else None]
+    return data_reader
+
+
+def _record_prices(fixtures, data_reader):
+    def recorded(ticker, start=None, end=None, *args, **kwargs):
+        fixtures._count('prices')
+        df = data_reader(ticker, start, end, *args, **kwargs)
+        if df is not None and len(df) > 0:
+            key = Fixtures.prices_key(ticker)
+            previous = fixtures.entries.get(key, ('ok', None))[1]
+            merged = df[['Close']] if previous is None else df[['Close']].combine_first(previous)
+            fixtures.put(key, merged.sort_index())
+        return df
+    return recorded
+
+
+@contextmanager
+def patched(patches):
+    originals = [(obj, name, getattr(obj, name, None)) for obj, name, _ in patches]
+    for obj, name, value in patches:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value in originals:
+            setattr(obj, name, value)
+
+
+@contextmanager
+def replaying(fixtures):
+    """
+    dart_fss 배당(get_dividend), FinanceDataReader 주가, 공시 문서 요청을 fixtures 로 재생
+    OpenDartReader 는 ReplayOpenDart(fixtures) 를 사용
+    """
+    with patched([(dart.api.info, 'get_dividend', _replay_dividend(fixtures)),
+                   (fdr, 'DataReader', replay_prices(fixtures)),
+                   (share_helper, 'http_session', ReplaySession(fixtures))]):
+        yield fixtures
+
+
+@contextmanager
+def recording(fixtures):
+    """
+    실제 요청을 하면서 응답을 fixtures 에 녹화, 끝나면 fixtures.path 에 저장
+    OpenDartReader 는 ReplayOpenDart(fixtures, OpenDartReader(api_key)) 를 사용
+    """
+    get_dividend = getattr(dart.api.info, 'get_dividend', None)
+    with patched([(dart.api.info, 'get_dividend', _record_dividend(fixtures, get_dividend)),
+                   (fdr, 'DataReader', _record_prices(fixtures, fdr.DataReader)),
+                   (share_helper, 'http_session', ReplaySession(fixtures, share_helper.http_session))]):
+        yield fixtures
+    if fixtures.path is not None:
+        fixtures.save()
@@ -0,0 +1,266 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+import pandas as pd
+
+from policy_helper import QuotaExhausted
+from profile_helper import profiler
+from statement_helper import yearly_company_performance, quarterly_company_performance
+
+DEFAULT_RESULT_CACHE_MB = int(os.environ.get('DART_RESULT_CACHE_MB', 256))
+# 계산한 뒤 이 시간(초)이 지나면 새 공시가 있을 수 있으므로 다시 계산
+DEFAULT_RESULT_MAX_AGE = int(os.environ.get('DART_RESULT_MAX_AGE', 24 * 60 * 60))
+
+PERFORMANCE_FUNCTIONS = {'yearly': yearly_company_performance,
+                         'quarterly': quarterly_company_performance}
+
+
+def result_key(corp_code, start, end, mode):
+    return str(corp_code), int(start), int(end), mode
+
+
+def _size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    계산한 회사 표(yearly/quarterly_company_performance 결과)를 (corp_code, start, end, mode) 로 보관
+    프로세스 안의 모든 세션이 공유하며, 전체 크기가 max_bytes 를 넘으면 오래 사용하지 않은 것부터 버림
+    계산한 지 max_age 초가 지난 값은 없는 것으로 보고 다시 계산, 정정공시 등은 invalidate 로 바로 지움
+    같은 key 를 동시에 계산하려 하면 한번만 계산함, 화면처럼 조각을 받으며 계산하는 쪽은 begin/finish 로 등록
+    """
+
+    def __init__(self, max_bytes=DEFAULT_RESULT_CACHE_MB * 1024 * 1024, max_age=DEFAULT_RESULT_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._fresh(key) is not None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _fresh(self, key):
+        # lock 안에서 호출, 오래된 값은 버림
+        entry = self.entries.get(key)
+        if entry is not None and self.max_age is not None and time.time() - entry[2] > self.max_age:
+            del self.entries[key]
+            self.bytes -= entry[1]
+            entry = None
+        return entry
+
+    def get(self, key):
+        with self.lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        profiler.count_cache('result', entry is not None)
+        return None if entry is None else entry[0]
+
+    def put(self, key, value):
+        """
+        DataFrame 만 보관, 데이터가 없다는 안내 문자열 등은 다음에 다시 계산
+        """
+        if not isinstance(value, pd.DataFrame):
+            return
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self.entries[key] = (value, size, time.time())
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def begin(self, key):
+        """
+        key 를 계산하기 시작함을 등록
+        보관한 값이 있거나 다른 쓰레드가 계산 중이면 그 결과를 담을 Future, 아니면 None
+        None 을 받은 쪽이 계산하며, 끝나면 반드시 finish 를 불러야 함
+        """
+        with self.lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                done = Future()
+                done.set_result(entry[0])
+                return done
+            flight = self.flights.get(key)
+            if flight is None:
+                self.flights[key] = Future()
+            return flight
+
+    def finish(self, key, value=None, error=None):
+        """
+        begin 으로 시작한 계산을 끝냄, 기다리던 쪽은 value 를 받거나 error 가 다시 발생함
+        error 가 Exception 이 아니면(KeyboardInterrupt, 화면 rerun 등) 기다리던 쪽이 직접 다시 계산하도록 취소
+        """
+        if error is None:
+            self.put(key, value)
+        with self.lock:
+            flight = self.flights.pop(key)
+        if error is None:
+            flight.set_result(value)
+        elif isinstance(error, Exception):
+            flight.set_exception(error)
+        else:
+            flight.cancel()
+
+    def compute(self, key, func):
+        """
+        있으면 보관한 값, 없으면 func() 를 계산하여 보관
+        다른 쓰레드가 같은 key 를 계산하고 있으면 새로 계산하지 않고 그 결과(또는 예외)를 기다림
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        flight = self.begin(key)
+        while flight is not None:
+            try:
+                return flight.result()
+            except CancelledError:  # 계산하던 쪽이 중단됨
+                flight = self.begin(key)
+
+        try:
+            value = func()
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, value)
+        return value
+
+    def computing(self, key):
+        with self.lock:
+            return key in self.flights
+
+    def invalidate(self, corp_code):
+        """
+        corp_code 회사의 모든 표를 지움, 새 공시나 정정공시가 있을 때 sync_filings 에서 부름
+
+        :return: 지운 표의 수
+        """
+        with self.lock:
+            keys = [key for key in self.entries if key[0] == str(corp_code)]
+            for key in keys:
+                self.bytes -= self.entries.pop(key)[1]
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+class Warmer:
+    """
+    선택한 업종의 회사 표들을 background 쓰레드에서 미리 계산하여 ResultCache 에 넣음
+    프로세스의 모든 세션이 공유하며 요청한 작업은 세션(owner)별로 기억함
+    warm 을 다시 부르면 그 세션의 새 목록에 없고 다른 세션도 요청하지 않은, 아직 시작하지 않은 작업만 취소
+    DART 이용한도를 넘으면 남은 작업을 모두 취소
+    """
+
+    def __init__(self, cache, max_workers=1):
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='warmer')
+        self.futures = {}
+        self.requests = {}  # {owner: 요청한 key 들}
+        self.lock = threading.Lock()
+
+    def _run(self, key, func):
+        try:
+            self.cache.compute(key, func)
+        except QuotaExhausted as e:
+            print(f'{key} 미리 계산 중단: {e}')
+            self.cancel()
+        except Exception as e:
+            print(f'{key} 미리 계산 실패: {e}')
+
+    def _done(self, key, future):
+        with self.lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
+
+    def warm(self, jobs, owner=None):
+        """
+        :param jobs: {key: 계산 함수}, 비어 있으면 owner 의 요청을 모두 거둠
+        :param owner: 요청한 세션, 같은 owner 의 이전 요청을 jobs 로 바꿈
+        :return: 새로 예약한 작업수
+        """
+        with self.lock:
+            if len(jobs) > 0:
+                self.requests[owner] = set(jobs)
+            else:
+                self.requests.pop(owner, None)
+            wanted = set().union(*self.requests.values())
+            stale = [future for key, future in self.futures.items() if key not in wanted]
+        # 취소하면 done callback(_done)이 바로 불리므로 lock 밖에서 취소
+        for future in stale:
+            future.cancel()
+
+        submitted = 0
+        with self.lock:
+            for key, func in jobs.items():
+                if key in self.futures or key in self.cache:
+                    continue
+                future = self.executor.submit(self._run, key, func)
+                self.futures[key] = future
+                future.add_done_callback(lambda f, key=key: self._done(key, f))
+                submitted += 1
+        return submitted
+
+    def cancel(self):
+        with self.lock:
+            futures = list(self.futures.values())
+        for future in futures:
+            future.cancel()
+
+    def pending(self):
+        with self.lock:
+            return len(self.futures)
+
+
+def performance_jobs(companies, start, end, mode, odr, max_workers=None, store=None):
+    """
+    회사들의 mode 표를 계산하는 {result_key: 함수}
+    """
+    func = PERFORMANCE_FUNCTIONS[mode]
+    return {result_key(c.corp_code, start, end, mode):
+            (lambda c=c: func(c, start, end, odr, max_workers, store=store))
+            for c in companies}
+
+
+_default_cache = None
+_default_warmer = None
+
+
+def get_result_cache():
+    """
+    프로세스에서 공유하는 ResultCache, DART_RESULT_CACHE_MB 환경변수로 크기를 바꿀 수 있음
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
+
+
+def get_warmer():
+    global _default_warmer
+    if _default_warmer is None:
+        _default_warmer = Warmer(get_result_cache())
+    return _default_warmer
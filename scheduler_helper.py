@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+
+DEFAULT_MAX_WORKERS = int(os.environ.get('DART_MAX_WORKERS', 4))
+
+# OpenDART 이용한도: 하루 20,000건, 분당 1,000건을 넘으면 일시적으로 차단될 수 있음
+DART_PER_MINUTE = 1000
+DART_PER_DAY = 20000
+
+# OpenDART 일일 이용한도는 한국시간 자정에 초기화됨
+KST = timezone(timedelta(hours=9))
+
+
+def quota_day(now=None):
+    """
+    이용한도를 세는 날(한국시간 날짜)
+    """
+    return (now or datetime.now(KST)).astimezone(KST).date()
+
+
+class TokenBucket:
+    """
+    capacity 개의 토큰을 period 초 동안 균일하게 채우는 토큰버킷
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, n=1):
+        """
+        :return: 토큰을 얻었으면 0, 아니면 기다려야 할 시간(초)
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0
+            return (n - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    분당, 일당 한도를 함께 지키는 제한기. 모든 버킷에서 토큰을 얻을 때까지 대기
+    """
+
+    def __init__(self, per_minute=DART_PER_MINUTE, per_day=DART_PER_DAY):
+        self.buckets = [TokenBucket(per_minute, 60), TokenBucket(per_day, 24 * 60 * 60)]
+        self.lock = threading.Lock()
+        # 요청수는 대기 중에도 읽을 수 있도록 따로 잠금
+        self.count_lock = threading.Lock()
+        self.total = 0  # 프로세스 시작 이후
+        self.day, self.today = quota_day(), 0  # 이용한도를 세는 날과 그날의 요청수
+
+    def acquire(self):
+        with self.lock:  # 여러 쓰레드가 토큰을 나눠 가지다 모두 대기하는 것을 막음
+            for bucket in self.buckets:
+                while True:
+                    wait = bucket.try_acquire()
+                    if wait == 0:
+                        break
+                    time.sleep(wait)
+        day = quota_day()
+        with self.count_lock:
+            if day != self.day:
+                self.day, self.today = day, 0
+            self.today += 1
+            self.total += 1
+
+    def used_today(self, now=None):
+        """
+        오늘(한국시간) 이 프로세스가 보낸 요청수
+        """
+        with self.count_lock:
+            return self.today if self.day == quota_day(now) else 0
+
+
+# 프로세스에서 공유하는 DART API 제한기
+dart_limiter = RateLimiter()
+
+
+def run_in_order(func, items, max_workers=None):
+    """
+    items 의 각 원소에 func 를 쓰레드풀에서 동시에 실행하고 결과를 items 의 순서대로 반환
+
+    :param func: 원소 하나를 받는 함수
+    :param items: 연도, (연도, reprt_code) 등 기간 목록
+    :param max_workers: 동시 실행수, None 이면 DEFAULT_MAX_WORKERS, 1 이면 순차 실행
+    :return: [func(item) for item in items]
+    """
+    items = list(items)
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def run_as_completed(func, items, max_workers=None):
+    """
+    run_in_order 와 같이 실행하되 끝나는 대로 (item, 결과) 를 yield
+    중간에 그만 받으면(generator 를 닫으면) 아직 시작하지 않은 작업은 취소
+    """
+    items = list(items)
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = {executor.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
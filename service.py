@@ -0,0 +1,366 @@
+import argparse
+import gzip
+import re
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import dart_fss as dart
+import OpenDartReader
+import pandas as pd
+
+from batch_helper import QUANT_DATA_PATH, companies_in_category, dart_api_key, listed_companies
+from cache_helper import cached_opendart
+from corp_helper import load_corp_index
+from policy_helper import FetchPolicy, QuotaExhausted, seconds_until_quota_reset, set_policy
+from profile_helper import profiler, write_report
+from result_helper import PERFORMANCE_FUNCTIONS, ResultCache, result_key
+from sheet_helper import CONTENT_TYPES, DEFAULT_SHEET_DIR, DEFAULT_SHEET_MAX_AGE, SheetStore, export_panel
+from store_helper import get_store
+from sync_helper import sync_filings
+
+
+DEFAULT_START = 2015
+DEFAULT_END = 2021
+
+SHEET_ROUTE = re.compile(r'^/sheets/(?P<mode>yearly|quarterly)/(?P<code>\d{6}|\d{8})$')
+
+
+class SheetService:
+    """
+    회사 표를 SheetStore 에서 찾고, 없으면 계산하여 저장
+    max_age 가 지난 표는 그대로 주면서 background 에서 다시 계산함(stale-while-revalidate),
+    다시 계산하다 이용한도를 넘거나 실패해도 저장된 표를 계속 줌
+    같은 표를 동시에 요청하면 ResultCache 의 single-flight 로 한번만 계산함
+    표는 store 에 있으므로 ResultCache 는 기본으로 값을 메모리에 두지 않음(max_bytes=0)
+    """
+
+    def __init__(self, opendart, corp_index, store=None, results=None, max_workers=None, refresh_workers=1):
+        self.opendart = cached_opendart(opendart)
+        self.corp_index = corp_index
+        self.store = store or SheetStore()
+        self.results = results or ResultCache(max_bytes=0)
+        self.max_workers = max_workers
+        self.refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='refresh')
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def company(self, code):
+        """
+        6자리 종목코드 또는 8자리 corp_code 의 회사, 없으면 None
+        """
+        if len(code) == 8:
+            return self.corp_index.find_by_corp_code(code)
+        return self.corp_index.find_by_stock_code(code)
+
+    def ensure(self, company, start, end, mode, stale=True):
+        """
+        :param stale: False 이면 오래된 표를 주지 않고 바로 다시 계산 (export)
+        :return: store 에 있는 표의 key, 데이터가 없으면 None
+        """
+        key = result_key(company.corp_code, start, end, mode)
+        if self.store.exists(key):
+            return key
+        if stale and self.store.stored(key):
+            self.refresh(company, key)
+            return key
+        df = self.results.compute(key, lambda: self._compute(company, key))
+        return key if isinstance(df, pd.DataFrame) else None
+
+    def refresh(self, company, key):
+        """
+        오래된 표를 background 에서 다시 계산, 이미 예약되어 있으면 그대로 둠
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        self.refresher.submit(self._refresh, company, key)
+
+    def _refresh(self, company, key):
+        try:
+            self.results.compute(key, lambda: self._compute(company, key))
+        except QuotaExhausted as e:
+            print(f'[service] {company.corp_name}({company.stock_code}) 이용한도 초과로 저장된 표를 계속 사용: {e}')
+        except Exception as e:
+            print(f'[service] {company.corp_name}({company.stock_code}) 다시 계산 실패, 저장된 표를 계속 사용: {e!r}')
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _compute(self, company, key):
+        # 앞의 계산이 끝난 직후에 들어온 요청이면 store 에 이미 있음
+        if self.store.exists(key):
+            return self.store.read(key)
+        _, start, end, mode = key
+        with profiler.stage(f'service.compute.{mode}'):
+            df = PERFORMANCE_FUNCTIONS[mode](company, start, end, self.opendart, self.max_workers)
+        if isinstance(df, pd.DataFrame):
+            self.store.write(key, df)
+        return df
+
+
+def negotiate(query, accept):
+    """
+    ?format= 이 있으면 그것, 없으면 Accept header 로 고름, 기본은 parquet
+    """
+    fmt = query.get('format')
+    if fmt is not None:
+        return fmt if fmt in CONTENT_TYPES else None
+    for fmt, content_type in CONTENT_TYPES.items():
+        if content_type.split(';')[0] in accept:
+            return fmt
+    return 'parquet'
+
+
+def _etag_matches(header, etag):
+    if header is None:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def make_handler(service):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b'', content_type='text/plain; charset=utf-8', headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if status != 304:
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if status != 304:
+                self.wfile.write(body)
+
+        def _text(self, status, text, headers=None):
+            self._send(status, text.encode('utf-8'), headers=headers)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+
+            if parsed.path == '/health':
+                return self._text(200, 'ok')
+            if parsed.path == '/metrics':
+                return self._send(200, profiler.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+
+            match = SHEET_ROUTE.match(parsed.path)
+            if match is None:
+                return self._text(404, 'not found')
+            with profiler.stage('service.request'):
+                self._sheet(match['mode'], match['code'], query)
+
+        def _sheet(self, mode, code, query):
+            try:
+                start = int(query.get('start', DEFAULT_START))
+                end = int(query.get('end', DEFAULT_END))
+            except ValueError:
+                return self._text(400, 'start, end 는 연도')
+            if start > end:
+                return self._text(400, 'start 가 end 보다 큽니다')
+            fmt = negotiate(query, self.headers.get('Accept', ''))
+            if fmt is None:
+                return self._text(406, f'format 은 {", ".join(CONTENT_TYPES)} 중 하나')
+
+            company = service.company(code)
+            if company is None:
+                return self._text(404, f'{code} 회사가 없습니다')
+            payload = None
+            # ensure 와 payload 사이에 표가 지워지면(sync 의 invalidate) 한번 더 계산
+            for _ in range(2):
+                try:
+                    key = service.ensure(company, start, end, mode)
+                except QuotaExhausted as e:
+                    return self._text(503, f'DART 이용한도 초과 ({e})',
+                                      {'Retry-After': str(int(seconds_until_quota_reset()))})
+                except Exception as e:
+                    # 예외 내용(경로, 설정값 등)은 응답에 넣지 않고 로그에만 남김
+                    print(f'[service] {company.corp_name}({company.stock_code}) {mode} 실패: {e!r}')
+                    traceback.print_exc()
+                    return self._text(500, '표를 만들지 못했습니다')
+                if key is None:
+                    break
+                payload = service.store.payload(key, fmt)
+                if payload is not None:
+                    break
+            if payload is None:
+                return self._text(404, f'Can not retrieve {company.corp_name} data')
+
+            body, etag = payload
+            # parquet, arrow 는 이미 zstd 로 압축되어 있으므로 json 만 gzip
+            # gzip 한 body 는 bytes 가 다르므로 ETag 도 따로 (strong ETag 는 bytes 가 같을 때만 같아야 함)
+            gzipped = fmt == 'json' and 'gzip' in self.headers.get('Accept-Encoding', '')
+            if gzipped:
+                etag = f'{etag[:-1]}-gzip"'
+            headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+            if _etag_matches(self.headers.get('If-None-Match'), etag):
+                return self._send(304, headers=headers)
+            if gzipped:
+                body = gzip.compress(body, compresslevel=6)
+                headers['Content-Encoding'] = 'gzip'
+            self._send(200, body, CONTENT_TYPES[fmt], headers)
+
+    return Handler
+
+
+def make_server(service, host='127.0.0.1', port=8600):
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    httpd.daemon_threads = True
+    return httpd
+
+
+def export(service, companies, start, end, mode, workers=4):
+    """
+    회사들의 표를 계산하여 store 에 저장, 이미 있는 표는 건너뜀
+
+    :return: (저장된 key 목록, 실패하거나 데이터가 없는 corp_code 목록)
+    """
+    keys, failed = [], []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(service.ensure, c, start, end, mode, False): c for c in companies}
+        for i, future in enumerate(as_completed(futures), 1):
+            company = futures[future]
+            try:
+                key = future.result()
+            except QuotaExhausted as e:
+                print(f'[export] 이용한도 초과로 중단합니다: {e}')
+                executor.shutdown(wait=True, cancel_futures=True)
+                # 아직 받지 않았지만 끝난 회사들(중단을 기다리는 동안 끝난 회사 포함)의 결과도 모음
+                for other in futures:
+                    if other.cancelled() or other.exception() is not None:
+                        continue
+                    key = other.result()
+                    if key is not None and key not in keys:
+                        keys.append(key)
+                done = {k[0] for k in keys}
+                failed = [c.corp_code for c in companies if c.corp_code not in done]
+                break
+            except Exception as e:
+                print(f'[export] {company.corp_name}({company.stock_code}) 실패: {e!r}')
+                failed.append(company.corp_code)
+                continue
+            if key is None:
+                failed.append(company.corp_code)
+            else:
+                keys.append(key)
+            print(f'[export] {i}/{len(companies)} {company.corp_name}({company.stock_code}) 완료')
+    return keys, failed
+
+
+def sync_sheets(service, args):
+    """
+    sync_filings 로 공시가 바뀐 회사의 캐시, facts, 저장된 표를 지우고,
+    지우기 전에 저장되어 있던 표는 다시 계산하여 다음 요청이 DART 를 기다리지 않도록 함
+    """
+    corp_codes, universe = None, None
+    if args.stock_code:
+        corp_codes = [c.corp_code for c in map(service.company, args.stock_code) if c is not None]
+    elif args.category:
+        universe = [c.corp_code for c in companies_in_category(args.category, service.corp_index, args.quant)]
+
+    stored = service.store.keys()
+    changed = sync_filings(service.opendart, args.since, args.until, corp_codes, universe, store=get_store(),
+                           refetch=not args.baseline, results=service.results, sheets=service.store)
+    changed = set(changed['corp_code'])
+
+    # (start, end, mode) 별로 지워진 표들을 다시 계산
+    rebuild = {}
+    for corp_code, start, end, mode in stored:
+        if corp_code in changed:
+            rebuild.setdefault((start, end, mode), []).append(corp_code)
+    for (start, end, mode), codes in sorted(rebuild.items()):
+        companies = [c for c in map(service.corp_index.find_by_corp_code, codes) if c is not None]
+        keys, failed = export(service, companies, start, end, mode, args.workers)
+        print(f'[sync] {mode} {start}~{end}: {len(keys)}개 다시 계산, 실패 또는 데이터 없음 {len(failed)}개')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='회사별 연간/분기 표를 미리 계산하여 저장하고 HTTP 로 제공, '
+                                                 '매일 sync 로 새 공시를 반영')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='GET /sheets/{yearly|quarterly}/{종목코드}?start=&end=&format=')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8600)
+
+    batch = commands.add_parser('export', help='회사들의 표를 계산하여 저장')
+    scope = batch.add_mutually_exclusive_group(required=True)
+    scope.add_argument('--category', help="quant 데이터의 '업종 (대)'")
+    scope.add_argument('--stock-code', nargs='+')
+    scope.add_argument('--all', action='store_true', help='dart.get_corp_list() 의 전체 상장사')
+    batch.add_argument('--start', type=int, default=DEFAULT_START)
+    batch.add_argument('--end', type=int, default=DEFAULT_END)
+    batch.add_argument('--mode', choices=sorted(PERFORMANCE_FUNCTIONS), default='yearly')
+    batch.add_argument('--quant', default=QUANT_DATA_PATH)
+    batch.add_argument('--workers', type=int, default=4)
+    batch.add_argument('--out', help='저장된 표들을 (corp_code, period) panel 로 쌓아 저장할 parquet 파일')
+    batch.add_argument('--profile', help='단계별 성능 정보를 저장할 파일, .prom 이면 Prometheus text, 그 외는 JSON')
+
+    sync = commands.add_parser('sync', help='새 공시나 정정공시가 있는 회사의 캐시와 저장된 표를 지우고 다시 계산')
+    sync_scope = sync.add_mutually_exclusive_group()
+    sync_scope.add_argument('--category', help="quant 데이터의 '업종 (대)', 없으면 전체 시장")
+    sync_scope.add_argument('--stock-code', nargs='+', help='회사별로 공시목록을 조회')
+    sync.add_argument('--since', help='공시목록 조회 시작일(YYYY-MM-DD), 없으면 마지막 동기화일')
+    sync.add_argument('--until', help='공시목록 조회 종료일, 없으면 오늘')
+    sync.add_argument('--quant', default=QUANT_DATA_PATH)
+    sync.add_argument('--workers', type=int, default=4)
+    sync.add_argument('--baseline', action='store_true',
+                      help='처음 동기화할 때 다시 가져오지 않고 캐시만 지우며 접수번호를 기록')
+
+    for p in [serve, batch, sync]:
+        p.add_argument('--sheets', default=DEFAULT_SHEET_DIR, help='미리 계산한 표를 저장하는 디렉토리')
+        p.add_argument('--max-age', type=int, default=DEFAULT_SHEET_MAX_AGE,
+                       help='저장한 표를 다시 계산하기까지의 시간(초)')
+        p.add_argument('--period-workers', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    api_key = dart_api_key()
+    dart.set_api_key(api_key=api_key)
+    # 요청을 받는 중에는 이용한도가 초기화될 때까지 기다리지 않고 503 으로 응답
+    set_policy(FetchPolicy(on_quota='raise'))
+    corp_index = load_corp_index()
+    service = SheetService(OpenDartReader(api_key), corp_index, SheetStore(args.sheets, max_age=args.max_age),
+                           max_workers=args.period_workers)
+
+    if args.command == 'serve':
+        httpd = make_server(service, args.host, args.port)
+        print(f'[service] http://{args.host}:{httpd.server_address[1]}/sheets/yearly/005930 ({args.sheets})')
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+        return
+
+    if args.command == 'sync':
+        sync_sheets(service, args)
+        return
+
+    if args.all:
+        companies = listed_companies(dart.get_corp_list())
+    elif args.category:
+        companies = companies_in_category(args.category, corp_index, args.quant)
+    else:
+        companies = [c for c in map(service.company, args.stock_code) if c is not None]
+
+    keys, failed = export(service, companies, args.start, args.end, args.mode, args.workers)
+    print(f'[export] {len(keys)}개 저장 -> {args.sheets}, 실패 또는 데이터 없음 {len(failed)}개')
+    if args.out:
+        rows = export_panel(service.store, keys, args.out)
+        print(f'[export] {rows} rows -> {args.out}')
+    if args.profile:
+        write_report(args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,131 @@
-import re
-from datetime import date
+import codecs
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+from html.parser import HTMLParser
 import FinanceDataReader as fdr
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+from dart_fss.errors import NoDataReceived
 
+from cache_helper import get_cache
+from policy_helper import unavailable_as_no_filing
+from profile_helper import profiled, profiler
+from scheduler_helper import run_in_order
 
+
+SHARES_ROW_KEYWORD = '발행주식'
+
+# 주식수 추출 방식이 바뀌면 올려서 예전 방식으로 캐시한(없음으로 저장된 것 포함) 결과를 다시 추출
+SHARES_FORMAT = 2
+
+# 공시 문서 요청에 재사용하는 연결 pool
+http_session = requests.Session()
+http_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+http_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class SharesRowParser(HTMLParser):
+    """
+    keyword 가 있는 td 를 포함한 첫번째 tr 의 td 문자열들을 찾으면 더 이상 파싱하지 않음
+    """
+
+    def __init__(self, keyword=SHARES_ROW_KEYWORD):
+        super().__init__(convert_charrefs=True)
+        self.keyword = keyword
+        self.cells = None
+        self.row = None
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._end_row()
+            self.row = []
+        elif tag == 'td' and self.row is not None:
+            self._end_cell()
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if tag == 'td':
+            self._end_cell()
+        elif tag in ('tr', 'table'):
+            self._end_row()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def _end_cell(self):
+        if self.cell is not None:
+            self.row.append(''.join(self.cell).strip())
+            self.cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self.row is not None and any(self.keyword in c for c in self.row):
+            self.cells = self.row
+            raise _StopParsing()
+        self.row = None
+
+
+@profiled('share.parse_shares_row')
+def parse_shares_row(chunks, keyword=SHARES_ROW_KEYWORD):
+    """
+    html 문자열 조각들을 차례로 파싱하다가 keyword 가 있는 행을 찾으면 멈춤
+
+    :param chunks: 문자열 또는 문자열 조각들의 iterable
+    :return: 행의 td 값들, 숫자는 int 로 변환, 없으면 None
+    """
+    parser = SharesRowParser(keyword)
+    try:
+        for chunk in [chunks] if isinstance(chunks, str) else chunks:
+            parser.feed(chunk)
+        parser.close()
+    except _StopParsing:
+        pass
+
+    if parser.cells is None:
+        return None
+
+    shares = []
+    for r in parser.cells:
+        r = r.replace(',', '').replace('-', '')
+        shares.append(int(r) if r.isdigit() else r)
+    return shares
+
+
+def _decoded_chunks(response, chunk_size=16 * 1024):
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        profiler.add_bytes('share.shares_in_document', len(chunk))
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+@profiled('share.shares_in_document')
+def shares_in_document(url):
+    """
+    문서를 받으면서 파싱하고, 주식수 행을 찾으면 나머지는 받지 않음
+    """
+    with http_session.get(url, stream=True, timeout=30) as response:
+        # 5xx 등은 FetchPolicy 에서 다시 시도함
+        response.raise_for_status()
+        return parse_shares_row(_decoded_chunks(response))
+
+
+@profiled('share.share_volume_in_year')
 def share_volume_in_year(stock_code, year, opendart):
     '''
     해당년도의 주식수, 사업보고서에서 추출
     주식의 총수 항목에서
     발행한 주식의 총수 [Ⅳ. 발행주식의 총수 (Ⅱ-Ⅲ), 보통주, 우선주, 합계]
     를 반환
+    접수번호(rcept_no)별로 추출한 결과를 캐시함
 
     :param stock_code:
     :param year:
@@ -19,64 +133,200 @@ def share_volume_in_year(stock_code, year, opendart):
 
     '''
 
-    try:
-        # 사업보고서 문서번호, 연간보고서는 다음해 3월 말에 제출됨
-        rpt_list = opendart.list(stock_code, start=f'{year}-12-01', end=f'{year + 1}-5-30', kind='A')
-        rcept_no = rpt_list[rpt_list['rm'] == '연'].iloc[0]['rcept_no']
+    # 사업보고서 문서번호, 연간보고서는 다음해 3월 말에 제출됨
+    rpt_list = opendart.list(stock_code, start=f'{year}-12-01', end=f'{year + 1}-5-30', kind='A')
+    annual = rpt_list[rpt_list['rm'] == '연'] if rpt_list is not None and 'rm' in rpt_list else []
+    if len(annual) == 0:
+        print(f"[{year}] Can't retrieve share info! (사업보고서 없음)")
+        return None
+    rcept_no = annual.iloc[0]['rcept_no']
 
+    def extract():
         # 제목이 잘 매치되는 순서로 소트
         # df는 [title], [url] column 을 가짐
         doc_df = opendart.sub_docs(rcept_no, match='주식의 총수')
-
+        if doc_df is None or len(doc_df) == 0:
+            raise NoDataReceived(f'{rcept_no}: 주식의 총수 문서 없음')
         print(f'[{year}] {doc_df.iloc[0]["title"]} 에서 주식수를 추출중...')
+        shares = shares_in_document(doc_df.iloc[0]['url'])
+        if shares is None:
+            raise NoDataReceived(f'{rcept_no}: 발행주식의 총수 행 없음')
+        # [구분, 보통주, 우선주, 합계] 에서 합계가 숫자가 아니면 문서 형식이 다른 것
+        if len(shares) < 4 or not isinstance(shares[3], int):
+            raise NoDataReceived(f'{rcept_no}: 발행주식의 총수 행의 형식이 다름 {shares}')
+        # 우선주가 없는 회사는 '-' 라서 빈 값, 0 주로 봄
+        return shares[:1] + [0 if e == '' else e for e in shares[1:3]] + shares[3:]
 
-        response = requests.get(doc_df.iloc[0]['url'])
-
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-        else:
-            print(response.status_code)
-            return None
-
-        shares_row = soup.find('td', text=re.compile('발행주식')).parent
-        # shares_row = soup.find('td', text=re.compile('유통주식')).parent
-        shares = []
-        for r in shares_row.find_all('td'):
-            r = r.text.replace(',', '').replace('-', '')
-            shares.append(int(r) if r.isdigit() else r)
-        return shares
-
-    except:
+    # 접수번호의 문서는 바뀌지 않으므로 만료되지 않음, 주식수가 없거나 받을 수 없는(4xx) 문서도 다시 받지 않음
+    shares = get_cache().fetch('shares', stock_code, year, unavailable_as_no_filing(extract, f'{rcept_no} 주식수'),
+                               reprt_code='11011', extra=f'{rcept_no}|{SHARES_FORMAT}', limited=False)
+    if shares is None:
         print(f"[{year}] Can't retrieve share info!")
-        return None
+    return shares
+
 
+@profiled('share.yearly_share_volume')
+def yearly_share_volume(stock_code, start, end, odr, max_workers=None):
+    years = range(start, end + 1)
+    volumes = run_in_order(lambda year: share_volume_in_year(stock_code, year, odr), years, max_workers)
 
-def yearly_share_volume(stock_code, start, end, odr):
     shares = []
-    for year in range(start, end + 1):
-        r = share_volume_in_year(stock_code, year, odr)
+    for year, r in zip(years, volumes):
         if r is not None:
             shares.append({'year': year, '보통주': r[1], '우선주': r[2], '주식수': r[3]})
 
-    df_shares = pd.DataFrame(shares)
+    df_shares = pd.DataFrame(shares, columns=['year', '보통주', '우선주', '주식수'])
     df_shares.set_index('year', inplace=True)
     return df_shares
 
 
-def yearly_share_prices(corp_code, start, end):
+DEFAULT_PRICE_STORE_PATH = os.path.join('docs_cache', 'prices.sqlite3')
+
+
+class PriceStore:
     """
-    각해의 마지막날(년말) 주가의 'Close'값들을 반환
+    종목별 일별 종가를 저장하는 SQLite 저장소
+    이미 받은 기간은 다시 받지 않고, 마지막 동기화 이후의 날짜만 FinanceDataReader 로 받음
+    """
+
+    def __init__(self, path=DEFAULT_PRICE_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS prices ('
+                         'ticker TEXT NOT NULL, date TEXT NOT NULL, close REAL, PRIMARY KEY (ticker, date))')
+            conn.execute('CREATE TABLE IF NOT EXISTS synced ('
+                         'ticker TEXT PRIMARY KEY, first_date TEXT NOT NULL, last_date TEXT NOT NULL, '
+                         'synced_on TEXT NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    @profiled('share.price_download')
+    def _fetch(self, ticker, start, end):
+        df = fdr.DataReader(ticker, start, end)
+        if df is None or len(df) == 0:
+            return 0
+        rows = [(ticker, d.strftime('%Y-%m-%d'), float(c)) for d, c in zip(df.index, df['Close'])]
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?)', rows)
+        return len(rows)
+
+    def sync(self, ticker, start, end=None):
+        """
+        [start, end] 중 아직 받지 않은 날짜만 받음
+        마지막으로 받은 날(last)을 그날 이후에 받은 적이 없으면(synced_on <= last) 장중 값일 수 있어 다시 받음
+        synced_on 은 last 를 받은 날이라서, 지난 기간만 요청하면 다시 받지 않음
+        """
+        today = date.today()
+        end = min(end or today, today)
+        with self._connect() as conn:
+            row = conn.execute('SELECT first_date, last_date, synced_on FROM synced WHERE ticker=?',
+                               (ticker,)).fetchone()
+
+        if row is None:
+            first, last, synced_on = start, end, today
+            self._fetch(ticker, start, end)
+        else:
+            first, last = date.fromisoformat(row[0]), date.fromisoformat(row[1])
+            synced_on = date.fromisoformat(row[2])
+            if start < first:
+                self._fetch(ticker, start, first - timedelta(days=1))
+                first = start
+            # last 를 받은 날이 last 이전이면 종가가 확정된 뒤에 받은 것
+            intraday = last >= synced_on
+            if end > last or (end == last and intraday and synced_on < today):
+                self._fetch(ticker, last if intraday else last + timedelta(days=1), end)
+                last, synced_on = max(last, end), today
+
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO synced VALUES (?, ?, ?, ?)',
+                         (ticker, first.isoformat(), last.isoformat(), synced_on.isoformat()))
+
+    def closes(self, tickers, start, end, sync=True, max_workers=None):
+        """
+        여러 종목의 일별 종가, index 는 날짜, column 은 종목코드
+
+        :param sync: True 이면 없는 날짜를 먼저 받음
+        """
+        tickers = list(tickers)
+        if sync:
+            run_in_order(lambda ticker: self.sync(ticker, start, end), tickers, max_workers)
+
+        with self._connect() as conn:
+            rows = conn.execute(f'SELECT ticker, date, close FROM prices WHERE ticker IN '
+                                f'({",".join("?" * len(tickers))}) AND date BETWEEN ? AND ? ORDER BY date',
+                                tickers + [start.isoformat(), end.isoformat()]).fetchall()
+
+        df = pd.DataFrame(rows, columns=['ticker', 'Date', 'Close'])
+        df['Date'] = pd.to_datetime(df['Date'])
+        return df.pivot(index='Date', columns='ticker', values='Close').reindex(columns=tickers)
+
+
+_default_price_store = None
+
+
+def get_price_store():
+    """
+    기본 주가 저장소, DART_PRICE_STORE_PATH 환경변수로 위치를 바꿀 수 있음
     """
-    prices = None
+    global _default_price_store
+    if _default_price_store is None:
+        _default_price_store = PriceStore(os.environ.get('DART_PRICE_STORE_PATH', DEFAULT_PRICE_STORE_PATH))
+    return _default_price_store
 
-    for year in range(start - 3, end + 1):
-        price = fdr.DataReader(corp_code, date(year, 12, 15), date(year, 12, 31)).iloc[-1:, :]
-        prices = price if prices is None else pd.concat([prices, price])
 
-    prices = prices[['Close']]
-    prices = prices.reset_index()
-    prices = prices.set_index(pd.DatetimeIndex(prices['Date']).year)
+def set_price_store(store):
+    global _default_price_store
+    _default_price_store = store
+
+
+def period_end_prices(closes, quarterly=False):
+    """
+    기간(년 또는 분기)의 마지막 거래일의 종가
+
+    :param closes: 날짜 index 의 종가 Series
+    :return: '주가날짜', '주가' column 의 DataFrame, index 는 연도 또는 '2020.1Q'
+    """
+    closes = closes.dropna()
+    keys = [closes.index.year, closes.index.quarter] if quarterly else [closes.index.year]
+    last = closes.groupby(keys).tail(1)
+
+    prices = pd.DataFrame({'주가날짜': last.index, '주가': last.to_numpy()})
+    if quarterly:
+        prices.index = [f'{d.year}.{d.quarter}Q' for d in last.index]
+    else:
+        prices.index = last.index.year
     prices.index.name = 'year'
-    prices.rename(columns={'Date': '주가날짜', 'Close': '주가'}, inplace=True)
+    return prices
+
 
-    return prices
\ No newline at end of file
+@profiled('share.yearly_share_prices')
+def yearly_share_prices(corp_code, start, end, store=None):
+    """
+    각해의 마지막날(년말) 주가의 'Close'값들을 반환
+    start - 3 년부터 end 년까지를 한번에 조회
+    """
+    store = store or get_price_store()
+    closes = store.closes([corp_code], date(start - 3, 1, 1), date(end, 12, 31))[corp_code]
+    return period_end_prices(closes)
+
+
+@profiled('share.quarterly_share_prices')
+def quarterly_share_prices(corp_code, start, end, store=None):
+    """
+    각 분기의 마지막 거래일 주가, index 는 '2020.1Q' 형식
+    """
+    store = store or get_price_store()
+    closes = store.closes([corp_code], date(start, 1, 1), date(end, 12, 31))[corp_code]
+    return period_end_prices(closes, quarterly=True)
@@ -0,0 +1,176 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+DEFAULT_SHEET_DIR = os.path.join('docs_cache', 'sheets')
+# 저장한 뒤 이 시간(초)이 지난 표는 새 공시가 있을 수 있으므로 다시 계산
+DEFAULT_SHEET_MAX_AGE = 24 * 60 * 60
+
+CONTENT_TYPES = {'parquet': 'application/vnd.apache.parquet',
+                 'arrow': 'application/vnd.apache.arrow.stream',
+                 'json': 'application/json; charset=utf-8'}
+
+
+def sheet_table(df):
+    """
+    회사 표를 arrow table 로, 단위(attrs['units'])는 schema metadata 에 남김
+    """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    units = json.dumps(df.attrs.get('units', {}), ensure_ascii=False).encode('utf-8')
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), b'units': units})
+
+
+def sheet_from_table(table):
+    df = table.to_pandas()
+    metadata = table.schema.metadata or {}
+    if b'units' in metadata:
+        df.attrs['units'] = json.loads(metadata[b'units'].decode('utf-8'))
+    return df
+
+
+def encode_sheet(table, fmt):
+    """
+    :param fmt: 'arrow' (zstd 로 압축한 Arrow IPC stream) 또는 'json' (orient='split')
+    """
+    if fmt == 'arrow':
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='zstd')) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    df = sheet_from_table(table)
+    body = json.loads(df.to_json(orient='split', force_ascii=False))
+    body['units'] = df.attrs.get('units', {})
+    return json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+
+class SheetStore:
+    """
+    미리 계산한 회사 표들, (corp_code, start, end, mode) 마다 zstd parquet 파일 하나
+    응답 body 는 파일이 바뀌지 않는 동안 형식별로 메모리에 두고(최대 max_payloads 개) 다시 쓰며,
+    ETag 는 파일 내용의 hash 라서 같은 값으로 다시 계산되면 그대로임
+    저장한 지 max_age 초가 지난 표는 exists 가 False 라서 다시 계산됨, 정정공시 등은 invalidate 로 바로 지움
+    """
+
+    def __init__(self, directory=DEFAULT_SHEET_DIR, max_payloads=1024, max_age=DEFAULT_SHEET_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_payloads = max_payloads
+        self.payloads = OrderedDict()
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        corp_code, start, end, mode = key
+        return os.path.join(self.directory, mode, f'{corp_code}_{start}_{end}.parquet')
+
+    def exists(self, key):
+        """
+        저장되어 있고 max_age 가 지나지 않았는지
+        """
+        try:
+            mtime = os.path.getmtime(self.path(key))
+        except FileNotFoundError:
+            return False
+        return self.max_age is None or time.time() - mtime <= self.max_age
+
+    def stored(self, key):
+        """
+        max_age 와 상관없이 저장되어 있는지, 오래된 표를 다시 계산하는 동안 대신 줄 때 사용
+        """
+        return os.path.exists(self.path(key))
+
+    def invalidate(self, corp_code):
+        """
+        corp_code 회사의 모든 표를 지움, 새 공시나 정정공시가 있을 때 sync_filings 에서 부름
+
+        :return: 지운 표의 수
+        """
+        keys = [key for key in self.keys() if key[0] == str(corp_code)]
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            for cached in [k for k in self.payloads if k[0] in keys]:
+                del self.payloads[cached]
+        return len(keys)
+
+    def keys(self):
+        """
+        저장된 (corp_code, start, end, mode) 들
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        keys = []
+        for mode in sorted(os.listdir(self.directory)):
+            for name in sorted(os.listdir(os.path.join(self.directory, mode))):
+                if name.endswith('.parquet'):
+                    corp_code, start, end = name[:-len('.parquet')].split('_')
+                    keys.append((corp_code, int(start), int(end), mode))
+        return keys
+
+    def write(self, key, df):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 읽는 쪽이 반쯤 쓰인 파일을 보지 않도록 임시파일에 쓰고 바꿔치기
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        pq.write_table(sheet_table(df), tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+
+    def read(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        return sheet_from_table(pq.read_table(path))
+
+    def payload(self, key, fmt='parquet'):
+        """
+        :return: (body bytes, ETag), 저장된 표가 없으면 None
+        """
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            cached = self.payloads.get((key, fmt))
+            if cached is not None and cached[0] == version:
+                self.payloads.move_to_end((key, fmt))
+                return cached[1], cached[2]
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        etag = f'"{hashlib.sha1(content).hexdigest()[:20]}-{fmt}"'
+        body = content if fmt == 'parquet' else encode_sheet(pq.read_table(io.BytesIO(content)), fmt)
+
+        with self.lock:
+            self.payloads[(key, fmt)] = (version, body, etag)
+            self.payloads.move_to_end((key, fmt))
+            while len(self.payloads) > self.max_payloads:
+                self.payloads.popitem(last=False)
+        return body, etag
+
+
+def export_panel(store, keys, path):
+    """
+    저장된 표들을 (corp_code, period) index 의 panel 하나로 쌓아 parquet 으로 저장
+    """
+    frames = {key[0]: store.read(key) for key in keys}
+    frames = {corp_code: df for corp_code, df in frames.items() if df is not None}
+    if len(frames) == 0:
+        return 0
+    panel = pd.concat(frames.values(), keys=frames.keys(), names=['corp_code', 'period'])
+    panel.attrs['units'] = next(iter(frames.values())).attrs.get('units', {})
+    pq.write_table(sheet_table(panel), path, compression='zstd')
+    return len(panel)
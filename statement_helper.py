@@ -1,39 +1,158 @@
+import re
+
 import dart_fss as dart
 import OpenDartReader
 import pandas as pd
 import numpy as np
-from pandas.api.types import is_numeric_dtype
 
+from cache_helper import cached_opendart
 from dividend_helper import yearly_dividends_from_dart, yearly_dividends
+from plan_helper import iter_covering
+from profile_helper import profiled
+from scheduler_helper import run_in_order, run_as_completed
 from share_helper import yearly_share_volume, yearly_share_prices
+from store_helper import frame_to_facts
 
 
-def safe_df_append(merged, df):
-    if df is not None:
-        if merged is None:
-            merged = df
-        else:
-            merged = merged.append(df)
-    return merged
+@profiled('statement.combine_by_precedence')
+def combine_by_precedence(frames):
+    """
+    같은 기간의 값이 여러 frame 에 있으면 앞의 frame 의 값을 사용
+    row 가 아닌 값 단위로 고르므로 앞의 frame 에 없는(NaN) 계정은 뒤의 frame 의 값으로 채워짐
+
+    :param frames: 우선순위 순서의 DataFrame 들, None 은 무시
+    :return: 한번에 만든 DataFrame, frame 이 없으면 None
+    """
+    frames = [df for df in frames if df is not None and len(df) > 0]
+    if len(frames) == 0:
+        return None
+    name = frames[0].index.name or 'year'
+    stacked = pd.concat(frames, keys=range(len(frames)), names=['precedence', name])
+    # groupby.first 는 그룹 안의 순서(= 우선순위)대로 NaN 이 아닌 첫 값을 고름
+    return stacked.groupby(level=name, sort=True).first()
+
+
+@profiled('statement.align_sources')
+def align_sources(sources):
+    """
+    기간 index 의 DataFrame 들(재무, 주가, 주식수, 배당 ...)을 한번의 outer join 으로 붙임
+    같은 column 이 여러 source 에 있으면 앞의 source 의 것을 사용
+    """
+    frames = []
+    seen = set()
+    for df in sources:
+        if df is None or len(df.columns) == 0:
+            continue
+        columns = [c for c in df.columns if c not in seen]
+        seen.update(columns)
+        frames.append(df[columns])
+    return pd.concat(frames, axis=1, join='outer', sort=True)
+
+
+def _literals(value):
+    """
+    조건값은 문자열(부분일치) 또는 문자열들의 tuple(그 중 하나라도 부분일치)
+    정규식이 아닌 문자 그대로 비교하므로 괄호, 따옴표 등이 있어도 됨
+    """
+    return tuple(value) if isinstance(value, (tuple, list)) else (value,)
+
+
+def compile_accounts(accounts):
+    """
+    get_accounts() 의 조건들을 한번만 해석해 둔 matcher
+    같은 (column, 값) 패턴은 여러 계정, 조건에서 쓰여도 한번만 계산됨
+
+    :return: {'patterns': [(column, literals), ...],
+              'accounts': [(label, [[pattern index, ...] 조건별]), ...]}
+    """
+    patterns = {}
+    compiled = []
+    for account in accounts:
+        conditions = []
+        for condition in account['conditions']:
+            conditions.append([patterns.setdefault((k, _literals(v)), len(patterns)) for k, v in condition.items()])
+        compiled.append((account['label'], conditions))
+    return {'patterns': list(patterns), 'accounts': compiled}
+
+
+_matchers = {}
+
+
+def account_matcher(accounts):
+    key = repr(accounts)
+    if key not in _matchers:
+        _matchers[key] = compile_accounts(accounts)
+    return _matchers[key]
 
 
-def _conditional_exp(condition):
-    exprs = []
-    for k, v in condition.items():
-        exprs.append(f"(df['{k}'].str.contains('{v}'))")
-    s = ' & '.join(exprs)
-    return s
+_regexes = {}
+
+
+def _regex(literals):
+    # 문자 그대로의 부분일치들을 하나의 정규식으로, 한번만 compile
+    if literals not in _regexes:
+        _regexes[literals] = re.compile('|'.join(re.escape(e) for e in literals))
+    return _regexes[literals]
+
+
+def pattern_masks(df, matcher):
+    """
+    column 마다 한번만 factorize 하고 패턴은 고유값들에만 비교한 뒤 코드로 펼침
+
+    :return: (패턴수, row 수) 의 bool 배열, 조건은 패턴 index 들의 AND
+    """
+    masks = np.zeros((len(matcher['patterns']), len(df)), dtype=bool)
+    factorized = {}
+    for i, (column, literals) in enumerate(matcher['patterns']):
+        if column not in df.columns:
+            continue
+        if column not in factorized:
+            # 고유값들을 '\0' 으로 이은 문자열 하나로 만들어 패턴마다 한번만 훑음
+            codes, uniques = pd.factorize(df[column])
+            uniques = [u if isinstance(u, str) else '' for u in uniques.tolist()]
+            starts = np.cumsum([0] + [len(u) + 1 for u in uniques[:-1]])
+            factorized[column] = codes, '\0'.join(uniques), starts
+        codes, text, starts = factorized[column]
+        found = [m.start() for m in _regex(literals).finditer(text)]
+        hit = np.zeros(len(starts) + 1, dtype=bool)  # 결측값(코드 -1)은 마지막 False
+        hit[np.searchsorted(starts, found, side='right') - 1] = True
+        masks[i] = hit[codes]
+    return masks
+
+
+@profiled('statement.resolve_accounts')
+def resolve_accounts(df, matcher):
+    """
+    모든 계정을 한번에 찾음, 계정마다 먼저 나열된 조건이 우선하며 그 조건을 만족하는 첫번째 row 를 사용
+
+    :param df: finstate DataFrame (account_id, account_nm, account_detail column)
+    :param matcher: compile_accounts() 의 결과
+    :return: {label: (조건 순번, 조건을 만족하는 row 위치 배열)}, 찾지 못한 계정은 없음
+    """
+    if df is None or len(df) == 0:
+        return {}
+
+    masks = pattern_masks(df, matcher)
+
+    resolved = {}
+    for label, conditions in matcher['accounts']:
+        for i, condition in enumerate(conditions):
+            rows = np.flatnonzero(masks[condition].all(axis=0))
+            if len(rows) > 0:
+                resolved[label] = (i, rows)
+                break
+    return resolved
 
 
 def account_meet_conditions(df, conditions):
-    for c in conditions:
-        r = df[eval(_conditional_exp(c))]
-        if len(r) > 0:
-            print(f'{_conditional_exp(c)} 을 찾음')
-            return r
-        else:
-            pass
-            # print(f'{_conditional_exp(c)} 를 만족하는 row 는 없음')
+    """
+    conditions 중 처음으로 만족하는 조건의 row 들, 없으면 None
+    """
+    resolved = resolve_accounts(df, compile_accounts([{'label': '', 'conditions': conditions}]))
+    if '' in resolved:
+        i, rows = resolved['']
+        print(f'{conditions[i]} 을 찾음')
+        return df.iloc[rows]
     return None
 
 
@@ -74,26 +193,43 @@ def pick_common_columns(picking_columns, all_columns):
     return list(set(all_columns) & set(picking_columns))
 
 
+def _amount(e):
+    if e is None or (isinstance(e, float) and np.isnan(e)):
+        return 0
+    e = str(e).replace(',', '').strip()
+    return int(e) if len(e) > 0 else 0
+
+
+def account_values(account_row, year, quarter=None):
+    """
+    사업보고서는 {2020: 당기, 2019: 전기, 2018: 전전기}, 분기보고서는 {'2020.1Q': 당기} 형식
+
+    :param account_row: thstrm_amount, frmtrm_amount, bfefrmtrm_amount 를 가진 row
+    """
+    if quarter is not None:
+        return {f'{year}.{quarter}': _amount(account_row['thstrm_amount'])}
+    return {year - i: _amount(account_row[column])
+            for i, column in enumerate(['thstrm_amount', 'frmtrm_amount', 'bfefrmtrm_amount'])}
+
+
+@profiled('statement.finstate_in_year')
 def finstate_in_year(stock_code, year, accounts, opendart):
 
     finstate = opendart.finstate_all(stock_code, year)
 
-    if finstate is None:
+    if finstate is None or finstate.empty:
         print(f'{stock_code}, {year}년 데이터를 가져올 수 없습니다. ')
         return None
 
+    resolved = resolve_accounts(finstate, account_matcher(accounts))
+
     series = []
     for account in accounts:
-        account_row = account_meet_conditions(finstate, account['conditions'])
-        if account_row is not None:
-
-            this_year = account_row.iloc[0]['thstrm_amount']
-            prev_year = account_row.iloc[0]['frmtrm_amount']
-            penultimate_year = account_row.iloc[0]['bfefrmtrm_amount']
+        if account['label'] in resolved:
+            account_row = finstate.iloc[resolved[account['label']][1][0]]
 
             # {2020: 1017050375182, 2019: 1000259401598, 2018: 1045526121935} 의 형식으로 만듦
-            info = {year-i: int(e) if len(e.strip()) > 0 else 0
-                    for i, e in enumerate([this_year, prev_year, penultimate_year])}
+            info = account_values(account_row, year)
 
             s = pd.Series(info, name=account['label'])
             s.index.name = 'year'
@@ -102,84 +238,137 @@ def finstate_in_year(stock_code, year, accounts, opendart):
             pass
             # print(f"[{account['label']} : {account['conditions']}] not exist!")
 
-    return pd.DataFrame({s.name: s for s in series})
+    df = pd.DataFrame({s.name: s for s in series})
+    df.attrs['rcept_no'] = finstate['rcept_no'].iloc[0]
+    return df
 
 
-def yearly_finstate(stock_code, start, end, accounts, opendart):
-    mdf = None
-    for year in range(start, end + 1):
-        df = finstate_in_year(stock_code, year, accounts, opendart)
-        mdf = safe_df_append(mdf, df)
+def filings_frame(stock_code, filings, store=None):
+    """
+    [(보고서 연도, 계정값), ...] 을 최근 보고서의 값이 우선하도록 합침
+    store 가 주어지면 가져온 값을 facts 로 저장
+    """
+    frames = [df for _, df in sorted(filings, key=lambda e: e[0], reverse=True)]  # 최근 보고서 순
+    if store is not None and len(frames) > 0:
+        # store 는 같은 키의 나중 값을 사용하므로 오래된 보고서부터 씀
+        store.write(pd.concat([frame_to_facts(df, stock_code, df.attrs.get('rcept_no')) for df in frames[::-1]]))
 
-    mdf = mdf[~mdf.index.duplicated(keep='first')]
-    return mdf
+    return combine_by_precedence(frames)
 
 
-def financial_statement(company, end, odr, start):
+# 계정(get_accounts)이 아닌 column 의 단위, 계정값은 모두 'KRW', 둘 다 아니면 단위 없음
+COLUMN_UNITS = {'주가': 'KRW/share',
+                '보통주': 'shares', '우선주': 'shares', '주식수': 'shares',
+                '주당순이익': 'KRW/share', '주당 현금배당금(원)': 'KRW/share', '현금배당수익률(%)': '%',
+                'ROE': 'ratio', 'BPS': 'KRW/share',
+                '보고서': 'url'}
+
+# 단위별 dtype, 금액은 조 단위에서도 원 단위까지 정확하도록 float64
+UNIT_DTYPES = {'KRW': 'float64', 'KRW/share': 'float32', 'shares': 'Int64', '%': 'float32', 'ratio': 'float32'}
 
-    accounts = get_accounts()
-    mdf = yearly_finstate(company.corp_code, start, end, accounts, odr)
 
-    denominating_columns = [e['label'] for e in accounts]
-    common_denominating_columns = pick_common_columns(denominating_columns, mdf.columns)
+@profiled('statement.typed_frame')
+def typed_frame(df, accounts):
+    """
+    계산 결과를 단위별 숫자 dtype 으로 바꾸고 계정 순서(order)대로 column 을 정렬
+    단위는 df.attrs['units'] 에 {column: 단위} 로 남기며, 표시 형식은 display_helper 에서 정함
+    단위를 모르는 column 은 units 에 넣지 않음
+    """
+    orders = {e['label']: e['order'] for e in accounts}
+    columns = sorted([c for c in df.columns if c in orders], key=lambda c: orders[c])
+    columns += [c for c in df.columns if c not in orders]
+    df = df[columns].copy()
+
+    units = {}
+    for column in columns:
+        # 계정도 COLUMN_UNITS 에도 없는 column 은 단위를 모르므로 dtype 을 바꾸지 않고 표시도 그대로
+        unit = COLUMN_UNITS.get(column, 'KRW' if column in orders else None)
+        if unit is None:
+            continue
+        dtype = UNIT_DTYPES.get(unit)
+        if dtype is not None:
+            values = pd.to_numeric(df[column], errors='coerce')
+            df[column] = values.round().astype(dtype) if dtype == 'Int64' else values.astype(dtype)
+        units[column] = unit
+    df.attrs['units'] = units
+    return df
+
+
+@profiled('statement.yearly_company_performance')
+def yearly_company_performance(company, start, end, odr, max_workers=None, store=None):
+    """
+    연간 계정값, 주가, 주식수, 배당, ROE, BPS 를 숫자 그대로 담은 DataFrame (단위는 attrs['units'])
+    """
+    *_, (_, sheet) = yearly_company_performance_stream(company, start, end, odr, max_workers, store)
+    return sheet
 
-    for column in common_denominating_columns:
-        order = next(item for item in accounts if item["label"] == column)['order']
-        new_col_name = f'{order}.{column}(억)'
-        mdf[new_col_name] = mdf[column] / 100000000
-        mdf[new_col_name] = mdf[new_col_name].map('{:,.0f}'.format)
 
-    mdf = mdf[sorted(mdf.columns.tolist())]
+@profiled('statement.yearly_company_performance_stream')
+def yearly_company_performance_stream(company, start, end, odr, max_workers=None, store=None):
+    """
+    yearly_company_performance 를 받는 대로 나눠서 (보고서 연도, 조각) 으로 yield
+    사업보고서마다 그 보고서에 있는 연도의 계정값을 먼저, 마지막에 주가, 주식수, 배당, ROE, BPS 까지 채운 전체를
+    (None, 표) 로 yield, 조각들은 collect_sheet 로 합치며 마지막 조각이 yearly_company_performance 의 결과와 같음
+    """
+    odr = cached_opendart(odr)
+    accounts = get_accounts()
 
-    return mdf, common_denominating_columns
+    labels = [e['label'] for e in accounts]
+    mdf = store.company_frame(company.corp_code, start, end, labels=labels) if store is not None else None
+    if mdf is None:
+        filings = []
+        for year, df in iter_covering(start, end,
+                                      lambda y: finstate_in_year(company.corp_code, y, accounts, odr),
+                                      max_workers=max_workers):
+            filings.append((year, df))
+            yield year, typed_frame(df, accounts)
+        mdf = filings_frame(company.corp_code, filings, store)
 
+    yield None, _yearly_sheet(company, start, end, odr, typed_frame(mdf, accounts), max_workers, store)
 
-def yearly_company_performance(company, start, end, odr):
 
+def _yearly_sheet(company, start, end, odr, mdf, max_workers=None, store=None):
     dividend_criteria = [{'se': '주당순이익'}, {'se': '주당 현금배당금(원)'},
                          {'se': '현금배당수익률(%)'}]
 
-    annual_dividends = yearly_dividends(yearly_dividends_from_dart(company.corp_code, start, end), dividend_criteria)
+    annual_dividends = yearly_dividends(yearly_dividends_from_dart(company.corp_code, start, end, max_workers),
+                                        dividend_criteria)
     annual_share_prices = yearly_share_prices(company.stock_code, start, end)
-    annual_share_volume = yearly_share_volume(company.stock_code, start, end, odr)
+    annual_share_volume = yearly_share_volume(company.stock_code, start, end, odr, max_workers)
 
-    mdf, common_denominating_columns = financial_statement(company, end, odr, start)
+    if store is not None:
+        for df in [annual_dividends, annual_share_prices.drop(columns=['주가날짜']), annual_share_volume]:
+            store.write(frame_to_facts(df, company.corp_code))
 
-    mdf = pd.merge(mdf, annual_share_prices, on='year', how='outer')
-    mdf = pd.merge(mdf, annual_share_volume, on='year', how='outer')
-    mdf = pd.merge(mdf, annual_dividends, on='year', how='outer')
-    mdf.drop(['주가날짜'], axis=1, inplace=True)
-    mdf.sort_index(axis=0, inplace=True)
-    mdf.fillna(0, inplace=True)
+    # 재무 > 주가 > 주식수 > 배당 순으로 우선
+    mdf = align_sources([mdf, annual_share_prices.drop(columns=['주가날짜']), annual_share_volume,
+                         annual_dividends])
 
     if {'지배기업소유주당기순이익', '지배기업소유주자본'}.issubset(mdf.columns):
         mdf['ROE'] = mdf['지배기업소유주당기순이익'] / mdf['지배기업소유주자본'].rolling(min_periods=1, window=2).mean()
-        mdf['ROE'] = mdf['ROE'].map('{:,.1%}'.format)
 
     # BPS(Book value per share)
     if {'지배기업소유주자본', '주식수'}.issubset(mdf.columns):
-        mdf['BPS'] = mdf['지배기업소유주자본'].div(mdf['주식수'].replace({0: np.nan}))
-        mdf['BPS'] = mdf['BPS'].map('{:,.0f}'.format)
+        mdf['BPS'] = mdf['지배기업소유주자본'].div(mdf['주식수'].astype('float64').replace({0: np.nan}))
 
-    mdf.drop(common_denominating_columns, axis=1, inplace=True)
+    return typed_frame(mdf, get_accounts())
 
-    return mdf
 
+def collect_sheet(parts, accounts=None):
+    """
+    *_stream 이 yield 한 (보고서, 조각) 들을 하나의 표로
+    보고서는 받는 순서와 상관없이 최근 보고서(정정된 수치)의 값이 우선하고, 보고서가 None 인 조각은
+    모든 보고서를 합친 전체 표라서 가장 우선함
 
-# def yearly_finstate(stock_code, start, end, accounts, opendart):
-#     merged = None
-#     for year in range(end, start - 1, -3):
-#         df = finstate_in_year(stock_code, year, accounts, opendart)
-#         if df is not None:
-#             if merged is None:
-#                 merged = df
-#             else:
-#                 merged = merged.append(df)
-#
-#     return merged
+    :return: typed DataFrame, 조각이 없으면 None
+    """
+    parts = sorted(parts, key=lambda e: (e[0] is None, e[0] or 0), reverse=True)
+    mdf = combine_by_precedence([df for _, df in parts])
+    return None if mdf is None else typed_frame(mdf, accounts or get_accounts())
 
 
-def finstate_in_quarter(stock_code, year, accounts, opendart):
+@profiled('statement.finstate_in_quarter')
+def finstate_in_quarter(stock_code, year, accounts, opendart, max_workers=None):
     '''
     reprt_code = [
     '11011' = 사업보고서, 4Q
@@ -194,67 +383,100 @@ def finstate_in_quarter(stock_code, year, accounts, opendart):
     :return:
     '''
 
-    reprt_code = {'11013': '1Q', '11012': '2Q',  '11014': '3Q', '11011': '4Q'}
+    dfs = run_in_order(lambda code: finstate_of_report(stock_code, year, code, accounts, opendart),
+                       REPRT_CODES, max_workers)
+    dfs = [df for df in dfs if df is not None]
 
-    dfs = []
-    for code, quarter in reprt_code.items():
+    return None if len(dfs) == 0 else pd.concat(dfs, axis=0).sort_index(axis=0)
 
-        finstate = opendart.finstate_all(stock_code, year, reprt_code=code)
 
-        if finstate is not None:
-            series = []
-            for account in accounts:
-                if account['label'] == '보고서':
-                    sub_docs = opendart.sub_docs(finstate['rcept_no'][0], match='사업의 내용')
-                    _url = sub_docs.iloc[0]['url']
-                    #_url = f'<a href="{_url}">보고서</a>'
-                    info = {f'{year}.{quarter}': _url}
-                    s = pd.Series(info, name='보고서')
-                    s.index.name = 'year'
-                    series.append(s)
-                else:
-                    account_row = account_meet_conditions(finstate, account['conditions'])
-                    if account_row is not None:
-                        this_year = account_row.iloc[0]['thstrm_amount']
-                        info = {f'{year}.{quarter}': int(this_year) if len(this_year) > 0 else 0}
+REPRT_CODES = {'11013': '1Q', '11012': '2Q',  '11014': '3Q', '11011': '4Q'}
 
-                        s = pd.Series(info, name=account['label'])
-                        s.index.name = 'year'
-                        series.append(s)
 
-            dfs.append(pd.DataFrame({s.name: s for s in series}))
+@profiled('statement.finstate_of_report')
+def finstate_of_report(stock_code, year, code, accounts, opendart):
+    """
+    한 보고서(reprt_code)의 계정값, index 는 '2021.1Q' 형식
+    """
+    quarter = REPRT_CODES[code]
+    finstate = opendart.finstate_all(stock_code, year, reprt_code=code)
 
-    return None if len(dfs) == 0 else pd.concat(dfs, axis=0).sort_index(axis=0)
+    if finstate is None or finstate.empty:
+        return None
 
+    resolved = resolve_accounts(finstate, account_matcher(accounts))
 
-def quarterly_company_performance(company, start, end, odr):
-    accounts = get_accounts()
-    mdf = None
-    for year in range(start, end+1):
-        df = finstate_in_quarter(company.stock_code, year, accounts, odr)
-        mdf = safe_df_append(mdf, df)
+    series = []
+    for account in accounts:
+        if account['label'] == '보고서':
+            sub_docs = opendart.sub_docs(finstate['rcept_no'][0], match='사업의 내용')
+            _url = sub_docs.iloc[0]['url']
+            #_url = f'<a href="{_url}">보고서</a>'
+            info = {f'{year}.{quarter}': _url}
+            s = pd.Series(info, name='보고서')
+            s.index.name = 'year'
+            series.append(s)
+        else:
+            if account['label'] in resolved:
+                info = account_values(finstate.iloc[resolved[account['label']][1][0]], year, quarter)
 
-    if mdf is not None:
-        for column in mdf:
-            order = next(item for item in accounts if item["label"] == column)['order']
-            if is_numeric_dtype(mdf[column]):
-                new_col_name = f'{order}.{column}(억)'
-                mdf[new_col_name] = mdf[column] / 100000000
-                mdf[new_col_name] = mdf[new_col_name].map('{:,.0f}'.format)
-            else:
-                new_col_name = f'{order}.{column}'
-                mdf[new_col_name] = mdf[column]
-
-        mdf = mdf[sorted(mdf.columns.tolist())]
-        denominating_columns = [e['label'] for e in accounts]
-        mdf.drop(denominating_columns, axis=1, inplace=True)
-    else:
+                s = pd.Series(info, name=account['label'])
+                s.index.name = 'year'
+                series.append(s)
+
+    df = pd.DataFrame({s.name: s for s in series})
+    df.attrs['rcept_no'] = finstate['rcept_no'].iloc[0]
+    return df
+
+
+@profiled('statement.quarterly_company_performance')
+def quarterly_company_performance(company, start, end, odr, max_workers=None, store=None):
+    """
+    분기별 계정값을 숫자 그대로 담은 DataFrame (단위는 attrs['units']), 데이터가 없으면 안내 문자열
+    store(FactStore) 에 [start, end] 의 모든 연도가 있으면 네트워크 대신 store 에서 읽고,
+    없으면 가져온 값을 store 에 저장
+    """
+    mdf = collect_sheet(list(quarterly_company_performance_stream(company, start, end, odr, max_workers, store)))
+    if mdf is None:
         #print(f'Can not retrieve {company.corp_name} data')
         mdf = f'Can not retrieve {company.corp_name} data'
     return mdf
 
 
+@profiled('statement.quarterly_company_performance_stream')
+def quarterly_company_performance_stream(company, start, end, odr, max_workers=None, store=None):
+    """
+    quarterly_company_performance 를 분기 보고서를 받는 대로 한 분기씩 (연도.분기, 조각) 으로 yield,
+    store 에서 읽으면 (None, 전체 표) 하나, 조각들은 collect_sheet 로 합침
+    """
+    odr = cached_opendart(odr)
+    accounts = get_accounts()
+
+    labels = [e['label'] for e in accounts]
+    mdf = store.company_frame(company.corp_code, start, end, quarterly=True, labels=labels) \
+        if store is not None else None
+    if mdf is not None:
+        yield None, typed_frame(mdf, accounts)
+        return
+
+    # 연도 x 보고서 전체를 한번에 스케쥴링, 결과는 받는 순서대로
+    periods = [(year, code) for year in range(start, end + 1) for code in REPRT_CODES]
+    reports = []
+    for (year, code), df in run_as_completed(
+            lambda p: finstate_of_report(company.stock_code, p[0], p[1], accounts, odr), periods, max_workers):
+        if df is not None and len(df) > 0:
+            report = f'{year}.{REPRT_CODES[code]}'
+            reports.append((report, df))
+            yield report, typed_frame(df, accounts)
+
+    if store is not None and len(reports) > 0:
+        # store 는 같은 키의 나중 값을 사용하므로 오래된 보고서부터 씀
+        store.write(pd.concat([frame_to_facts(df, company.corp_code, df.attrs.get('rcept_no'))
+                               for _, df in sorted(reports, key=lambda e: e[0])]))
+
+
 def get_accounts():
+    # 조건값은 부분일치 문자열, tuple 은 그 중 하나라도 일치하면 됨
     return [{'label': '매출액', 'order': 1,
              'conditions': [{'account_nm': '매출액'},
                             {'account_id': 'ifrs-full_Revenue'},
@@ -266,16 +488,16 @@ def get_accounts():
                             {'account_id': 'ifrs_ProfitLossAttributableToOwnersOfParent'},#금호고속
                             {'account_nm': '당기순이익', 'account_detail': '지배기업의 소유주'},
                             {'account_nm': '당기순이익', 'account_detail': '지배기업 소유주'},
-                            {'account_nm': '당기순이익', 'account_detail': '지배지분 | 이익잉여금'},
+                            {'account_nm': '당기순이익', 'account_detail': ('지배지분 ', ' 이익잉여금')},
                             {'account_nm': '분기순이익', 'account_detail': '지배기업의 소유주'},
                             {'account_nm': '분기순이익', 'account_detail': '지배기업 소유주'},
-                            {'account_nm': '분기순이익', 'account_detail': '지배지분 | 이익잉여금'}, #SK가스
+                            {'account_nm': '분기순이익', 'account_detail': ('지배지분 ', ' 이익잉여금')}, #SK가스
                             {'account_nm': '분기순손익', 'account_detail': '지배기업의 소유주'}, #금호고속
                             {'account_nm': '분기순손실', 'account_detail': '지배기업의 소유주'},
                             {'account_nm': '분기연결순이익', 'account_detail': '지배기업의 소유주'}, #SK이노베이션
                             {'account_nm': '반기순이익', 'account_detail': '지배기업의 소유주'},  # ifrs_ProfitLoss
                             {'account_nm': '반기순이익', 'account_detail': '지배기업 소유주'},
-                            {'account_nm': '반기순이익', 'account_detail': '지배지분 | 이익잉여금'},
+                            {'account_nm': '반기순이익', 'account_detail': ('지배지분 ', ' 이익잉여금')},
                             {'account_id': 'ifrs_ProfitLoss', 'account_detail': '지배기업의 소유주'},
                             {'account_id': 'ifrs_ProfitLoss', 'account_detail': '지배기업 소유주'},
 
@@ -311,7 +533,7 @@ def get_accounts():
 def test():
     from key import api_key
     dart.set_api_key(api_key=api_key)
-    opendartreader = OpenDartReader(api_key)
+    opendartreader = cached_opendart(OpenDartReader(api_key))
     corp_list = dart.get_corp_list()
     #df = yearly_company_performance(corp_list.find_by_corp_name('AJ네트웍스', exactly=True)[0], 2015, 2020, opendartreader)
 
@@ -0,0 +1,194 @@
+import os
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+DEFAULT_STORE_PATH = os.path.join('docs_cache', 'facts')
+
+QUARTER_REPRT_CODES = {'1Q': '11013', '2Q': '11012', '3Q': '11014', '4Q': '11011'}
+
+# 재무, 배당, 주식수, 주가 등을 모두 같은 long format 으로 저장
+FACT_SCHEMA = pa.schema([('corp_code', pa.string()),
+                         ('period', pa.string()),       # '2020' 또는 '2020.1Q'
+                         ('year', pa.int32()),          # partition column
+                         ('reprt_code', pa.string()),
+                         ('label', pa.string()),
+                         ('value', pa.float64()),
+                         ('text', pa.string()),         # 보고서 url 처럼 숫자가 아닌 값
+                         ('rcept_no', pa.string()),
+                         ('fetched', pa.float64())])
+
+FACT_KEY = ['corp_code', 'period', 'reprt_code', 'label']
+
+
+def period_year(period):
+    return int(str(period)[:4])
+
+
+def period_reprt_code(period):
+    """
+    '2020' -> '11011'(사업보고서), '2020.1Q' -> '11013'
+    """
+    period = str(period)
+    return QUARTER_REPRT_CODES[period.split('.')[1]] if '.' in period else '11011'
+
+
+def frame_to_facts(df, corp_code, rcept_no=None):
+    """
+    period 를 index 로, 계정(label)을 column 으로 가진 DataFrame 을 long format facts 로 바꿈
+
+    :param rcept_no: 접수번호, 문자열 하나 또는 {period: rcept_no}
+    """
+    if df is None or len(df) == 0:
+        return pd.DataFrame(columns=FACT_SCHEMA.names)
+
+    long = df.rename_axis('period').reset_index().melt(id_vars='period', var_name='label', value_name='raw')
+    long = long[long['raw'].notna()]
+    long['period'] = long['period'].astype(str)
+
+    numeric = pd.to_numeric(long['raw'], errors='coerce')
+    facts = pd.DataFrame({'corp_code': corp_code,
+                          'period': long['period'],
+                          'year': long['period'].map(period_year).astype('int32'),
+                          'reprt_code': long['period'].map(period_reprt_code),
+                          'label': long['label'].astype(str),
+                          'value': numeric.astype('float64'),
+                          'text': long['raw'].astype(str).where(numeric.isna(), None),
+                          'rcept_no': long['period'].map(rcept_no) if isinstance(rcept_no, dict) else rcept_no,
+                          'fetched': time.time()})
+    return facts.reset_index(drop=True)
+
+
+class FactStore:
+    """
+    year 로 partition 된 Parquet facts 저장소
+    조회는 partition(year) 과 row group 통계(corp_code)로 필요한 부분만 memory map 하여 읽음
+    """
+
+    def __init__(self, root=DEFAULT_STORE_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def write(self, facts):
+        if facts is None or len(facts) == 0:
+            return 0
+        table = pa.Table.from_pandas(facts[FACT_SCHEMA.names], schema=FACT_SCHEMA, preserve_index=False)
+        pq.write_to_dataset(table, self.root, partition_cols=['year'],
+                            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                            existing_data_behavior='overwrite_or_ignore')
+        return len(facts)
+
+    def _is_empty(self):
+        return not any(name.startswith('year=') for name in os.listdir(self.root))
+
+    def read(self, corp_codes=None, start=None, end=None, reprt_codes=None, labels=None):
+        """
+        조건에 맞는 facts, 같은 (corp_code, period, reprt_code, label) 은 마지막에 저장된 값을 사용
+        """
+        if self._is_empty():
+            return pd.DataFrame(columns=FACT_SCHEMA.names)
+
+        filters = []
+        if start is not None:
+            filters.append(('year', '>=', int(start)))
+        if end is not None:
+            filters.append(('year', '<=', int(end)))
+        if corp_codes is not None:
+            filters.append(('corp_code', 'in', list(corp_codes)))
+        if reprt_codes is not None:
+            filters.append(('reprt_code', 'in', list(reprt_codes)))
+        if labels is not None:
+            filters.append(('label', 'in', list(labels)))
+
+        table = pq.read_table(self.root, filters=filters or None, memory_map=True, partitioning='hive')
+        facts = table.to_pandas()
+        if len(facts) == 0:
+            return facts
+        facts['year'] = facts['year'].astype('int32')
+        facts = facts.sort_values('fetched', kind='stable').drop_duplicates(FACT_KEY, keep='last')
+        return facts.reset_index(drop=True)
+
+    def query(self, corp_codes=None, start=None, end=None, reprt_codes=None, labels=None):
+        """
+        (corp_code, period) index, label column 의 wide panel
+        """
+        facts = self.read(corp_codes, start, end, reprt_codes, labels)
+        if len(facts) == 0:
+            return pd.DataFrame()
+
+        values = facts['value'].astype(object).where(facts['value'].notna(), facts['text'])
+        panel = facts.assign(v=values).pivot(index=['corp_code', 'period'], columns='label', values='v')
+        panel.columns.name = None
+        for column in panel.columns:
+            if not panel[column].map(lambda e: isinstance(e, str)).any():
+                panel[column] = pd.to_numeric(panel[column])
+        return panel
+
+    def company_frame(self, corp_code, start, end, quarterly=False, labels=None):
+        """
+        finstate_in_year/finstate_in_quarter 를 이어 붙인 것과 같은 모양의 DataFrame
+        [start, end] 의 모든 연도가 저장되어 있지 않으면 None
+
+        :param quarterly: True 이면 '2020.1Q' 형식의 분기 데이터, 아니면 연간 데이터
+        :param labels: 읽을 계정 label 들 (get_accounts() 의 label), 연간 facts 에는 주가, 주식수, 배당 등도
+                       같은 reprt_code 로 저장되므로 재무제표 계정만 읽고 연도가 모두 있는지도 그 계정들로 판단
+        """
+        reprt_codes = list(QUARTER_REPRT_CODES.values()) if quarterly else ['11011']
+        # 연간 데이터는 사업보고서의 전기, 전전기 값도 함께 읽음
+        panel = self.query([corp_code], start if quarterly else start - 2, end, reprt_codes, labels)
+        if len(panel) == 0:
+            return None
+
+        df = panel.loc[corp_code]
+        is_quarter = df.index.str.contains('.', regex=False)
+        df = df[is_quarter] if quarterly else df[~is_quarter]
+        df = df.dropna(axis=0, how='all')
+        if not set(range(start, end + 1)).issubset({period_year(p) for p in df.index}):
+            return None
+
+        if not quarterly:
+            df.index = df.index.astype(int)
+        df.index.name = 'year'
+        return df.dropna(axis=1, how='all').sort_index()
+
+    def compact(self):
+        """
+        작은 파일들을 연도별로 하나씩 다시 씀
+        연도마다 새 파일을 임시 이름으로 다 쓴 뒤 바꿔치기하고 나서 예전 파일들을 지우므로
+        중간에 실패해도 facts 를 잃지 않음 (남은 중복은 read 에서 하나로 합쳐짐)
+        """
+        facts = self.read()
+        if len(facts) == 0:
+            return 0
+        schema = FACT_SCHEMA.remove(FACT_SCHEMA.get_field_index('year'))
+        for year, group in facts.groupby('year'):
+            partition = os.path.join(self.root, f'year={year}')
+            old = [f for f in os.listdir(partition) if not f.startswith('.')] if os.path.isdir(partition) else []
+            os.makedirs(partition, exist_ok=True)
+
+            name = f'part-{uuid.uuid4().hex}-0.parquet'
+            # '.' 으로 시작하는 파일은 dataset 을 읽을 때 무시됨
+            tmp_path = os.path.join(partition, f'.{name}.tmp')
+            table = pa.Table.from_pandas(group[schema.names], schema=schema, preserve_index=False)
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, os.path.join(partition, name))
+            for f in old:
+                os.remove(os.path.join(partition, f))
+        return len(facts)
+
+
+_default_store = None
+
+
+def get_store():
+    """
+    기본 facts 저장소, DART_FACTS_PATH 환경변수로 위치를 바꿀 수 있음
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = FactStore(os.environ.get('DART_FACTS_PATH', DEFAULT_STORE_PATH))
+    return _default_store
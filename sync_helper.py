@@ -0,0 +1,239 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from cache_helper import get_cache, cached_opendart, to_date
+from dividend_helper import dividend_in_year, extract_df_from_dividends_raw
+from share_helper import share_volume_in_year
+from statement_helper import get_accounts, finstate_in_year, finstate_of_report
+from store_helper import frame_to_facts
+
+
+DEFAULT_SYNC_PATH = os.path.join('docs_cache', 'sync.sqlite3')
+
+# corp_code 없이 공시목록을 조회하면 조회기간이 3개월로 제한됨
+MARKET_LIST_DAYS = 90
+
+# '사업보고서 (2020.12)', '[기재정정]분기보고서 (2021.03)' 등
+REPORT_NAME = re.compile(r'(사업|반기|분기)보고서\s*\((\d{4})\.(\d{2})\)')
+
+DIVIDEND_CRITERIA = [{'se': '주당순이익'}, {'se': '주당 현금배당금(원)'}, {'se': '현금배당수익률(%)'}]
+
+
+def parse_report_name(report_nm):
+    """
+    정기보고서 이름에서 (연도, reprt_code), 정기보고서가 아니면 None
+    12월 결산법인 기준으로 분기보고서는 3월이면 1분기, 그 외는 3분기
+    """
+    m = REPORT_NAME.search(str(report_nm))
+    if m is None:
+        return None
+    kind, year, month = m.group(1), int(m.group(2)), int(m.group(3))
+    if kind == '사업':
+        return year, '11011'
+    if kind == '반기':
+        return year, '11012'
+    return year, '11013' if month <= 6 else '11014'
+
+
+class SyncState:
+    """
+    (corp_code, year, reprt_code) 별로 마지막으로 반영한 접수번호(rcept_no)를 저장
+    """
+
+    def __init__(self, path=DEFAULT_SYNC_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS seen ('
+                         'corp_code TEXT NOT NULL, year INTEGER NOT NULL, reprt_code TEXT NOT NULL, '
+                         'rcept_no TEXT NOT NULL, report_nm TEXT, synced REAL NOT NULL, '
+                         'PRIMARY KEY (corp_code, year, reprt_code))')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def seen(self, corp_codes=None):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT corp_code, year, reprt_code, rcept_no FROM seen').fetchall()
+        seen = {(c, y, r): n for c, y, r, n in rows}
+        if corp_codes is not None:
+            corp_codes = set(corp_codes)
+            seen = {k: v for k, v in seen.items() if k[0] in corp_codes}
+        return seen
+
+    def mark(self, corp_code, year, reprt_code, rcept_no, report_nm=''):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO seen VALUES (?, ?, ?, ?, ?, ?)',
+                         (corp_code, int(year), reprt_code, rcept_no, report_nm, time.time()))
+
+    def last_synced(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key='last_synced'").fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def set_last_synced(self, day):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_synced', ?)", (day.isoformat(),))
+
+
+def _raw_opendart(opendart):
+    # 공시목록은 새 공시를 찾기 위한 것이므로 캐시를 거치지 않음
+    return getattr(opendart, 'opendart', opendart)
+
+
+def poll_filings(opendart, start, end, corp_codes=None):
+    """
+    [start, end] 에 제출된 정기공시 목록, (corp_code, year, reprt_code) 별로 가장 최근 접수번호만 남김
+
+    :param corp_codes: 주어지면 회사별로 한번씩 조회, 없으면 전체 시장을 3개월 단위로 조회
+    :return: corp_code, stock_code, year, reprt_code, rcept_no, report_nm column 의 DataFrame
+    """
+    opendart = _raw_opendart(opendart)
+    start, end = to_date(start), to_date(end)
+
+    lists = []
+    if corp_codes is not None:
+        for corp_code in corp_codes:
+            lists.append(opendart.list(corp_code, start=start.isoformat(), end=end.isoformat(), kind='A'))
+    else:
+        day = start
+        while day <= end:
+            until = min(day + timedelta(days=MARKET_LIST_DAYS - 1), end)
+            lists.append(opendart.list(start=day.isoformat(), end=until.isoformat(), kind='A'))
+            day = until + timedelta(days=1)
+
+    lists = [df for df in lists if df is not None and len(df) > 0]
+    columns = ['corp_code', 'stock_code', 'year', 'reprt_code', 'rcept_no', 'report_nm']
+    if len(lists) == 0:
+        return pd.DataFrame(columns=columns)
+
+    filings = pd.concat(lists, ignore_index=True)
+    periods = filings['report_nm'].map(parse_report_name)
+    filings = filings[periods.notna()].copy()
+    filings['year'] = [p[0] for p in periods.dropna()]
+    filings['reprt_code'] = [p[1] for p in periods.dropna()]
+    if 'stock_code' not in filings:
+        filings['stock_code'] = ''
+
+    # 접수번호는 접수일로 시작하므로 가장 큰 값이 가장 최근 (정정공시 포함)
+    filings = filings.sort_values('rcept_no').drop_duplicates(['corp_code', 'year', 'reprt_code'], keep='last')
+    return filings[columns].reset_index(drop=True)
+
+
+def changed_filings(filings, state):
+    """
+    처음 보거나 접수번호가 바뀐(정정된) 공시만 남김
+    """
+    seen = state.seen(filings['corp_code'].unique())
+    changed = [seen.get((r.corp_code, r.year, r.reprt_code)) != r.rcept_no for r in filings.itertuples()]
+    return filings[changed].reset_index(drop=True)
+
+
+def invalidate_filing(corp_code, stock_code, year, reprt_code, cache=None):
+    """
+    해당 기간의 재무, 배당, 주식수 캐시를 지움
+    :return: 지운 항목수
+    """
+    cache = cache or get_cache()
+    codes = [c for c in [corp_code, stock_code] if c]
+    removed = cache.invalidate('finstate_all', codes, year, reprt_code)
+    removed += cache.invalidate('multi_accounts', None, year, reprt_code)
+    if reprt_code == '11011':
+        removed += cache.invalidate('get_dividend', codes, year)
+        removed += cache.invalidate('shares', codes, year)
+        # 주식수를 찾는 사업보고서 목록은 해당 연도 12월부터 조회함
+        removed += cache.invalidate('list', codes, year)
+    return removed
+
+
+def refetch_filing(corp_code, stock_code, year, reprt_code, opendart, store=None, accounts=None):
+    """
+    해당 기간을 다시 가져오고 store 가 있으면 facts 로 저장
+    """
+    accounts = accounts or get_accounts()
+    facts = []
+    if reprt_code == '11011':
+        df = finstate_in_year(corp_code, year, accounts, opendart)
+        if df is not None:
+            facts.append(frame_to_facts(df, corp_code, df.attrs.get('rcept_no')))
+
+        dividend = dividend_in_year(corp_code, year)
+        for criterion in DIVIDEND_CRITERIA:
+            dividends = extract_df_from_dividends_raw([dividend] if dividend else [], criterion)
+            facts.append(frame_to_facts(dividends, corp_code))
+
+        shares = share_volume_in_year(stock_code, year, opendart) if stock_code else None
+        if shares is not None:
+            shares = pd.DataFrame({'보통주': shares[1], '우선주': shares[2], '주식수': shares[3]},
+                                  index=pd.Index([year], name='year'))
+            facts.append(frame_to_facts(shares, corp_code))
+    else:
+        # quarterly_company_performance 와 같은 캐시 키를 쓰도록 stock_code 로 요청
+        df = finstate_of_report(stock_code or corp_code, year, reprt_code, accounts, opendart)
+        if df is not None:
+            facts.append(frame_to_facts(df, corp_code, df.attrs.get('rcept_no')))
+
+    facts = [f for f in facts if len(f) > 0]
+    if store is not None and len(facts) > 0:
+        store.write(pd.concat(facts, ignore_index=True))
+    return len(facts) > 0
+
+
+def sync_filings(opendart, start=None, end=None, corp_codes=None, universe=None, store=None, state=None,
+                 refetch=True, results=None, sheets=None):
+    """
+    새 공시나 정정공시가 있는 기간만 캐시를 지우고 다시 가져옴
+
+    :param start: 공시목록 조회 시작일, 없으면 마지막 동기화일 (처음이면 7일 전)
+    :param corp_codes: 주어지면 회사별로 공시목록을 조회, 없으면 전체 시장 목록을 조회
+    :param universe: 전체 시장을 조회할 때 반영할 corp_code 들, 없으면 모두
+    :param refetch: False 이면 캐시만 지우고 접수번호를 기록 (처음 동기화 시 기준점을 만들 때)
+    :param results: ResultCache, 공시가 바뀐 회사의 계산한 표를 지움
+    :param sheets: SheetStore, 공시가 바뀐 회사의 저장한 표를 지움
+    :return: 반영한 공시 DataFrame
+    """
+    state = state or SyncState()
+    # 다시 가져온 값은 캐시에 채워 두어 다음 계산에서 사용
+    cached = cached_opendart(opendart)
+    end = to_date(end) if end else date.today()
+    start = to_date(start) if start else (state.last_synced() or end - timedelta(days=7))
+
+    filings = poll_filings(opendart, start, end, corp_codes)
+    if universe is not None:
+        filings = filings[filings['corp_code'].isin(set(universe))]
+    changed = changed_filings(filings, state)
+    print(f'[sync] {start}~{end}: 정기공시 {len(filings)}건 중 새 공시/정정 {len(changed)}건')
+
+    for r in changed.itertuples():
+        removed = invalidate_filing(r.corp_code, r.stock_code, r.year, r.reprt_code)
+        if refetch:
+            refetch_filing(r.corp_code, r.stock_code, r.year, r.reprt_code, cached, store)
+        state.mark(r.corp_code, r.year, r.reprt_code, r.rcept_no, r.report_nm)
+        print(f'[sync] {r.corp_code} {r.year} {r.reprt_code} {r.report_nm}: 캐시 {removed}건 삭제')
+
+    # 회사 표는 여러 기간의 값으로 만들어지므로 기간과 상관없이 회사 단위로 지움
+    for corp_code in changed['corp_code'].unique():
+        if results is not None:
+            results.invalidate(corp_code)
+        if sheets is not None:
+            sheets.invalidate(corp_code)
+
+    if corp_codes is None:
+        state.set_last_synced(end)
+    return changed